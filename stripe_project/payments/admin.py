@@ -1,8 +1,28 @@
 from django import forms
 from django.contrib import admin
-
-from .models import Discount, Item, Order, ShippingTax, Tax
-from .services import DiscountService, TaxService
+from django.utils import timezone
+
+from .exchange import (
+    ExchangeRateMissing,
+    exchange_rates,
+    get_settlement_currency,
+)
+from .jobs import enqueue
+from .models import (
+    Discount,
+    ExchangeRate,
+    Item,
+    JobStatus,
+    Order,
+    OrderLine,
+    PaymentAttempt,
+    ShippingTax,
+    StripeJob,
+    Tax,
+    WebhookEvent,
+)
+from .pricing import rebuild_orders_totals
+from .services import ExchangeRateService
 
 admin.site.empty_value_display = "-"
 
@@ -11,40 +31,68 @@ admin.site.empty_value_display = "-"
 class ItemAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "description", "price", "currency")
     list_display_links = ("name",)
-    readonly_fields = ("id",)
+    readonly_fields = ("id", "stripe_product_id", "stripe_price_id")
     search_fields = ("name",)
 
 
 class OrderForm(forms.ModelForm):
     class Meta:
         model = Order
-        fields = ["items", "discount", "tax", "shipping"]
+        fields = ["discount", "tax", "shipping"]
 
-    def clean_items(self):
-        values = self.cleaned_data["items"]
-        currencies = set([item.currency for item in values])
-        if len(currencies) > 1:
-            raise forms.ValidationError(
-                "Items in the order have different currencies."
-            )
-        return values
 
+class OrderLineFormSet(forms.BaseInlineFormSet):
     def clean(self):
-        values = self.cleaned_data["items"]
-        shipping = self.cleaned_data["shipping"]
-        currencies = set([item.currency for item in values])
+        """Проверяет наличие курсов пересчета валют товаров и доставки
+        в валюту расчетов заказа."""
+        super().clean()
+        currencies = set(
+            form.cleaned_data["item"].currency
+            for form in self.forms
+            if form.cleaned_data.get("item")
+            and not form.cleaned_data.get("DELETE")
+        )
+        shipping = self.instance.shipping
+        settlement = get_settlement_currency(
+            currencies, shipping.currency if shipping else None
+        )
         if shipping:
             currencies.add(shipping.currency)
-        if len(currencies) > 1:
-            raise forms.ValidationError(
-                "Items and tax in the order have different currencies."
-            )
+        try:
+            exchange_rates.check(currencies, settlement)
+        except ExchangeRateMissing as e:
+            raise forms.ValidationError(str(e))
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    formset = OrderLineFormSet
+    fields = ("item", "quantity", "unit_price")
+    readonly_fields = ("unit_price",)
+    autocomplete_fields = ("item",)
+    extra = 1
 
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("pk", "discount", "tax")
+    list_display = (
+        "pk",
+        "discount",
+        "tax",
+        "items_count",
+        "final_amount",
+        "currency",
+        "status",
+        "paid_at",
+    )
+    list_filter = ("status",)
     form = OrderForm
+    inlines = (OrderLineInline,)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Позиции сохраняются формами по одной, без сигналов m2m_changed
+        rebuild_orders_totals(Order.objects.filter(pk=form.instance.pk))
 
 
 @admin.register(Discount)
@@ -56,8 +104,7 @@ class DiscountAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        coupon_id = DiscountService.generate_coupon_id(obj.id)
-        DiscountService.update_coupon(coupon_id, obj.name, obj.percent_off)
+        enqueue("discount.sync", obj.pk)
 
 
 @admin.register(Tax)
@@ -80,24 +127,8 @@ class TaxAdmin(admin.ModelAdmin):
         return self.readonly_fields
 
     def save_model(self, request, obj, form, change):
-        try:
-            TaxService.update_tax(
-                obj.tax_id,
-                obj.name,
-                obj.description,
-                obj.percentage,
-                obj.behavior,
-            )
-        except Exception:
-            # create new tax
-            tax_rate = TaxService.create_tax(
-                obj.name,
-                obj.description,
-                obj.percentage,
-                obj.behavior,
-            )
-            obj.tax_id = tax_rate.id
         super().save_model(request, obj, form, change)
+        enqueue("tax.sync", obj.pk)
 
 
 @admin.register(ShippingTax)
@@ -108,6 +139,112 @@ class ShippingTaxAdmin(admin.ModelAdmin):
     search_fields = ("name",)
 
 
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ("id", "source", "target", "rate", "updated_at")
+    list_filter = ("source", "target")
+    readonly_fields = ("updated_at",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        ExchangeRateService.rebuild_orders()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ExchangeRateService.rebuild_orders()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        ExchangeRateService.rebuild_orders()
+
+
+@admin.register(PaymentAttempt)
+class PaymentAttemptAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "order",
+        "intent_id",
+        "amount",
+        "currency",
+        "status",
+        "created_at",
+    )
+    list_filter = ("status",)
+    readonly_fields = (
+        "order",
+        "intent_id",
+        "client_secret",
+        "amount",
+        "currency",
+        "created_at",
+        "updated_at",
+    )
+    search_fields = ("intent_id",)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "event_id",
+        "type",
+        "status",
+        "attempts",
+        "next_attempt_at",
+        "received_at",
+        "processed_at",
+    )
+    list_filter = ("status", "type")
+    readonly_fields = (
+        "event_id",
+        "type",
+        "payload",
+        "attempts",
+        "error",
+        "next_attempt_at",
+        "received_at",
+        "processed_at",
+    )
+    search_fields = ("event_id",)
+
+
+@admin.register(StripeJob)
+class StripeJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "kind",
+        "object_id",
+        "status",
+        "attempts",
+        "run_after",
+        "finished_at",
+        "last_error",
+    )
+    list_filter = ("status", "kind")
+    readonly_fields = (
+        "kind",
+        "object_id",
+        "status",
+        "attempts",
+        "run_after",
+        "last_error",
+        "locked_by",
+        "locked_at",
+        "created_at",
+        "finished_at",
+    )
+    actions = ("retry",)
+
+    @admin.action(description="Повторить выбранные задачи")
+    def retry(self, request, queryset):
+        queryset.exclude(status=JobStatus.RUNNING).update(
+            status=JobStatus.PENDING,
+            attempts=0,
+            run_after=timezone.now(),
+            finished_at=None,
+        )
+
+
 admin.site.site_header = "Административная панель Stripe Payments"
 admin.site.index_title = "Настройки Stripe Payments"
 admin.site.site_title = "Административная панель Stripe Payments"
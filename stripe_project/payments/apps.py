@@ -7,3 +7,6 @@ class PaymentsConfig(AppConfig):
 
     def ready(self):
         import payments.signals  # noqa F401
+        from payments.http_client import configure_stripe_http_client
+
+        configure_stripe_http_client()
@@ -0,0 +1,11 @@
+"""Замеры производительности расчета стоимости и оформления заказов.
+
+Данные создаются функцией seed, замеры выполняются функцией run,
+регрессии относительно сохраненных результатов ищет функция compare
+(команда run_benchmarks).
+"""
+from .cases import CASES
+from .runner import compare, run
+from .seed import Dataset, seed
+
+__all__ = ["CASES", "Dataset", "compare", "run", "seed"]
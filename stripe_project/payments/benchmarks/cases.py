@@ -0,0 +1,94 @@
+from django.test import RequestFactory
+
+from payments.models import Item, Order
+from payments.page_cache import page_cache
+from payments.payload_cache import checkout_payload_cache
+from payments.pricing import get_order_pricing
+from payments.services import OrderPaymentService
+from payments.signals import order_exchange_rate_validator
+from payments.views import OrderDetail
+
+from .seed import Dataset
+
+# Замеры: имя -> функция одного выполнения (идентификатор заказа,
+# количество позиций, набор данных)
+CASES = {}
+
+
+def case(name: str):
+    """Регистрирует замер под заданным именем."""
+
+    def decorator(func):
+        CASES[name] = func
+        return func
+
+    return decorator
+
+
+@case("final_price")
+def final_price(pk: int, size: int, dataset: Dataset):
+    Order.objects.get(pk=pk).get_final_price()
+
+
+@case("order_pricing")
+def order_pricing(pk: int, size: int, dataset: Dataset):
+    # Полный расчет по позициям заказа (пересчет итогов)
+    order = Order.objects.select_related("discount", "tax", "shipping").get(
+        pk=pk
+    )
+    get_order_pricing(order)
+
+
+@case("price_data")
+def price_data(pk: int, size: int, dataset: Dataset):
+    order = Order.objects.prefetch_related("lines__item").get(pk=pk)
+    # Позиции сессии с объединением позиций сверх ограничения stripe
+    OrderPaymentService.get_line_items(order, ["txr_bench"])
+
+
+@case("session")
+def session(pk: int, size: int, dataset: Dataset):
+    OrderPaymentService.get_session(
+        pk, success_url="/success/", cancel_url=f"/order/{pk}/"
+    )
+
+
+@case("session_payload")
+def session_payload(pk: int, size: int, dataset: Dataset):
+    # Параметры сессии без кэша данных позиций (кэш default отключен)
+    OrderPaymentService.get_session_request(
+        pk, success_url="/success/", cancel_url=f"/order/{pk}/"
+    )
+
+
+@case("session_payload_cached")
+def session_payload_cached(pk: int, size: int, dataset: Dataset):
+    # Параметры сессии с данными позиций из кэша: версии заказов и данные
+    # хранятся в кэше benchmark (кэш default отключен)
+    aliases = page_cache.alias, checkout_payload_cache.alias
+    page_cache.alias = checkout_payload_cache.alias = "benchmark"
+    try:
+        OrderPaymentService.get_session_request(
+            pk, success_url="/success/", cancel_url=f"/order/{pk}/"
+        )
+    finally:
+        page_cache.alias, checkout_payload_cache.alias = aliases
+
+
+@case("order_detail")
+def order_detail(pk: int, size: int, dataset: Dataset):
+    request = RequestFactory().get(f"/order/{pk}/")
+    OrderDetail.as_view()(request, pk=pk)
+
+
+@case("currency_validator")
+def currency_validator(pk: int, size: int, dataset: Dataset):
+    # Проверка при добавлении в заказ товаров, уже входящих в него
+    order_exchange_rate_validator(
+        sender=Order.items.through,
+        instance=Order(pk=pk),
+        action="pre_add",
+        reverse=False,
+        model=Item,
+        pk_set=set(dataset.items[:size]),
+    )
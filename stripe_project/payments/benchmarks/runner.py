@@ -0,0 +1,142 @@
+import platform
+import statistics
+import time
+from itertools import cycle
+
+import django
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from payments.gateways import get_gateway
+
+from .cases import CASES
+from .seed import Dataset
+
+# Кэш отключен (каждый замер выполняет запросы и отрисовку), платежный
+# шлюз работает в памяти процесса без задержки
+BENCHMARK_SETTINGS = {
+    "ALLOWED_HOSTS": ["testserver"],
+    "CACHES": {
+        "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        # Кэш замеров с кэшированными данными (cases.session_payload_cached)
+        "benchmark": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "benchmark",
+        },
+    },
+    "PAYMENT_GATEWAY": {"BACKEND": "payments.gateways.FakeGateway"},
+    "METRICS_ENABLED": False,
+    "STRIPE_RATE_LIMIT": {"ENABLED": False},
+    "STRIPE_CIRCUIT_BREAKER": {"ENABLED": False},
+}
+
+
+def calibrate(repeat: int = 20) -> float:
+    """Время эталонной нагрузки на Python (мс, минимум из повторов).
+
+    Используется для поправки на скорость машины при сравнении
+    с сохраненными результатами.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sorted(str(i * 7919 % 10007) for i in range(20000))
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def measure(func, pks: list[int], size: int, dataset: Dataset, repeat: int):
+    """Замер одного случая: запросы первого выполнения и время повторов.
+
+    Заказы одного размера перебираются по кругу. Перед замером каждый
+    заказ выполняется один раз (прогрев кэшей случая).
+    """
+    for pk in pks:
+        func(pk, size, dataset)
+    with CaptureQueriesContext(connection) as context:
+        func(pks[0], size, dataset)
+    timings = []
+    for pk, _ in zip(cycle(pks), range(repeat)):
+        start = time.perf_counter()
+        func(pk, size, dataset)
+        timings.append(time.perf_counter() - start)
+    return {
+        "queries": len(context),
+        "min_ms": min(timings) * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "mean_ms": statistics.mean(timings) * 1000,
+    }
+
+
+def run(dataset: Dataset, cases: list[str], repeat: int) -> dict:
+    """Выполняет замеры для всех размеров заказов набора данных.
+
+    Args:
+        dataset: Созданные товары и заказы (seed).
+        cases: Имена замеров (CASES).
+        repeat: Количество повторов каждого замера.
+    """
+    results = []
+    with override_settings(**BENCHMARK_SETTINGS):
+        get_gateway.cache_clear()
+        try:
+            for size, pks in dataset.orders.items():
+                for name in cases:
+                    results.append(
+                        {
+                            "case": name,
+                            "size": size,
+                            **measure(
+                                CASES[name], pks, size, dataset, repeat
+                            ),
+                        }
+                    )
+        finally:
+            get_gateway.cache_clear()
+    return {
+        "meta": {
+            "created": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "repeat": repeat,
+            "calibration_ms": calibrate(),
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """Возвращает описания регрессий относительно сохраненных замеров.
+
+    Регрессией считается рост минимального времени больше чем на
+    threshold (доля) или любой рост количества запросов. Минимальное
+    время меньше других оценок зависит от нагрузки на машину, время
+    сохраненных замеров приводится к скорости текущей машины по
+    эталонной нагрузке (calibration_ms).
+    """
+    scale = report["meta"]["calibration_ms"] / baseline["meta"].get(
+        "calibration_ms", report["meta"]["calibration_ms"]
+    )
+    previous = {
+        (result["case"], result["size"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        base = previous.get((result["case"], result["size"]))
+        if base is None:
+            continue
+        name = f"{result['case']}[{result['size']}]"
+        if result["queries"] > base["queries"]:
+            regressions.append(
+                f"{name}: queries {base['queries']} -> {result['queries']}"
+            )
+        if result["min_ms"] > base["min_ms"] * scale * (1 + threshold):
+            regressions.append(
+                f"{name}: min {base['min_ms'] * scale:.3f} ms -> "
+                f"{result['min_ms']:.3f} ms"
+            )
+    return regressions
@@ -0,0 +1,82 @@
+from dataclasses import dataclass, field
+
+from payments.models import (
+    Discount,
+    Item,
+    Order,
+    ShippingTax,
+    Tax,
+    TaxBehavior,
+)
+from payments.services import OrderLineService
+
+
+@dataclass
+class Dataset:
+    """Созданные для замеров объекты.
+
+    Attributes:
+        items: Идентификаторы товаров.
+        orders: Идентификаторы заказов по количеству позиций.
+    """
+
+    items: list[int] = field(default_factory=list)
+    orders: dict[int, list[int]] = field(default_factory=dict)
+
+
+def seed(
+    sizes: list[int],
+    orders: int = 1,
+    discount: bool = True,
+    tax: str = TaxBehavior.EXCLUSIVE,
+    shipping: bool = True,
+) -> Dataset:
+    """Создает товары и заказы для замеров.
+
+    Для каждого количества позиций создается orders заказов, позиции
+    заказов ссылаются на общий набор товаров.
+
+    Args:
+        sizes: Количество позиций в заказе.
+        orders: Количество заказов каждого размера.
+        discount: Прикрепить к заказам скидку.
+        tax: Тип налога заказов (inclusive, exclusive) или пустая строка.
+        shipping: Прикрепить к заказам доставку.
+    """
+    # Item унаследован от CurrencyMixin (multi-table), поэтому
+    # bulk_create для него недоступен.
+    items = [
+        Item.objects.create(
+            name=f"bench item {i}", description="benchmark", price=100 + i
+        ).pk
+        for i in range(max(sizes))
+    ]
+    relations = {
+        "discount": Discount.objects.create(name="bench", percent_off=10)
+        if discount
+        else None,
+        "tax": Tax.objects.create(
+            name="bench",
+            description="benchmark",
+            percentage=20,
+            behavior=tax,
+            tax_id="txr_bench",
+        )
+        if tax
+        else None,
+        "shipping": ShippingTax.objects.create(
+            name="bench", amount=500, code="txcd_92010001"
+        )
+        if shipping
+        else None,
+    }
+    dataset = Dataset(items=items)
+    for size in sizes:
+        dataset.orders[size] = []
+        for _ in range(orders):
+            order = Order.objects.create(**relations)
+            OrderLineService.upsert_lines(
+                order, {pk: 1 + i % 3 for i, pk in enumerate(items[:size])}
+            )
+            dataset.orders[size].append(order.pk)
+    return dataset
@@ -0,0 +1,205 @@
+import math
+import time
+from typing import Optional
+
+import stripe
+from django.conf import settings
+
+from .counters import SharedCounters
+from .metrics import registry
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """Обращения к stripe временно прекращены (цепь разомкнута).
+
+    Attributes:
+        retry_after: Время до следующей попытки (сек).
+    """
+
+    def __init__(self, retry_after: float):
+        self.retry_after = max(math.ceil(retry_after), 1)
+        super().__init__(
+            f"Payment service is unavailable, retry after "
+            f"{self.retry_after} s"
+        )
+
+
+class CircuitBreaker:
+    """Размыкатель цепи обращений к stripe, общий для процессов.
+
+    Количество обращений и ошибок (сетевые ошибки, ответы 5xx и
+    обращения дольше slow_call) учитывается по интервалам скользящего
+    окна в общих атомарных счетчиках (SharedCounters). Если доля ошибок
+    за окно достигает failure_rate (при не менее min_calls обращений),
+    цепь размыкается (время размыкания хранится там же, поэтому цепь
+    размыкается для всех процессов): обращения сразу завершаются
+    CircuitOpenError. По истечении open_duration
+    выполняются пробные обращения (не более half_open_probes
+    одновременно): успешное замыкает цепь, ошибка снова размыкает.
+
+    Args:
+        failure_rate: Доля ошибок, при которой цепь размыкается.
+        min_calls: Минимальное количество обращений за окно.
+        slow_call: Время обращения, считающееся ошибкой (сек).
+        window: Длительность окна (сек).
+        open_duration: Время до пробных обращений (сек).
+        half_open_probes: Количество одновременных пробных обращений.
+    """
+
+    prefix = "stripe_circuit"
+    # Количество интервалов скользящего окна
+    buckets = 6
+    # Время хранения времени размыкания (сек): полуоткрытая цепь, через
+    # которую не было пробных обращений, по его истечении замыкается
+    state_ttl = 24 * 60 * 60
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        min_calls: int = 20,
+        slow_call: float = 5.0,
+        window: int = 60,
+        open_duration: int = 30,
+        half_open_probes: int = 1,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self.counters = SharedCounters(self.prefix)
+
+    def window_keys(self, now: float) -> list[tuple[str, str]]:
+        """Имена счетчиков (обращений, ошибок) интервалов окна, начиная
+        с текущего.
+
+        Счетчики интервалов используются по кругу: счетчик интервала
+        действует до конца окна, начинающегося с этого интервала, и
+        сбрасывается при повторном использовании.
+        """
+        slot = int(now // self.bucket_size)
+        keys = []
+        for index in range(slot, slot - self.buckets, -1):
+            index %= self.buckets
+            keys.append((f"calls:{index}", f"failures:{index}"))
+        return keys
+
+    @property
+    def bucket_size(self) -> float:
+        return self.window / self.buckets
+
+    def bucket_expires(self, now: float) -> float:
+        """Время истечения счетчиков текущего интервала."""
+        slot = int(now // self.bucket_size)
+        return (slot + self.buckets) * self.bucket_size
+
+    def opened_until(self) -> Optional[float]:
+        """Время размыкания цепи (unix time) или None, если цепь
+        замкнута. Хранится в счетчике opened_until в миллисекундах."""
+        value = self.counters.get("opened_until")
+        return value / 1000 if value else None
+
+    def before_call(self) -> bool:
+        """Проверяет, разрешено ли обращение.
+
+        Возвращает True для пробного обращения (цепь полуоткрыта).
+
+        Raises:
+            CircuitOpenError: Цепь разомкнута.
+        """
+        opened_until = self.opened_until()
+        if opened_until is None:
+            return False
+        now = time.time()
+        if now < opened_until:
+            registry.stripe_circuit.add("rejected", 1)
+            raise CircuitOpenError(opened_until - now)
+        # Пробное обращение, не завершенное аварийно остановленным
+        # процессом, освобождается по истечении slow_call
+        probes = self.counters.incr(
+            "probes", now + math.ceil(self.slow_call) + 1
+        )
+        if probes > self.half_open_probes:
+            registry.stripe_circuit.add("rejected", 1)
+            raise CircuitOpenError(1)
+        registry.stripe_circuit.add("probe", 1)
+        return True
+
+    def record(self, failed: bool, probe: bool = False):
+        """Учитывает результат обращения."""
+        if probe:
+            if failed:
+                self.open()
+            else:
+                self.close()
+            return
+        now = time.time()
+        keys = self.window_keys(now)
+        calls_key, failures_key = keys[0]
+        expires = self.bucket_expires(now)
+        self.counters.incr(calls_key, expires)
+        if not failed:
+            return
+        self.counters.incr(failures_key, expires)
+        counters = self.counters.get_many(
+            [key for pair in keys for key in pair]
+        )
+        calls = sum(counters.get(key, 0) for key, _ in keys)
+        failures = sum(counters.get(key, 0) for _, key in keys)
+        if calls >= self.min_calls and failures >= calls * self.failure_rate:
+            self.open()
+
+    def is_failure(self, error: Optional[Exception], elapsed: float) -> bool:
+        """Ошибка недоступности stripe: сетевая ошибка, ответ 5xx или
+        медленное обращение. Ошибки запроса (4xx) не учитываются."""
+        if elapsed > self.slow_call:
+            return True
+        if error is None:
+            return False
+        if isinstance(error, stripe.error.APIConnectionError):
+            return True
+        status = getattr(error, "http_status", None)
+        return isinstance(error, stripe.error.APIError) or (
+            status is not None and status >= 500
+        )
+
+    def open(self):
+        # Запись хранится до замыкания цепи: по истечении open_duration
+        # цепь полуоткрыта
+        opened_until = time.time() + self.open_duration
+        self.counters.set(
+            "opened_until",
+            math.ceil(opened_until * 1000),
+            opened_until + self.state_ttl,
+        )
+        self.counters.delete_many(["probes"])
+        registry.stripe_circuit.add("opened", 1)
+
+    def close(self):
+        keys = [key for pair in self.window_keys(time.time()) for key in pair]
+        self.counters.delete_many(["opened_until", "probes", *keys])
+        registry.stripe_circuit.add("closed", 1)
+
+    def state(self) -> str:
+        """Состояние цепи: closed, open или half_open."""
+        opened_until = self.opened_until()
+        if opened_until is None:
+            return "closed"
+        return "open" if time.time() < opened_until else "half_open"
+
+
+def get_circuit_breaker() -> Optional[CircuitBreaker]:
+    """Размыкатель цепи по настройке STRIPE_CIRCUIT_BREAKER (None, если
+    отключен)."""
+    config = settings.STRIPE_CIRCUIT_BREAKER
+    if not config["ENABLED"]:
+        return None
+    return CircuitBreaker(
+        failure_rate=config["FAILURE_RATE"],
+        min_calls=config["MIN_CALLS"],
+        slow_call=config["SLOW_CALL"],
+        window=config["WINDOW"],
+        open_duration=config["OPEN_DURATION"],
+        half_open_probes=config["HALF_OPEN_PROBES"],
+    )
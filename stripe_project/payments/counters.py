@@ -0,0 +1,97 @@
+import time
+
+from django.db import connection
+from django.db.models import F
+
+from .models import SharedCounter
+
+
+class SharedCounters:
+    """Счетчики, общие для процессов (таблица SharedCounter).
+
+    Кэш Django для таких счетчиков не подходит: LocMemCache действует
+    в пределах процесса, а DatabaseCache.incr читает и записывает
+    значение отдельными запросами, поэтому одновременные увеличения
+    теряются. Здесь счетчик изменяется одним запросом INSERT ... ON
+    CONFLICT DO UPDATE ... RETURNING, атомарным в PostgreSQL и SQLite.
+
+    Срок действия задается при создании счетчика и не продлевается.
+    Истекший счетчик не учитывается при чтении и сбрасывается при
+    следующем увеличении, поэтому количество строк ограничено
+    количеством имен. Методом set в таблице хранятся и общие значения
+    состояния (например, время размыкания цепи).
+
+    Args:
+        prefix: Префикс имен счетчиков.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    def name(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def incr(self, key: str, expires: float, delta: int = 1) -> int:
+        """Увеличивает счетчик и возвращает новое значение.
+
+        Args:
+            key: Имя счетчика.
+            expires: Время истечения (unix time) нового или
+                сброшенного счетчика.
+            delta: Приращение.
+        """
+        table = connection.ops.quote_name(SharedCounter._meta.db_table)
+        now = time.time()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, value, expires) "
+                f"VALUES (%s, %s, %s) ON CONFLICT (name) DO UPDATE SET "
+                f"value = CASE WHEN {table}.expires <= %s "
+                f"THEN excluded.value ELSE {table}.value + excluded.value "
+                f"END, expires = CASE WHEN {table}.expires <= %s "
+                f"THEN excluded.expires ELSE {table}.expires END "
+                f"RETURNING value",
+                [self.name(key), delta, expires, now, now],
+            )
+            return cursor.fetchone()[0]
+
+    def set(self, key: str, value: int, expires: float):
+        """Записывает значение независимо от прежнего.
+
+        Args:
+            key: Имя счетчика.
+            value: Значение.
+            expires: Время истечения (unix time).
+        """
+        table = connection.ops.quote_name(SharedCounter._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (name, value, expires) "
+                f"VALUES (%s, %s, %s) ON CONFLICT (name) DO UPDATE SET "
+                f"value = excluded.value, expires = excluded.expires",
+                [self.name(key), value, expires],
+            )
+
+    def decr(self, key: str):
+        """Уменьшает действующий счетчик (не ниже нуля)."""
+        SharedCounter.objects.filter(
+            name=self.name(key), expires__gt=time.time(), value__gt=0
+        ).update(value=F("value") - 1)
+
+    def get_many(self, keys: list[str]) -> dict[str, int]:
+        """Значения действующих счетчиков по именам."""
+        names = {self.name(key): key for key in keys}
+        return {
+            names[name]: value
+            for name, value in SharedCounter.objects.filter(
+                name__in=names, expires__gt=time.time()
+            ).values_list("name", "value")
+        }
+
+    def get(self, key: str) -> int:
+        return self.get_many([key]).get(key, 0)
+
+    def delete_many(self, keys: list[str]):
+        SharedCounter.objects.filter(
+            name__in=[self.name(key) for key in keys]
+        ).delete()
@@ -0,0 +1,143 @@
+import time
+from fractions import Fraction
+from typing import Iterable, Optional
+
+from django.conf import settings
+
+from .models import ExchangeRate
+
+
+class ExchangeRateMissing(LookupError):
+    """Нет курса пересчета из валюты source в валюту target."""
+
+    def __init__(self, source: str, target: str):
+        self.source = source
+        self.target = target
+        super().__init__(f"No exchange rate from {source} to {target}")
+
+
+class RateMatrix:
+    """Матрица курсов пересчета валют в виде точных дробей.
+
+    Курс, отсутствующий в таблице, вычисляется как обратный к курсу
+    target -> source или через общую валюту (кросс-курс). Вычисленные
+    курсы запоминаются.
+
+    Args:
+        rates: Курсы по парам валют (source, target).
+    """
+
+    def __init__(self, rates: dict[tuple[str, str], Fraction]):
+        self.rates = dict(rates)
+        self.currencies = {currency for pair in rates for currency in pair}
+        self._resolved = {}
+
+    def direct(self, source: str, target: str) -> Optional[Fraction]:
+        """Курс из таблицы (прямой или обратный)."""
+        if (source, target) in self.rates:
+            return self.rates[(source, target)]
+        if (target, source) in self.rates:
+            return 1 / self.rates[(target, source)]
+        return None
+
+    def rate(self, source: str, target: str) -> Fraction:
+        """Курс пересчета суммы из валюты source в валюту target.
+
+        Raises:
+            ExchangeRateMissing: Курс не может быть вычислен.
+        """
+        if source == target:
+            return Fraction(1)
+        key = (source, target)
+        if key not in self._resolved:
+            rate = self.direct(source, target)
+            if rate is None:
+                for pivot in sorted(self.currencies - set(key)):
+                    first = self.direct(source, pivot)
+                    second = self.direct(pivot, target)
+                    if first is not None and second is not None:
+                        rate = first * second
+                        break
+                else:
+                    raise ExchangeRateMissing(source, target)
+            self._resolved[key] = rate
+        return self._resolved[key]
+
+
+class ExchangeRates:
+    """Матрица курсов ExchangeRate в памяти процесса.
+
+    Таблица курсов читается одним запросом и используется до истечения
+    ttl секунд (или до вызова clear), поэтому пересчет сумм заказов не
+    обращается к базе данных. Другие процессы получают новые курсы по
+    истечении ttl.
+
+    Args:
+        ttl: Время хранения матрицы (по умолчанию EXCHANGE_RATES_TTL).
+    """
+
+    def __init__(self, ttl: int = None):
+        self.ttl = ttl
+        self._matrix = None
+        self._loaded_at = 0.0
+
+    def get_matrix(self) -> RateMatrix:
+        ttl = settings.EXCHANGE_RATES_TTL if self.ttl is None else self.ttl
+        matrix = self._matrix
+        if matrix is None or time.monotonic() - self._loaded_at > ttl:
+            matrix = self.load()
+            self._matrix = matrix
+            self._loaded_at = time.monotonic()
+        return matrix
+
+    def load(self) -> RateMatrix:
+        return RateMatrix(
+            {
+                (source, target): Fraction(rate)
+                for source, target, rate in ExchangeRate.objects.values_list(
+                    "source", "target", "rate"
+                )
+            }
+        )
+
+    def clear(self):
+        self._matrix = None
+
+    def rate(self, source: str, target: str) -> Fraction:
+        """Курс пересчета (без загрузки матрицы для одной валюты)."""
+        if source == target:
+            return Fraction(1)
+        return self.get_matrix().rate(source, target)
+
+    def check(self, currencies: Iterable[str], target: str):
+        """Проверяет наличие курсов пересчета валют в валюту target.
+
+        Raises:
+            ExchangeRateMissing: Нет курса для одной из валют.
+        """
+        for currency in sorted(set(currencies)):
+            self.rate(currency, target)
+
+
+exchange_rates = ExchangeRates()
+
+
+def get_settlement_currency(
+    currencies: Iterable[str], empty: Optional[str] = None
+) -> str:
+    """Валюта расчетов заказа по валютам его товаров.
+
+    Заказ с товарами одной валюты рассчитывается в ней, с товарами
+    разных валют — в SETTLEMENT_CURRENCY, заказ без товаров — в валюте
+    доставки (если есть) или в валюте по умолчанию.
+
+    Args:
+        currencies: Валюты товаров заказа.
+        empty: Валюта доставки заказа.
+    """
+    currencies = set(currencies)
+    if len(currencies) == 1:
+        return currencies.pop()
+    if not currencies:
+        return empty or settings.DEFAULT_CURRENCY
+    return settings.SETTLEMENT_CURRENCY
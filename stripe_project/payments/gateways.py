@@ -0,0 +1,609 @@
+import asyncio
+import itertools
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache, wraps
+from typing import Optional
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from stripe import StripeObject
+
+from .breaker import CircuitBreaker, get_circuit_breaker
+from .metrics import measure
+from .ratelimit import StripeRateLimiter, get_rate_limiter
+
+
+class PaymentGateway(ABC):
+    """Интерфейс обращений к платежному сервису.
+
+    Все методы возвращают объекты stripe (StripeObject) и выбрасывают
+    исключения stripe.error.*, независимо от реализации.
+    """
+
+    @abstractmethod
+    def create_coupon(
+        self, coupon_id: str, name: str, percent_off
+    ) -> StripeObject:
+        """Создает купон скидки."""
+
+    @abstractmethod
+    def delete_coupon(self, coupon_id: str) -> StripeObject:
+        """Удаляет купон скидки."""
+
+    @abstractmethod
+    def create_tax_rate(
+        self, display_name: str, description: str, percentage, inclusive: bool
+    ) -> StripeObject:
+        """Создает налоговую ставку."""
+
+    @abstractmethod
+    def modify_tax_rate(
+        self, tax_id: str, display_name: str, description: str
+    ) -> StripeObject:
+        """Изменяет налоговую ставку."""
+
+    @abstractmethod
+    def create_product(
+        self, product_id: str, name: str, description: str = ""
+    ) -> StripeObject:
+        """Создает товар."""
+
+    @abstractmethod
+    def modify_product(
+        self,
+        product_id: str,
+        name: str,
+        description: str = "",
+        default_price: Optional[str] = None,
+    ) -> StripeObject:
+        """Изменяет товар (и его цену по умолчанию, если задана)."""
+
+    @abstractmethod
+    def create_price(
+        self,
+        product_id: str,
+        unit_amount: int,
+        currency: str,
+        idempotency_key: Optional[str] = None,
+    ) -> StripeObject:
+        """Создает цену товара."""
+
+    @abstractmethod
+    def archive_price(self, price_id: str) -> StripeObject:
+        """Деактивирует цену (цены stripe не изменяются и не удаляются)."""
+
+    @abstractmethod
+    def create_checkout_session(self, **params) -> StripeObject:
+        """Создает сессию оформления заказа (stripe.checkout.Session)."""
+
+    async def acreate_checkout_session(self, **params) -> StripeObject:
+        """Асинхронно создает сессию оформления заказа.
+
+        По умолчанию синхронный запрос выполняется в пуле потоков, не
+        блокируя цикл событий.
+        """
+        return await sync_to_async(
+            self.create_checkout_session, thread_sensitive=False
+        )(**params)
+
+    @abstractmethod
+    def create_payment_intent(
+        self, idempotency_key: Optional[str] = None, **params
+    ) -> StripeObject:
+        """Создает PaymentIntent."""
+
+    @abstractmethod
+    def modify_payment_intent(
+        self, intent_id: str, idempotency_key: Optional[str] = None, **params
+    ) -> StripeObject:
+        """Изменяет PaymentIntent."""
+
+    @abstractmethod
+    def cancel_payment_intent(
+        self, intent_id: str, idempotency_key: Optional[str] = None
+    ) -> StripeObject:
+        """Отменяет PaymentIntent."""
+
+
+class StripeGateway(PaymentGateway):
+    """Обращения к API stripe."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or settings.STRIPE_SECRET_KEY
+
+    def create_coupon(self, coupon_id, name, percent_off):
+        return stripe.Coupon.create(
+            api_key=self.api_key,
+            name=name,
+            duration="forever",
+            id=coupon_id,
+            percent_off=percent_off,
+        )
+
+    def delete_coupon(self, coupon_id):
+        return stripe.Coupon.delete(coupon_id, api_key=self.api_key)
+
+    def create_tax_rate(
+        self, display_name, description, percentage, inclusive
+    ):
+        return stripe.TaxRate.create(
+            api_key=self.api_key,
+            display_name=display_name,
+            description=description,
+            percentage=percentage,
+            inclusive=inclusive,
+        )
+
+    def modify_tax_rate(self, tax_id, display_name, description):
+        return stripe.TaxRate.modify(
+            tax_id,
+            api_key=self.api_key,
+            display_name=display_name,
+            description=description,
+        )
+
+    def create_product(self, product_id, name, description=""):
+        # stripe не принимает пустую строку в качестве описания
+        return stripe.Product.create(
+            api_key=self.api_key,
+            id=product_id,
+            name=name,
+            description=description or None,
+        )
+
+    def modify_product(
+        self, product_id, name, description="", default_price=None
+    ):
+        params = {"name": name, "description": description}
+        if default_price:
+            params["default_price"] = default_price
+        return stripe.Product.modify(
+            product_id, api_key=self.api_key, **params
+        )
+
+    def create_price(
+        self, product_id, unit_amount, currency, idempotency_key=None
+    ):
+        return stripe.Price.create(
+            api_key=self.api_key,
+            idempotency_key=idempotency_key,
+            product=product_id,
+            unit_amount=unit_amount,
+            currency=currency,
+        )
+
+    def archive_price(self, price_id):
+        return stripe.Price.modify(
+            price_id, api_key=self.api_key, active=False
+        )
+
+    def create_checkout_session(self, **params):
+        return stripe.checkout.Session.create(api_key=self.api_key, **params)
+
+    def create_payment_intent(self, idempotency_key=None, **params):
+        return stripe.PaymentIntent.create(
+            api_key=self.api_key, idempotency_key=idempotency_key, **params
+        )
+
+    def modify_payment_intent(self, intent_id, idempotency_key=None, **params):
+        return stripe.PaymentIntent.modify(
+            intent_id,
+            api_key=self.api_key,
+            idempotency_key=idempotency_key,
+            **params,
+        )
+
+    def cancel_payment_intent(self, intent_id, idempotency_key=None):
+        return stripe.PaymentIntent.cancel(
+            intent_id, api_key=self.api_key, idempotency_key=idempotency_key
+        )
+
+
+class FakeGateway(PaymentGateway):
+    """Детерминированная реализация в памяти процесса для нагрузочных тестов.
+
+    Args:
+        latency: Задержка каждого обращения (сек).
+        jitter: Случайная добавка к задержке (сек).
+        error_rate: Доля обращений, завершающихся APIConnectionError.
+        seed: Начальное значение генератора случайных чисел.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        self.objects = {}
+        self.idempotency = {}
+        self.calls = 0
+
+    def reset(self):
+        with self.lock:
+            self.counter = itertools.count(1)
+            self.objects.clear()
+            self.idempotency.clear()
+            self.calls = 0
+
+    def call(self, idempotency_key: Optional[str] = None):
+        """Имитирует сетевое обращение: задержку и ошибки."""
+        delay, failed = self.next_call()
+        if delay:
+            time.sleep(delay)
+        return self.complete_call(failed, idempotency_key)
+
+    async def acall(self, idempotency_key: Optional[str] = None):
+        """Асинхронная версия call."""
+        delay, failed = self.next_call()
+        if delay:
+            await asyncio.sleep(delay)
+        return self.complete_call(failed, idempotency_key)
+
+    def next_call(self) -> tuple:
+        with self.lock:
+            self.calls += 1
+            delay = self.latency + self.jitter * self.random.random()
+            failed = self.random.random() < self.error_rate
+        return delay, failed
+
+    def complete_call(self, failed: bool, idempotency_key: Optional[str]):
+        if failed:
+            raise stripe.error.APIConnectionError(
+                "Fake gateway injected error", should_retry=True
+            )
+        if idempotency_key is not None:
+            return self.idempotency.get(idempotency_key)
+        return None
+
+    def new_id(self, prefix: str) -> str:
+        with self.lock:
+            return f"{prefix}_fake_{next(self.counter):08d}"
+
+    def store(self, data: dict, idempotency_key: Optional[str] = None):
+        obj = StripeObject.construct_from(data, None)
+        with self.lock:
+            self.objects[data["id"]] = obj
+            if idempotency_key is not None:
+                self.idempotency[idempotency_key] = obj
+        return obj
+
+    def get(self, object_id: str) -> StripeObject:
+        try:
+            return self.objects[object_id]
+        except KeyError:
+            raise stripe.error.InvalidRequestError(
+                f"No such object: '{object_id}'", "id", code="resource_missing"
+            ) from None
+
+    def create_coupon(self, coupon_id, name, percent_off):
+        self.call()
+        if coupon_id in self.objects:
+            raise stripe.error.InvalidRequestError(
+                "Coupon already exists.", "id", code="resource_already_exists"
+            )
+        return self.store(
+            {
+                "id": coupon_id,
+                "object": "coupon",
+                "name": name,
+                "duration": "forever",
+                "percent_off": float(percent_off),
+            }
+        )
+
+    def delete_coupon(self, coupon_id):
+        self.call()
+        self.get(coupon_id)
+        with self.lock:
+            del self.objects[coupon_id]
+        return StripeObject.construct_from(
+            {"id": coupon_id, "object": "coupon", "deleted": True}, None
+        )
+
+    def create_tax_rate(
+        self, display_name, description, percentage, inclusive
+    ):
+        self.call()
+        return self.store(
+            {
+                "id": self.new_id("txr"),
+                "object": "tax_rate",
+                "display_name": display_name,
+                "description": description,
+                "percentage": float(percentage),
+                "inclusive": inclusive,
+            }
+        )
+
+    def modify_tax_rate(self, tax_id, display_name, description):
+        self.call()
+        tax_rate = self.get(tax_id)
+        tax_rate.update(
+            {"display_name": display_name, "description": description}
+        )
+        return tax_rate
+
+    def create_product(self, product_id, name, description=""):
+        self.call()
+        if product_id in self.objects:
+            raise stripe.error.InvalidRequestError(
+                "Product already exists.", "id", code="resource_already_exists"
+            )
+        return self.store(
+            {
+                "id": product_id,
+                "object": "product",
+                "name": name,
+                "description": description or None,
+                "active": True,
+                "default_price": None,
+            }
+        )
+
+    def modify_product(
+        self, product_id, name, description="", default_price=None
+    ):
+        self.call()
+        product = self.get(product_id)
+        product.update({"name": name, "description": description or None})
+        if default_price:
+            self.get(default_price)
+            product["default_price"] = default_price
+        return product
+
+    def create_price(
+        self, product_id, unit_amount, currency, idempotency_key=None
+    ):
+        replay = self.call(idempotency_key)
+        if replay is not None:
+            return replay
+        self.get(product_id)
+        return self.store(
+            {
+                "id": self.new_id("price"),
+                "object": "price",
+                "product": product_id,
+                "unit_amount": unit_amount,
+                "currency": currency,
+                "active": True,
+            },
+            idempotency_key,
+        )
+
+    def archive_price(self, price_id):
+        self.call()
+        price = self.get(price_id)
+        price["active"] = False
+        return price
+
+    def create_checkout_session(self, **params):
+        self.call()
+        return self.new_checkout_session(params)
+
+    async def acreate_checkout_session(self, **params):
+        await self.acall()
+        return self.new_checkout_session(params)
+
+    def new_checkout_session(self, params: dict) -> StripeObject:
+        session_id = self.new_id("cs")
+        return self.store(
+            {
+                "id": session_id,
+                "object": "checkout.session",
+                "url": f"https://checkout.stripe.test/pay/{session_id}",
+                "status": "open",
+                "payment_status": "unpaid",
+                **params,
+            }
+        )
+
+    def create_payment_intent(self, idempotency_key=None, **params):
+        replay = self.call(idempotency_key)
+        if replay is not None:
+            return replay
+        intent_id = self.new_id("pi")
+        return self.store(
+            {
+                "id": intent_id,
+                "object": "payment_intent",
+                "client_secret": f"{intent_id}_secret",
+                "status": "requires_payment_method",
+                **params,
+            },
+            idempotency_key,
+        )
+
+    def modify_payment_intent(self, intent_id, idempotency_key=None, **params):
+        replay = self.call(idempotency_key)
+        if replay is not None:
+            return replay
+        intent = self.get(intent_id)
+        intent.update(params)
+        if idempotency_key is not None:
+            with self.lock:
+                self.idempotency[idempotency_key] = intent
+        return intent
+
+    def cancel_payment_intent(self, intent_id, idempotency_key=None):
+        replay = self.call(idempotency_key)
+        if replay is not None:
+            return replay
+        intent = self.get(intent_id)
+        if intent["status"] in ("succeeded", "canceled"):
+            raise stripe.error.InvalidRequestError(
+                f"PaymentIntent has a status of {intent['status']}.",
+                "intent",
+                code="payment_intent_unexpected_state",
+            )
+        intent["status"] = "canceled"
+        if idempotency_key is not None:
+            with self.lock:
+                self.idempotency[idempotency_key] = intent
+        return intent
+
+
+class GatewayWrapper:
+    """Базовая обертка платежного шлюза: обращения (методы
+    PaymentGateway) выполняются через call и acall.
+
+    Остальные атрибуты (например, FakeGateway.reset) передаются шлюзу
+    без изменений.
+    """
+
+    def __init__(self, gateway: PaymentGateway):
+        self.gateway = gateway
+
+    def __getattr__(self, name):
+        attr = getattr(self.gateway, name)
+        if name.startswith("_") or not hasattr(PaymentGateway, name):
+            return attr
+        if asyncio.iscoroutinefunction(attr):
+
+            @wraps(attr)
+            async def wrapper(*args, **kwargs):
+                return await self.acall(attr, *args, **kwargs)
+
+        else:
+
+            @wraps(attr)
+            def wrapper(*args, **kwargs):
+                return self.call(attr, *args, **kwargs)
+
+        return wrapper
+
+    def call(self, method, *args, **kwargs):
+        return method(*args, **kwargs)
+
+    async def acall(self, method, *args, **kwargs):
+        return await method(*args, **kwargs)
+
+
+class InstrumentedGateway(GatewayWrapper):
+    """Обертка платежного шлюза, учитывающая количество и время
+    обращений в метриках запроса."""
+
+    def call(self, method, *args, **kwargs):
+        with measure("stripe"):
+            return method(*args, **kwargs)
+
+    async def acall(self, method, *args, **kwargs):
+        with measure("stripe"):
+            return await method(*args, **kwargs)
+
+
+class RateLimitedGateway(GatewayWrapper):
+    """Обертка платежного шлюза, ограничивающая частоту обращений
+    через StripeRateLimiter.
+
+    Очередь обращения задается контекстом (ratelimit.lane). При ответе
+    429 обращения всех очередей приостанавливаются на время Retry-After.
+    """
+
+    # Пауза после ответа 429 без заголовка Retry-After (сек)
+    default_retry_after = 1.0
+
+    def __init__(self, gateway: PaymentGateway, limiter: StripeRateLimiter):
+        super().__init__(gateway)
+        self.limiter = limiter
+
+    def call(self, method, *args, **kwargs):
+        self.limiter.acquire()
+        try:
+            return method(*args, **kwargs)
+        except stripe.error.RateLimitError as e:
+            self.throttled(e)
+            raise
+
+    async def acall(self, method, *args, **kwargs):
+        await self.limiter.aacquire()
+        try:
+            return await method(*args, **kwargs)
+        except stripe.error.RateLimitError as e:
+            await sync_to_async(self.throttled)(e)
+            raise
+
+    def throttled(self, error: stripe.error.RateLimitError):
+        try:
+            headers = error.headers or {}
+            retry_after = float(
+                headers.get("retry-after") or headers.get("Retry-After")
+            )
+        except (TypeError, ValueError):
+            retry_after = self.default_retry_after
+        self.limiter.pause(retry_after)
+
+
+class CircuitBreakerGateway(GatewayWrapper):
+    """Обертка платежного шлюза с размыканием цепи (CircuitBreaker):
+    при недоступности stripe обращения сразу завершаются
+    CircuitOpenError, не ожидая таймаута."""
+
+    def __init__(self, gateway: PaymentGateway, breaker: CircuitBreaker):
+        super().__init__(gateway)
+        self.breaker = breaker
+
+    def call(self, method, *args, **kwargs):
+        probe = self.breaker.before_call()
+        start = time.perf_counter()
+        error = None
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.breaker.record(
+                self.breaker.is_failure(error, elapsed), probe
+            )
+
+    async def acall(self, method, *args, **kwargs):
+        probe = await sync_to_async(self.breaker.before_call)()
+        start = time.perf_counter()
+        error = None
+        try:
+            return await method(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            await sync_to_async(self.breaker.record)(
+                self.breaker.is_failure(error, elapsed), probe
+            )
+
+
+@lru_cache(maxsize=None)
+def get_gateway() -> PaymentGateway:
+    """Возвращает платежный шлюз, заданный настройкой PAYMENT_GATEWAY.
+
+    Шлюз оборачивается учетом метрик (METRICS_ENABLED), размыканием
+    цепи (STRIPE_CIRCUIT_BREAKER) и ограничением частоты обращений
+    (STRIPE_RATE_LIMIT). Ограничение частоты внешнее, чтобы время
+    ожидания очереди не учитывалось как медленное обращение.
+    """
+    config = settings.PAYMENT_GATEWAY
+    gateway_class = import_string(config["BACKEND"])
+    gateway = gateway_class(**config.get("OPTIONS", {}))
+    if settings.METRICS_ENABLED:
+        gateway = InstrumentedGateway(gateway)
+    breaker = get_circuit_breaker()
+    if breaker is not None:
+        gateway = CircuitBreakerGateway(gateway, breaker)
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        gateway = RateLimitedGateway(gateway, limiter)
+    return gateway
@@ -0,0 +1,137 @@
+import logging
+import random
+import re
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe import RequestsClient
+
+logger = logging.getLogger("payments.stripe")
+
+# Идентификаторы объектов stripe в пути запроса (pi_..., cs_test_..., ...)
+OBJECT_ID_RE = re.compile(r"/[a-z]+_(?=[A-Za-z0-9_]*[A-Z0-9])[A-Za-z0-9_]+")
+
+
+class LatencyStats:
+    """Потокобезопасная статистика времени обращений по методам API."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def observe(self, endpoint: str, seconds: float, failed: bool = False):
+        with self.lock:
+            stats = self.endpoints.setdefault(
+                endpoint, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["count"] += 1
+            stats["errors"] += failed
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                endpoint: dict(stats, avg=stats["total"] / stats["count"])
+                for endpoint, stats in self.endpoints.items()
+            }
+
+
+class PooledRequestsClient(RequestsClient):
+    """HTTP клиент stripe с общим пулом keep-alive соединений.
+
+    Один requests.Session (и пул соединений urllib3) используется всеми
+    потоками процесса, поэтому TLS соединение с api.stripe.com
+    устанавливается один раз на соединение пула, а не на каждый запрос.
+
+    Args:
+        pool_size: Максимальное количество соединений в пуле.
+        connect_timeout: Таймаут установки соединения (сек).
+        read_timeout: Таймаут чтения ответа (сек).
+        initial_retry_delay: Начальная задержка повтора запроса (сек).
+        max_retry_delay: Максимальная задержка повтора запроса (сек).
+    """
+
+    name = "pooled-requests"
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        initial_retry_delay: float = 0.5,
+        max_retry_delay: float = 5,
+        verify_ssl_certs: bool = True,
+        proxy: Optional[str] = None,
+    ):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=0
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        super().__init__(
+            timeout=(connect_timeout, read_timeout),
+            session=session,
+            verify_ssl_certs=verify_ssl_certs,
+            proxy=proxy,
+        )
+        self.initial_retry_delay = initial_retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stats = LatencyStats()
+
+    def _sleep_time_seconds(self, num_retries, response=None):
+        # Экспоненциальная задержка с полным случайным разбросом,
+        # чтобы повторы разных процессов не совпадали по времени
+        backoff = min(
+            self.initial_retry_delay * (2 ** (num_retries - 1)),
+            self.max_retry_delay,
+        )
+        sleep_seconds = random.uniform(0, backoff)
+        retry_after = self._retry_after_header(response) or 0
+        if retry_after <= self.MAX_RETRY_AFTER:
+            sleep_seconds = max(retry_after, sleep_seconds)
+        return sleep_seconds
+
+    def _request_internal(
+        self, method, url, headers, post_data, is_streaming
+    ):
+        endpoint = f"{method.upper()} {get_endpoint(url)}"
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = super()._request_internal(
+                method, url, headers, post_data, is_streaming
+            )
+            failed = response[1] >= 500
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats.observe(endpoint, elapsed, failed)
+            logger.debug("stripe %s %.1f ms", endpoint, elapsed * 1000)
+
+
+def get_endpoint(url: str) -> str:
+    """Путь запроса без идентификаторов объектов (/v1/coupons/{id})."""
+    return OBJECT_ID_RE.sub("/{id}", urlparse(url).path)
+
+
+def configure_stripe_http_client() -> PooledRequestsClient:
+    """Устанавливает клиент HTTP stripe по настройке STRIPE_HTTP_CLIENT."""
+    config = settings.STRIPE_HTTP_CLIENT
+    client = PooledRequestsClient(
+        pool_size=config["POOL_SIZE"],
+        connect_timeout=config["CONNECT_TIMEOUT"],
+        read_timeout=config["READ_TIMEOUT"],
+        initial_retry_delay=config["INITIAL_RETRY_DELAY"],
+        max_retry_delay=config["MAX_RETRY_DELAY"],
+    )
+    stripe.default_http_client = client
+    stripe.max_network_retries = config["MAX_NETWORK_RETRIES"]
+    return client
@@ -0,0 +1,160 @@
+import logging
+import os
+import random
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .breaker import CircuitOpenError
+from .models import Discount, Item, JobStatus, StripeJob, Tax
+from .ratelimit import BACKGROUND, lane
+from .services import DiscountService, ProductService, TaxService
+
+logger = logging.getLogger("payments.jobs")
+
+HANDLERS = {}
+
+
+def handler(kind: str):
+    """Регистрирует обработчик задачи заданного типа."""
+
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def enqueue(kind: str, object_id: int) -> StripeJob:
+    """Ставит задачу синхронизации объекта в очередь.
+
+    Задача записывается в той же транзакции, что и изменение объекта.
+    Если для объекта уже есть ожидающая задача, новая не создается:
+    обработчик всегда синхронизирует текущее состояние объекта.
+    """
+    job = StripeJob.objects.filter(
+        kind=kind, object_id=object_id, status=JobStatus.PENDING
+    ).first()
+    if job is None:
+        job = StripeJob.objects.create(kind=kind, object_id=object_id)
+    return job
+
+
+@handler("discount.sync")
+def sync_discount(discount_id: int):
+    discount = Discount.objects.filter(pk=discount_id).first()
+    if discount is not None:
+        DiscountService.sync_coupon(discount)
+
+
+@handler("tax.sync")
+def sync_tax(tax_id: int):
+    tax = Tax.objects.filter(pk=tax_id).first()
+    if tax is not None:
+        TaxService.sync_tax(tax)
+
+
+@handler("item.sync")
+def sync_item(item_id: int):
+    item = Item.objects.filter(pk=item_id).first()
+    if item is not None:
+        ProductService.sync_product(item)
+
+
+class JobWorker:
+    """Выполняет задачи из очереди в пуле потоков.
+
+    Args:
+        concurrency: Количество одновременно выполняемых задач.
+        batch_size: Количество задач, захватываемых за один запрос.
+    """
+
+    def __init__(self, concurrency: int = None, batch_size: int = None):
+        config = settings.STRIPE_JOBS
+        self.concurrency = concurrency or config["CONCURRENCY"]
+        self.batch_size = batch_size or self.concurrency
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+
+    def claim(self) -> list[StripeJob]:
+        """Захватывает задачи, готовые к выполнению.
+
+        Также захватываются задачи, выполнение которых было прервано
+        (например, при аварийном завершении обработчика).
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.STRIPE_JOBS["LOCK_TIMEOUT"])
+        with transaction.atomic():
+            jobs = list(
+                StripeJob.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=JobStatus.PENDING, run_after__lte=now)
+                    | Q(status=JobStatus.RUNNING, locked_at__lt=stale)
+                )
+                .order_by("run_after", "pk")[: self.batch_size]
+            )
+            StripeJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=JobStatus.RUNNING, locked_by=self.name, locked_at=now
+            )
+        return jobs
+
+    def run_once(self) -> int:
+        """Выполняет одну порцию задач, возвращает их количество."""
+        jobs = self.claim()
+        if jobs:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                list(pool.map(self.execute, jobs))
+        return len(jobs)
+
+    def execute(self, job: StripeJob):
+        try:
+            with lane(BACKGROUND):
+                HANDLERS[job.kind](job.object_id)
+        except Exception as e:
+            logger.warning("Stripe job %s failed: %s", job, e)
+            self.fail(job, e)
+        else:
+            StripeJob.objects.filter(pk=job.pk).update(
+                status=JobStatus.SUCCEEDED,
+                attempts=job.attempts + 1,
+                last_error="",
+                finished_at=timezone.now(),
+            )
+        finally:
+            close_old_connections()
+
+    def fail(self, job: StripeJob, error: Exception):
+        if isinstance(error, CircuitOpenError):
+            # stripe недоступен: задача откладывается без учета попытки
+            StripeJob.objects.filter(pk=job.pk).update(
+                status=JobStatus.PENDING,
+                last_error=str(error),
+                run_after=timezone.now()
+                + timedelta(seconds=error.retry_after),
+            )
+            return
+        config = settings.STRIPE_JOBS
+        attempts = job.attempts + 1
+        if attempts >= config["MAX_ATTEMPTS"]:
+            StripeJob.objects.filter(pk=job.pk).update(
+                status=JobStatus.FAILED,
+                attempts=attempts,
+                last_error=str(error),
+                finished_at=timezone.now(),
+            )
+            return
+        # Экспоненциальная задержка повтора со случайным разбросом
+        delay = min(
+            config["BACKOFF_BASE"] * 2 ** (attempts - 1), config["BACKOFF_MAX"]
+        )
+        delay *= random.uniform(0.5, 1)
+        StripeJob.objects.filter(pk=job.pk).update(
+            status=JobStatus.PENDING,
+            attempts=attempts,
+            last_error=str(error),
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
@@ -0,0 +1,47 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from payments.models import Item, JobStatus, StripeJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Ставит в очередь задачи синхронизации товаров, для которых "
+        "не сохранены идентификаторы товара и цены stripe."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Размер пакета чтения товаров и создания задач.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pending = set(
+            StripeJob.objects.filter(
+                kind="item.sync", status=JobStatus.PENDING
+            ).values_list("object_id", flat=True)
+        )
+        item_ids = (
+            Item.objects.filter(stripe_price_id="")
+            .order_by("pk")
+            .values_list("pk", flat=True)
+            .iterator(chunk_size=batch_size)
+        )
+        total = 0
+        while True:
+            batch = list(islice(item_ids, batch_size))
+            if not batch:
+                break
+            batch = [pk for pk in batch if pk not in pending]
+            StripeJob.objects.bulk_create(
+                [StripeJob(kind="item.sync", object_id=pk) for pk in batch]
+            )
+            total += len(batch)
+        self.stdout.write(
+            self.style.SUCCESS(f"Поставлено задач синхронизации: {total}")
+        )
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from payments.gateways import get_gateway
+from payments.models import Item, Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение пропускной способности и задержки (p99) синхронных "
+        "(WSGI) и асинхронных (ASGI) обработчиков оформления заказа "
+        "с платежным шлюзом FakeGateway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Количество запросов в каждом режиме.",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="Количество потоков обработки запросов WSGI.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Количество одновременных запросов ASGI.",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.1,
+            help="Задержка обращения к платежному шлюзу (сек).",
+        )
+        parser.add_argument(
+            "--kind",
+            choices=("item", "order"),
+            default="order",
+            help="Оформление товара или заказа.",
+        )
+
+    def handle(self, *args, **options):
+        item = Item.objects.create(
+            name="benchmark", description="benchmark", price=1000
+        )
+        order = Order.objects.create()
+        order.items.add(item)
+        if options["kind"] == "item":
+            sync_name, async_name, pk = (
+                "item-checkout",
+                "item-checkout-async",
+                item.pk,
+            )
+        else:
+            sync_name, async_name, pk = (
+                "order-session-checkout",
+                "order-session-checkout-async",
+                order.pk,
+            )
+        # Кэш сессий отключен, каждый запрос обращается к шлюзу
+        settings = override_settings(
+            ALLOWED_HOSTS=["testserver"],
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.dummy.DummyCache"
+                }
+            },
+            PAYMENT_GATEWAY={
+                "BACKEND": "payments.gateways.FakeGateway",
+                "OPTIONS": {"latency": options["latency"]},
+            },
+        )
+        try:
+            with settings:
+                get_gateway.cache_clear()
+                sync_url = reverse(f"payments:{sync_name}", args=[pk])
+                async_url = reverse(f"payments:{async_name}", args=[pk])
+                self.report(
+                    "wsgi",
+                    *self.run_wsgi(
+                        sync_url, options["requests"], options["threads"]
+                    ),
+                )
+                self.report(
+                    "asgi",
+                    *asyncio.run(
+                        self.run_asgi(
+                            async_url,
+                            options["requests"],
+                            options["concurrency"],
+                        )
+                    ),
+                )
+        finally:
+            get_gateway.cache_clear()
+            order.delete()
+            item.delete()
+
+    def run_wsgi(self, url: str, requests: int, threads: int) -> tuple:
+        def request(_):
+            client = Client()
+            start = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - start
+            close_old_connections()
+            return response.status_code, elapsed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(request, range(requests)))
+        return results, time.perf_counter() - start
+
+    async def run_asgi(self, url: str, requests: int, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+        client = AsyncClient()
+
+        async def request():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url)
+                return response.status_code, time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(request() for _ in range(requests)))
+        return results, time.perf_counter() - start
+
+    def report(self, mode: str, results: list, wall: float):
+        errors = [status for status, _ in results if status != 200]
+        if errors:
+            raise CommandError(f"{mode}: {len(errors)} запросов с ошибкой")
+        latencies = sorted(elapsed for _, elapsed in results)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{mode}: {len(results) / wall:.1f} req/s, "
+            f"p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms"
+        )
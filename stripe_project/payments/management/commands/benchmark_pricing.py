@@ -0,0 +1,122 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from payments.models import (
+    Discount,
+    Item,
+    Order,
+    ShippingTax,
+    Tax,
+    TaxBehavior,
+)
+from payments.views import OrderDetail, OrderList
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер количества запросов и времени расчета стоимости заказа "
+        "в зависимости от количества товаров. Данные создаются внутри "
+        "транзакции и откатываются по завершении."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1,10,100,1000",
+            help="Количество товаров в заказе (через запятую).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Количество повторов для каждого замера.",
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        self.stdout.write(
+            f"{'items':>8} {'case':>10} {'queries':>8} {'ms/order':>10}"
+        )
+        try:
+            with transaction.atomic():
+                for size in sizes:
+                    order = self.seed_order(size)
+                    for case, func in (
+                        ("methods", self.call_methods),
+                        ("detail", self.render_detail),
+                        ("list", self.render_list),
+                    ):
+                        queries, elapsed = self.measure(
+                            func, order.pk, options["repeat"]
+                        )
+                        self.stdout.write(
+                            f"{size:>8} {case:>10} {queries:>8} "
+                            f"{elapsed * 1000:>10.3f}"
+                        )
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed_order(self, size: int) -> Order:
+        # Item унаследован от CurrencyMixin (multi-table), поэтому
+        # bulk_create для него недоступен.
+        items = [
+            Item.objects.create(
+                name=f"bench item {i}", description="benchmark", price=100 + i
+            )
+            for i in range(size)
+        ]
+        order = Order.objects.create(
+            discount=Discount.objects.create(name="bench", percent_off=10),
+            tax=Tax.objects.create(
+                name="bench",
+                description="benchmark",
+                percentage=20,
+                behavior=TaxBehavior.EXCLUSIVE,
+                tax_id="txr_bench",
+            ),
+            shipping=ShippingTax.objects.create(
+                name="bench", amount=500, code="txcd_92010001"
+            ),
+        )
+        order.items.add(*items)
+        return order
+
+    @staticmethod
+    def measure(func, pk: int, repeat: int) -> tuple:
+        with CaptureQueriesContext(connection) as context:
+            func(pk)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(pk)
+        return len(context), (time.perf_counter() - start) / repeat
+
+    @staticmethod
+    def call_methods(pk: int):
+        order = Order.objects.get(pk=pk)
+        order.get_order_price()
+        order.get_discount_amount()
+        order.get_tax_amount()
+        order.get_shipping_amount()
+        order.get_final_price()
+        order.get_currency()
+
+    @staticmethod
+    def render_detail(pk: int):
+        request = RequestFactory().get(f"/order/{pk}/")
+        OrderDetail.as_view()(request, pk=pk).render()
+
+    @staticmethod
+    def render_list(pk: int):
+        # Количество запросов страницы списка не зависит от числа
+        # заказов на странице и товаров в них
+        request = RequestFactory().get("/order/")
+        OrderList.as_view()(request).render()
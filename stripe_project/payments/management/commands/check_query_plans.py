@@ -0,0 +1,264 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import RequestFactory
+from django.utils import timezone
+
+from payments.models import (
+    Item,
+    JobStatus,
+    Order,
+    OrderLine,
+    OrderStatus,
+    PaymentAttempt,
+    StripeJob,
+    WebhookEvent,
+    WebhookEventStatus,
+)
+from payments.services import OrderLineService
+from payments.views import ItemList, OrderList
+
+# Таблицы, полный просмотр которых недопустим при большом объеме данных
+LARGE_MODELS = (
+    Item,
+    Order,
+    OrderLine,
+    PaymentAttempt,
+    StripeJob,
+    WebhookEvent,
+)
+
+# Полный просмотр таблицы в плане запроса: "Seq Scan on <table>"
+# (PostgreSQL) или "SCAN <table>" (SQLite), в том числе по всему
+# индексу, если индекс не частичный
+SEQ_SCAN_PATTERNS = (
+    re.compile(r"Seq Scan on (?P<table>\w+)"),
+    re.compile(
+        r"\bSCAN (?P<table>\w+)(?: AS \w+)?"
+        r"(?: USING (?:COVERING )?INDEX (?P<index>\w+))?"
+    ),
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+def get_page(view_class, obj):
+    """Запрос страницы списка, следующей за объектом obj."""
+    view = view_class()
+    view.setup(
+        RequestFactory().get(
+            "/", {view.cursor_param: view.encode_cursor(obj)}
+        )
+    )
+    return view.get_queryset()[: view.page_size + 1]
+
+
+def get_queries(sample: dict) -> dict:
+    """Запросы основных путей оплаты (в том виде, в котором их выполняет
+    приложение): имя -> QuerySet.
+
+    Args:
+        sample: Значения для условий запросов (из созданных данных).
+    """
+    now = timezone.now()
+    order = Order(pk=sample["order"])
+    return {
+        "item list page": get_page(
+            ItemList, Item.objects.get(pk=sample["item"])
+        ),
+        "order list page": get_page(OrderList, order),
+        "order lines": OrderLine.objects.filter(order=order).select_related(
+            "item"
+        ),
+        "paid orders by status": Order.objects.filter(
+            status=OrderStatus.PAID
+        ).order_by("-paid_at")[:100],
+        "paid orders": Order.objects.filter(paid_at__isnull=False).order_by(
+            "-paid_at"
+        )[:100],
+        "orders by payment intents": Order.objects.for_payment_intents(
+            [sample["intent_id"]]
+        ).values_list("pk", flat=True),
+        "payment attempts by intent": PaymentAttempt.objects.filter(
+            intent_id__in=[sample["intent_id"]]
+        ),
+        "currency validation": OrderLineService.get_currencies(
+            order, [sample["item"]]
+        )[:2],
+        "job claim": StripeJob.objects.filter(
+            Q(status=JobStatus.PENDING, run_after__lte=now)
+            | Q(
+                status=JobStatus.RUNNING,
+                locked_at__lt=now - timedelta(minutes=5),
+            )
+        ).order_by("run_after", "pk")[:10],
+        "job enqueue": StripeJob.objects.filter(
+            kind="item.sync",
+            object_id=sample["item"],
+            status=JobStatus.PENDING,
+        )[:1],
+        "pending webhook events": WebhookEvent.objects.filter(
+            status=WebhookEventStatus.PENDING, next_attempt_at__lte=now
+        ).order_by("pk")[:100],
+    }
+
+
+def seed(rows: int) -> dict:
+    """Создает данные для проверки планов запросов.
+
+    Args:
+        rows: Количество товаров, заказов, оплат, задач и событий.
+    """
+    now = timezone.now()
+    # Item унаследован от CurrencyMixin (multi-table), поэтому
+    # bulk_create для него недоступен.
+    items = [
+        Item.objects.create(
+            name=f"plan item {i:06d}",
+            description="query plans",
+            price=100 + i,
+            stripe_product_id=f"prod_plan{i}",
+            stripe_price_id=f"price_plan{i}",
+        )
+        for i in range(rows)
+    ]
+    # bulk_create не устанавливает идентификаторы в SQLite
+    last_order = Order.objects.order_by("-pk").values_list("pk").first()
+    Order.objects.bulk_create(
+        Order(
+            status=OrderStatus.PAID if i % 2 else OrderStatus.NEW,
+            paid_at=now - timedelta(minutes=i) if i % 2 else None,
+        )
+        for i in range(rows)
+    )
+    orders = list(
+        Order.objects.filter(pk__gt=last_order[0] if last_order else 0)
+        .order_by("pk")
+        .only("pk")
+    )
+    OrderLine.objects.bulk_create(
+        OrderLine(order=order, item=items[(i + j) % rows], quantity=1)
+        for i, order in enumerate(orders)
+        for j in range(3)
+    )
+    PaymentAttempt.objects.bulk_create(
+        PaymentAttempt(
+            order=order,
+            intent_id=f"pi_plan{i}",
+            client_secret=f"pi_plan{i}_secret",
+            amount=100,
+            currency=items[0].currency,
+        )
+        for i, order in enumerate(orders)
+    )
+    StripeJob.objects.bulk_create(
+        StripeJob(
+            kind="item.sync",
+            object_id=item.pk,
+            status=JobStatus.PENDING if i % 10 == 0 else JobStatus.SUCCEEDED,
+        )
+        for i, item in enumerate(items)
+    )
+    WebhookEvent.objects.bulk_create(
+        WebhookEvent(
+            event_id=f"evt_plan{i}",
+            type="payment_intent.succeeded",
+            payload="{}",
+            status=WebhookEventStatus.PENDING
+            if i % 10 == 0
+            else WebhookEventStatus.PROCESSED,
+        )
+        for i in range(rows)
+    )
+    return {
+        "item": items[rows // 2].pk,
+        "order": orders[rows // 2].pk,
+        "intent_id": f"pi_plan{rows // 2}",
+    }
+
+
+def find_seq_scans(plan: str) -> list[str]:
+    """Таблицы с большим объемом данных, просматриваемые полностью."""
+    models = [
+        model
+        for large in LARGE_MODELS
+        for model in (large, *large._meta.get_parent_list())
+    ]
+    tables = {model._meta.db_table for model in models}
+    partial_indexes = {
+        index.name
+        for model in models
+        for index in model._meta.indexes
+        if index.condition is not None
+    }
+    return sorted(
+        {
+            match["table"]
+            for pattern in SEQ_SCAN_PATTERNS
+            for match in pattern.finditer(plan)
+            if match["table"] in tables
+            and match.groupdict().get("index") not in partial_indexes
+        }
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет планы (EXPLAIN) запросов основных путей оплаты: "
+        "завершается с ошибкой, если запрос просматривает большую таблицу "
+        "полностью. Данные создаются внутри транзакции и откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=5000,
+            help="Количество создаваемых товаров, заказов, оплат, задач "
+            "и событий.",
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Вывести планы всех запросов.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rows"] < 1:
+            raise CommandError("--rows должно быть положительным")
+        try:
+            with transaction.atomic():
+                sample = seed(options["rows"])
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+                plans = {
+                    name: queryset.explain()
+                    for name, queryset in get_queries(sample).items()
+                }
+                raise Rollback
+        except Rollback:
+            pass
+        failed = []
+        for name, plan in plans.items():
+            tables = find_seq_scans(plan)
+            if tables:
+                failed.append(name)
+                self.stdout.write(
+                    self.style.ERROR(
+                        f"{name}: полный просмотр {', '.join(tables)}"
+                    )
+                )
+            else:
+                self.stdout.write(f"{name}: ok")
+            if tables or options["verbose_plans"]:
+                self.stdout.write(plan)
+        if failed:
+            raise CommandError(
+                f"Полный просмотр таблиц в запросах: {', '.join(failed)}"
+            )
+        self.stdout.write(self.style.SUCCESS("Планы запросов в порядке"))
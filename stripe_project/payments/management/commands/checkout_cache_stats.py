@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from payments.payload_cache import checkout_payload_cache
+from payments.session_cache import checkout_session_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Статистика попаданий в кэш сессий оформления заказа stripe "
+        "и данных позиций заказов."
+    )
+
+    def handle(self, *args, **options):
+        for kind, stats in checkout_session_cache.stats().items():
+            self.stdout.write(
+                f"{kind}: hits={stats['hits']} misses={stats['misses']} "
+                f"hit_rate={stats['hit_rate']:.2%}"
+            )
+        stats = checkout_payload_cache.stats()
+        self.stdout.write(
+            f"order payload: hits={stats['hits']} misses={stats['misses']} "
+            f"hit_rate={stats['hit_rate']:.2%}"
+        )
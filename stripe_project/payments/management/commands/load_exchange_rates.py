@@ -0,0 +1,39 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.services import ExchangeRateService
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает курсы валют из файла JSON вида "
+        '{"usd": {"rub": "92.5", "eur": "0.92"}} и пересчитывает итоги '
+        "неоплаченных заказов с товарами в разных валютах."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к файлу курсов.")
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="Удалить курсы, отсутствующие в файле.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], encoding="utf-8") as file:
+                data = json.load(file)
+            rates = ExchangeRateService.parse(data)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Не удалось прочитать курсы: {e}")
+        except ValidationError as e:
+            raise CommandError(" ".join(e.messages))
+        updated = ExchangeRateService.load(rates, replace=options["replace"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Загружено курсов: {len(rates)}, пересчитано заказов: "
+                f"{updated}"
+            )
+        )
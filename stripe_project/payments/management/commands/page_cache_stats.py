@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from payments.page_cache import page_cache
+from payments.views import (
+    ItemApiDetail,
+    ItemApiList,
+    ItemDetail,
+    ItemList,
+    OrderApiDetail,
+    OrderApiList,
+    OrderDetail,
+    OrderList,
+)
+
+
+class Command(BaseCommand):
+    help = "Статистика попаданий в кэш страниц каталога и заказов."
+
+    def handle(self, *args, **options):
+        views = [
+            view.cache_name
+            for view in (
+                ItemDetail,
+                ItemList,
+                OrderDetail,
+                OrderList,
+                ItemApiDetail,
+                ItemApiList,
+                OrderApiDetail,
+                OrderApiList,
+            )
+        ]
+        for view, stats in page_cache.stats(views).items():
+            self.stdout.write(
+                f"{view}: hits={stats['hits']} misses={stats['misses']} "
+                f"not_modified={stats['not_modified']} "
+                f"hit_rate={stats['hit_rate']:.2%}"
+            )
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.webhooks import WebhookService
+
+
+class Command(BaseCommand):
+    help = "Обработка очереди событий stripe пакетами."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Количество событий, применяемых за одну транзакцию.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Пауза при пустой очереди (сек).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Обработать очередь и завершиться.",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = WebhookService.process_batch(options["batch_size"])
+            total += processed
+            if processed:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Обработано событий: {total}"))
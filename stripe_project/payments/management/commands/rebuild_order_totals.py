@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.models import Order
+from payments.page_cache import page_cache
+from payments.pricing import rebuild_orders_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает денормализованные итоги заказов по их товарам "
+        "(или только проверяет их с флагом --verify)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только проверить итоги, завершиться с ошибкой "
+            "при расхождениях.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Размер пакета чтения и обновления заказов.",
+        )
+
+    def handle(self, *args, **options):
+        count, mismatched = rebuild_orders_totals(
+            Order.objects.all(),
+            batch_size=options["batch_size"],
+            verify=options["verify"],
+        )
+        if options["verify"] and mismatched:
+            preview = ", ".join(str(pk) for pk in mismatched[:20])
+            raise CommandError(
+                f"Итоги не совпадают у {len(mismatched)} из {count} "
+                f"заказов: {preview}"
+            )
+        if not options["verify"]:
+            page_cache.touch_orders(*mismatched)
+        action = "Проверено" if options["verify"] else "Обновлено"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} заказов: {count}, исправлено: "
+                f"{0 if options['verify'] else len(mismatched)}"
+            )
+        )
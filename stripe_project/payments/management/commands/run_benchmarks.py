@@ -0,0 +1,136 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from payments.benchmarks import CASES, compare, run, seed
+from payments.models import TaxBehavior
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеры расчета стоимости, данных и сессии оплаты, страницы заказа "
+        "и проверки валюты в зависимости от количества позиций заказа. "
+        "Данные создаются внутри транзакции и откатываются по завершении, "
+        "результаты сравниваются с сохраненными (--baseline)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1,10,100,1000",
+            help="Количество позиций в заказе (через запятую).",
+        )
+        parser.add_argument(
+            "--orders",
+            type=int,
+            default=5,
+            help="Количество заказов каждого размера.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Количество повторов каждого замера.",
+        )
+        parser.add_argument(
+            "--cases",
+            default=",".join(CASES),
+            help="Замеры через запятую.",
+        )
+        parser.add_argument(
+            "--tax",
+            choices=(*TaxBehavior.values, "none"),
+            default=TaxBehavior.EXCLUSIVE,
+            help="Тип налога заказов.",
+        )
+        parser.add_argument(
+            "--no-discount",
+            action="store_true",
+            help="Заказы без скидки.",
+        )
+        parser.add_argument(
+            "--no-shipping",
+            action="store_true",
+            help="Заказы без доставки.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Файл результатов в формате JSON.",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Файл сохраненных результатов для сравнения.",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Допустимый рост минимального времени (доля).",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Записать результаты в файл --baseline.",
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        cases = [name.strip() for name in options["cases"].split(",")]
+        unknown = set(cases) - set(CASES)
+        if unknown:
+            raise CommandError(f"Неизвестные замеры: {', '.join(unknown)}")
+        if options["save_baseline"] and not options["baseline"]:
+            raise CommandError("--save-baseline требует --baseline")
+        try:
+            with transaction.atomic():
+                dataset = seed(
+                    sizes,
+                    orders=options["orders"],
+                    discount=not options["no_discount"],
+                    tax="" if options["tax"] == "none" else options["tax"],
+                    shipping=not options["no_shipping"],
+                )
+                report = run(dataset, cases, options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+        self.report(report)
+        if options["output"]:
+            self.write(options["output"], report)
+        if not options["baseline"]:
+            return
+        if options["save_baseline"]:
+            self.write(options["baseline"], report)
+            return
+        baseline = json.loads(Path(options["baseline"]).read_text())
+        regressions = compare(report, baseline, options["threshold"])
+        if regressions:
+            raise CommandError(
+                "Регрессии относительно сохраненных результатов:\n"
+                + "\n".join(regressions)
+            )
+        self.stdout.write(
+            self.style.SUCCESS("Регрессий относительно сохраненных нет")
+        )
+
+    def report(self, report: dict):
+        self.stdout.write(
+            f"{'size':>6} {'case':>20} {'queries':>8} "
+            f"{'min ms':>10} {'median ms':>10}"
+        )
+        for result in report["results"]:
+            self.stdout.write(
+                f"{result['size']:>6} {result['case']:>20} "
+                f"{result['queries']:>8} {result['min_ms']:>10.3f} "
+                f"{result['median_ms']:>10.3f}"
+            )
+
+    def write(self, path: str, report: dict):
+        Path(path).write_text(json.dumps(report, indent=2))
+        self.stdout.write(f"Результаты записаны в {path}")
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.jobs import JobWorker
+
+
+class Command(BaseCommand):
+    help = "Выполнение задач синхронизации со stripe из очереди."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Количество одновременно выполняемых задач.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Пауза при пустой очереди (сек).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить готовые задачи и завершиться.",
+        )
+
+    def handle(self, *args, **options):
+        worker = JobWorker(concurrency=options["concurrency"])
+        total = 0
+        while True:
+            executed = worker.run_once()
+            total += executed
+            if executed:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Выполнено задач: {total}"))
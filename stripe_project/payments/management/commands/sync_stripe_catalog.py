@@ -0,0 +1,132 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import override_settings
+
+from payments.gateways import get_gateway
+from payments.jobs import enqueue
+from payments.models import CatalogSyncCheckpoint, Discount, Item, Tax
+from payments.ratelimit import BACKGROUND, TokenBucket, lane
+from payments.services import DiscountService, ProductService, TaxService
+
+# Тип объекта: (модель, синхронизация, тип задачи повтора)
+KINDS = {
+    "items": (Item, ProductService.sync_product, "item.sync"),
+    "discounts": (Discount, DiscountService.sync_coupon, "discount.sync"),
+    "taxes": (Tax, TaxService.sync_tax, "tax.sync"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Синхронизация товаров, скидок и налогов со stripe в пуле потоков. "
+        "Синхронизация продолжается с последней сохраненной точки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--kinds",
+            default=",".join(KINDS),
+            help="Типы объектов через запятую (items,discounts,taxes).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Количество одновременных обращений к stripe.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=20,
+            help="Максимальное количество объектов в секунду.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Размер порции чтения объектов и сохранения точки.",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Начать синхронизацию сначала.",
+        )
+        parser.add_argument(
+            "--fake",
+            action="store_true",
+            help="Использовать платежный шлюз FakeGateway.",
+        )
+
+    def handle(self, *args, **options):
+        kinds = [kind.strip() for kind in options["kinds"].split(",")]
+        unknown = set(kinds) - set(KINDS)
+        if unknown:
+            raise CommandError(f"Неизвестные типы: {', '.join(unknown)}")
+        if options["reset"]:
+            CatalogSyncCheckpoint.objects.filter(kind__in=kinds).delete()
+        settings = (
+            override_settings(
+                PAYMENT_GATEWAY={"BACKEND": "payments.gateways.FakeGateway"}
+            )
+            if options["fake"]
+            else nullcontext()
+        )
+        bucket = TokenBucket(options["rate"])
+        pool = ThreadPoolExecutor(max_workers=options["workers"])
+        with settings, pool:
+            get_gateway.cache_clear()
+            try:
+                for kind in kinds:
+                    self.sync(kind, pool, bucket, options["chunk_size"])
+            finally:
+                get_gateway.cache_clear()
+
+    def sync(self, kind, pool, bucket, chunk_size: int):
+        model, sync, job_kind = KINDS[kind]
+        checkpoint, _ = CatalogSyncCheckpoint.objects.get_or_create(kind=kind)
+
+        def run(obj):
+            bucket.acquire()
+            try:
+                with lane(BACKGROUND):
+                    sync(obj)
+                return None
+            except Exception as e:
+                return obj.pk, e
+            finally:
+                close_old_connections()
+
+        synced = failed = 0
+        start = time.perf_counter()
+        objects = (
+            model.objects.filter(pk__gt=checkpoint.last_pk)
+            .order_by("pk")
+            .iterator(chunk_size=chunk_size)
+        )
+        while True:
+            chunk = list(islice(objects, chunk_size))
+            if not chunk:
+                break
+            errors = [error for error in pool.map(run, chunk) if error]
+            # Неудачные объекты повторяются через очередь задач,
+            # поэтому точка продолжения сдвигается на всю порцию
+            for pk, error in errors:
+                self.stderr.write(f"{kind} {pk}: {error}")
+                enqueue(job_kind, pk)
+            synced += len(chunk) - len(errors)
+            failed += len(errors)
+            checkpoint.last_pk = chunk[-1].pk
+            checkpoint.synced += len(chunk) - len(errors)
+            checkpoint.failed += len(errors)
+            checkpoint.save()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{kind}: {synced + failed} объектов за {elapsed:.1f} с "
+            f"({(synced + failed) / elapsed if elapsed else 0:.1f} obj/s), "
+            f"ошибок: {failed}"
+        )
@@ -0,0 +1,103 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.models import Order
+from payments.pricing import (
+    ROUNDING_MODES,
+    OrderPricing,
+    annotate_items_totals,
+    calculate_annotated_pricing,
+)
+from payments.valuation import COLUMNS, value_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Пакетный расчет стоимости заказов (суммы по валютам). С флагом "
+        "--verify результат сравнивается с расчетом по каждому заказу."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            choices=("numpy", "python"),
+            help="Способ расчета (по умолчанию numpy, если установлен).",
+        )
+        parser.add_argument(
+            "--rounding",
+            choices=ROUNDING_MODES,
+            help="Режим округления (по умолчанию PRICING_ROUNDING).",
+        )
+        parser.add_argument(
+            "--status",
+            help="Только заказы с заданным статусом.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="Размер порции чтения из базы данных.",
+        )
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Сравнить с расчетом по каждому заказу и сохраненными "
+            "итогами, завершиться с ошибкой при расхождениях.",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options["status"]:
+            queryset = queryset.filter(status=options["status"])
+        rounding = options["rounding"] or settings.PRICING_ROUNDING
+        start = time.perf_counter()
+        try:
+            valuation = value_orders(
+                queryset,
+                rounding=rounding,
+                backend=options["backend"],
+                batch_size=options["batch_size"],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{'currency':>8} {'orders':>10} "
+            + " ".join(f"{name:>14}" for name in COLUMNS[1:])
+        )
+        for currency, totals in sorted(valuation.summary().items()):
+            self.stdout.write(
+                f"{currency:>8} {totals['orders']:>10} "
+                + " ".join(f"{totals[name]:>14}" for name in COLUMNS[1:])
+            )
+        self.stdout.write(f"Заказов: {len(valuation)} за {elapsed:.2f} с")
+        if options["verify"]:
+            self.verify(queryset, valuation, rounding, options["batch_size"])
+
+    def verify(self, queryset, valuation, rounding: str, batch_size: int):
+        # Сохраненные итоги рассчитаны с округлением PRICING_ROUNDING
+        compare_totals = rounding == settings.PRICING_ROUNDING
+        orders = (
+            annotate_items_totals(queryset)
+            .order_by("pk")
+            .iterator(chunk_size=batch_size)
+        )
+        mismatched = []
+        for (pk, pricing), order in zip(valuation, orders):
+            expected = calculate_annotated_pricing(order, rounding)
+            if pk != order.pk or pricing != expected:
+                mismatched.append(order.pk)
+            elif compare_totals and OrderPricing.from_totals(order) != pricing:
+                mismatched.append(order.pk)
+        if mismatched:
+            preview = ", ".join(str(pk) for pk in mismatched[:20])
+            raise CommandError(
+                f"Расчет не совпадает у {len(mismatched)} заказов: {preview}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Пакетный расчет совпадает с расчетом по каждому заказу"
+            )
+        )
@@ -0,0 +1,325 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+from django.utils.deprecation import MiddlewareMixin
+
+
+class RequestMetrics:
+    """Количество и время операций (db, stripe, render) в запросе."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = {}
+
+    def record(self, name: str, duration: float):
+        count, total = self.timings.get(name, (0, 0.0))
+        self.timings[name] = (count + 1, total + duration)
+
+    def count(self, name: str) -> int:
+        return self.timings.get(name, (0, 0.0))[0]
+
+    def duration(self, name: str) -> float:
+        return self.timings.get(name, (0, 0.0))[1]
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar(
+    "current_metrics", default=None
+)
+
+
+@contextmanager
+def measure(name: str):
+    """Учитывает время блока в метриках текущего запроса (если они
+    собираются)."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record(name, time.perf_counter() - start)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Обертка выполнения SQL-запросов (connection.execute_wrapper)."""
+    with measure("db"):
+        return execute(sql, params, many, context)
+
+
+class Template:
+    """Шаблон, время отрисовки которого учитывается в метриках."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with measure("render"):
+            return self.template.render(context, request)
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """Шаблонизатор Django с учетом времени отрисовки шаблонов."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
+
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Гистограмма Prometheus с одной меткой (по умолчанию view — имя
+    маршрута).
+
+    Args:
+        name: Имя метрики.
+        description: Описание метрики (HELP).
+        buckets: Верхние границы интервалов.
+        label: Имя метки.
+    """
+
+    def __init__(
+        self, name: str, description: str, buckets: tuple, label="view"
+    ):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, view: str, value: float):
+        # Последний интервал — значения больше всех границ (+Inf)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if view not in self.series:
+                self.series[view] = [[0] * (len(self.buckets) + 1), 0.0]
+            series = self.series[view]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            series = {
+                view: (list(counts), total)
+                for view, (counts, total) in self.series.items()
+            }
+        for view, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{view}"'
+            cumulative = 0
+            for bound, value in zip((*self.buckets, "+Inf"), counts):
+                cumulative += value
+                lines.append(
+                    f'{self.name}_bucket{{{label},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Значение (gauge) или счетчик (counter) Prometheus с одной меткой.
+
+    Args:
+        name: Имя метрики.
+        description: Описание метрики (HELP).
+        label: Имя метки.
+        kind: Тип метрики (gauge, counter).
+    """
+
+    def __init__(
+        self, name: str, description: str, label: str, kind="gauge"
+    ):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.kind = kind
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def add(self, key: str, value: float):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{{{self.label}="{key}"}} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    """Гистограммы метрик запросов по именам маршрутов (в памяти процесса).
+
+    Каждый процесс (воркер gunicorn) ведет собственные гистограммы:
+    ответ /metrics содержит данные процесса, обработавшего запрос.
+    """
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            "payments_request_duration_seconds",
+            "Request processing time.",
+            TIME_BUCKETS,
+        )
+        self.db_queries = Histogram(
+            "payments_db_queries",
+            "SQL queries per request.",
+            COUNT_BUCKETS,
+        )
+        self.db_duration = Histogram(
+            "payments_db_duration_seconds",
+            "SQL query time per request.",
+            TIME_BUCKETS,
+        )
+        self.stripe_calls = Histogram(
+            "payments_stripe_calls",
+            "Payment gateway calls per request.",
+            COUNT_BUCKETS,
+        )
+        self.stripe_duration = Histogram(
+            "payments_stripe_duration_seconds",
+            "Payment gateway time per request.",
+            TIME_BUCKETS,
+        )
+        self.render_duration = Histogram(
+            "payments_render_duration_seconds",
+            "Template rendering time per request.",
+            TIME_BUCKETS,
+        )
+        # Очереди ограничения частоты обращений к stripe (ratelimit)
+        self.stripe_wait = Histogram(
+            "payments_stripe_wait_seconds",
+            "Payment gateway rate limit wait time.",
+            TIME_BUCKETS,
+            label="lane",
+        )
+        self.stripe_queue_depth = Gauge(
+            "payments_stripe_queue_depth",
+            "Payment gateway calls waiting for the rate limit.",
+            label="lane",
+        )
+        self.stripe_throttled = Gauge(
+            "payments_stripe_throttled_total",
+            "Payment gateway 429 responses.",
+            label="lane",
+            kind="counter",
+        )
+        self.stripe_circuit = Gauge(
+            "payments_stripe_circuit_events_total",
+            "Payment gateway circuit breaker events.",
+            label="event",
+            kind="counter",
+        )
+
+    @property
+    def metrics(self) -> list:
+        return [
+            self.request_duration,
+            self.db_queries,
+            self.db_duration,
+            self.stripe_calls,
+            self.stripe_duration,
+            self.render_duration,
+            self.stripe_wait,
+            self.stripe_queue_depth,
+            self.stripe_throttled,
+            self.stripe_circuit,
+        ]
+
+    def observe(self, view: str, metrics: RequestMetrics, elapsed: float):
+        self.request_duration.observe(view, elapsed)
+        self.db_queries.observe(view, metrics.count("db"))
+        self.db_duration.observe(view, metrics.duration("db"))
+        self.stripe_calls.observe(view, metrics.count("stripe"))
+        self.stripe_duration.observe(view, metrics.duration("stripe"))
+        self.render_duration.observe(view, metrics.duration("render"))
+
+    def render(self) -> str:
+        return "\n".join(
+            line
+            for metric in self.metrics
+            for line in metric.render()
+        ) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def server_timing(metrics: RequestMetrics, elapsed: float) -> str:
+    """Значение заголовка Server-Timing (длительности в мс)."""
+    entries = [
+        f'db;desc="{metrics.count("db")} queries";'
+        f'dur={metrics.duration("db") * 1000:.1f}',
+        f'stripe;desc="{metrics.count("stripe")} calls";'
+        f'dur={metrics.duration("stripe") * 1000:.1f}',
+        f'stripe-wait;dur={metrics.duration("stripe_wait") * 1000:.1f}',
+        f'render;dur={metrics.duration("render") * 1000:.1f}',
+        f"total;dur={elapsed * 1000:.1f}",
+    ]
+    return ", ".join(entries)
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Сбор метрик запросов (включается настройкой METRICS_ENABLED).
+
+    Учитывает количество и время SQL-запросов, обращений к платежному
+    шлюзу (и ожидания ограничения частоты) и отрисовки шаблонов.
+    Метрики добавляются в ответ заголовком Server-Timing и в гистограммы
+    по имени маршрута (/metrics).
+    Для потоковых ответов учитывается время до начала передачи.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_request(self, request):
+        # Обертка устанавливается один раз на соединение каждого потока
+        for connection in connections.all():
+            if execute_wrapper not in connection.execute_wrappers:
+                connection.execute_wrappers.append(execute_wrapper)
+        request._metrics = RequestMetrics()
+        current_metrics.set(request._metrics)
+
+    def process_response(self, request, response):
+        metrics = getattr(request, "_metrics", None)
+        if metrics is None:
+            return response
+        current_metrics.set(None)
+        elapsed = metrics.elapsed()
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else "unresolved"
+        registry.observe(view, metrics, elapsed)
+        response["Server-Timing"] = server_timing(metrics, elapsed)
+        return response
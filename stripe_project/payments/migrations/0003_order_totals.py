@@ -0,0 +1,103 @@
+# Generated by Django 3.2.6 on 2026-10-18 15:42
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+TOTALS_FIELDS = (
+    "items_count",
+    "gross_amount",
+    "discount_amount",
+    "tax_amount",
+    "shipping_amount",
+    "final_amount",
+    "currency",
+)
+
+
+def fill_order_totals(apps, schema_editor):
+    # Итоги существующих заказов заполняются один раз при миграции
+    # (расчет совпадает с payments.pricing.calculate_pricing)
+    Order = apps.get_model("payments", "Order")
+    orders = []
+    queryset = (
+        Order.objects.select_related("discount", "tax", "shipping")
+        .annotate(
+            items_gross=Sum("items__price"),
+            items_total=Count("items"),
+            items_currency=Min("items__currency"),
+        )
+        .order_by("pk")
+    )
+    for order in queryset.iterator(chunk_size=500):
+        gross = order.items_gross or 0
+        discount = 0
+        if order.discount:
+            discount = int(gross * order.discount.percent_off // 100)
+        subtotal = gross - discount
+        tax = tax_exclusive = 0
+        if order.tax and order.tax.behavior == "inclusive":
+            percentage = order.tax.percentage
+            tax = int(subtotal * percentage // (100 + percentage))
+        elif order.tax and order.tax.behavior == "exclusive":
+            tax = tax_exclusive = int(subtotal * order.tax.percentage // 100)
+        shipping = order.shipping.amount if order.shipping else 0
+        order.items_count = order.items_total
+        order.gross_amount = gross
+        order.discount_amount = discount
+        order.tax_amount = tax
+        order.shipping_amount = shipping
+        order.final_amount = subtotal + tax_exclusive + shipping
+        order.currency = order.items_currency or settings.DEFAULT_CURRENCY
+        orders.append(order)
+        if len(orders) >= 500:
+            Order.objects.bulk_update(orders, TOTALS_FIELDS)
+            orders = []
+    if orders:
+        Order.objects.bulk_update(orders, TOTALS_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_auto_20240304_1409'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='currency',
+            field=models.CharField(choices=[('usd', '$USD'), ('rub', 'Рубль')], default='usd', editable=False, max_length=5, verbose_name='Валюта'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount_amount',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Скидка (коп)'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='final_amount',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Итого (коп)'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='gross_amount',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Сумма товаров (коп)'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='shipping_amount',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Доставка (коп)'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='tax_amount',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Налог (коп)'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.6 on 2026-10-18 15:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('intent_id', models.CharField(max_length=255, unique=True, verbose_name='Идентификатор stripe')),
+                ('client_secret', models.CharField(max_length=255, verbose_name='Секрет клиента')),
+                ('amount', models.PositiveBigIntegerField(verbose_name='Сумма (коп)')),
+                ('currency', models.CharField(choices=[('usd', '$USD'), ('rub', 'Рубль')], max_length=5, verbose_name='Валюта')),
+                ('status', models.CharField(choices=[('requires_payment_method', 'Requires Payment Method'), ('requires_confirmation', 'Requires Confirmation'), ('requires_action', 'Requires Action'), ('processing', 'Processing'), ('requires_capture', 'Requires Capture'), ('canceled', 'Canceled'), ('succeeded', 'Succeeded')], default='requires_payment_method', max_length=30, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменен')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_attempts', to='payments.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Попытка оплаты',
+                'verbose_name_plural': 'Попытки оплаты',
+                'ordering': ('-created_at', '-pk'),
+            },
+        ),
+    ]
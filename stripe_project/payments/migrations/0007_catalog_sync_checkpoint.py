@@ -0,0 +1,28 @@
+# Generated by Django 3.2.6 on 2026-10-18 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_stripe_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSyncCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, unique=True, verbose_name='Тип')),
+                ('last_pk', models.PositiveBigIntegerField(default=0, verbose_name='Последний синхронизированный объект')),
+                ('synced', models.PositiveIntegerField(default=0, verbose_name='Синхронизировано')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Ошибок')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменено')),
+            ],
+            options={
+                'verbose_name': 'Синхронизация каталога',
+                'verbose_name_plural': 'Синхронизация каталога',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.6 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_catalog_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Stripe id цены'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Stripe id'),
+        ),
+    ]
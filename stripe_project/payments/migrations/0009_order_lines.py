@@ -0,0 +1,60 @@
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_unit_price(apps, schema_editor):
+    Item = apps.get_model("payments", "Item")
+    OrderLine = apps.get_model("payments", "OrderLine")
+    OrderLine.objects.filter(unit_price__isnull=True).update(
+        unit_price=Subquery(
+            Item.objects.filter(pk=OuterRef("item_id")).values("price")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_item_stripe_ids'),
+    ]
+
+    operations = [
+        # Таблица связи заказов и товаров уже существует,
+        # модель OrderLine создается только в состоянии миграций
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderLine',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='payments.item', verbose_name='Товар')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='payments.order', verbose_name='Заказ')),
+                    ],
+                    options={
+                        'verbose_name': 'Позиция заказа',
+                        'verbose_name_plural': 'Позиции заказа',
+                        'db_table': 'payments_order_items',
+                        'unique_together': {('order', 'item')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='items',
+                    field=models.ManyToManyField(related_name='orders', through='payments.OrderLine', to='payments.Item', verbose_name='Список заказов'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='unit_price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена (коп)'),
+        ),
+        migrations.RunPython(fill_unit_price, migrations.RunPython.noop),
+    ]
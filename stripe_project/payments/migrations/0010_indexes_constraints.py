@@ -0,0 +1,90 @@
+# Generated by Django 3.2.6 on 2026-10-18 16:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def clear_duplicate(model, field: str):
+    """Очищает повторяющиеся значения поля (кроме первого по порядку
+    создания), такие объекты будут синхронизированы со stripe заново."""
+    seen = set()
+    duplicates = []
+    for pk, value in (
+        model.objects.exclude(**{field: ""})
+        .order_by("pk")
+        .values_list("pk", field)
+    ):
+        if value in seen:
+            duplicates.append(pk)
+        seen.add(value)
+    model.objects.filter(pk__in=duplicates).update(**{field: ""})
+
+
+def clear_duplicate_stripe_ids(apps, schema_editor):
+    Item = apps.get_model("payments", "Item")
+    Tax = apps.get_model("payments", "Tax")
+    clear_duplicate(Item, "stripe_product_id")
+    clear_duplicate(Item, "stripe_price_id")
+    clear_duplicate(Tax, "tax_id")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_order_lines'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='orderline',
+            constraint=models.UniqueConstraint(fields=('order', 'item'), name='order_line_unique_item'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='orderline',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='orderline',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='payments.order', verbose_name='Заказ'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['name', 'currencymixin_ptr'], name='item_name_pk_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-paid_at'], name='order_status_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('paid_at__isnull', False)), fields=['-paid_at'], name='order_paid_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stripejob',
+            index=models.Index(fields=['status', 'run_after'], name='stripe_job_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stripejob',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['kind', 'object_id'], name='stripe_job_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='webhook_event_pending_idx'),
+        ),
+        migrations.RunPython(
+            clear_duplicate_stripe_ids, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_product_id', ''), _negated=True), fields=('stripe_product_id',), name='item_unique_stripe_product_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_price_id', ''), _negated=True), fields=('stripe_price_id',), name='item_unique_stripe_price_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='tax',
+            constraint=models.UniqueConstraint(condition=models.Q(('tax_id', ''), _negated=True), fields=('tax_id',), name='tax_unique_stripe_id'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.6 on 2026-10-18 16:55
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_indexes_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('usd', '$USD'), ('rub', 'Рубль'), ('eur', '€EUR'), ('gbp', '£GBP'), ('cny', '¥CNY')], max_length=5, verbose_name='Исходная валюта')),
+                ('target', models.CharField(choices=[('usd', '$USD'), ('rub', 'Рубль'), ('eur', '€EUR'), ('gbp', '£GBP'), ('cny', '¥CNY')], max_length=5, verbose_name='Валюта пересчета')),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=20, validators=[django.core.validators.MinValueValidator(Decimal('1E-10'))], verbose_name='Курс')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменен')),
+            ],
+            options={
+                'verbose_name': 'Курс валюты',
+                'verbose_name_plural': 'Курсы валют',
+                'ordering': ('source', 'target'),
+            },
+        ),
+        migrations.AlterField(
+            model_name='currencymixin',
+            name='currency',
+            field=models.CharField(choices=[('usd', '$USD'), ('rub', 'Рубль'), ('eur', '€EUR'), ('gbp', '£GBP'), ('cny', '¥CNY')], default='rub', max_length=5, verbose_name='Валюта'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='currency',
+            field=models.CharField(choices=[('usd', '$USD'), ('rub', 'Рубль'), ('eur', '€EUR'), ('gbp', '£GBP'), ('cny', '¥CNY')], default='usd', editable=False, max_length=5, verbose_name='Валюта расчетов'),
+        ),
+        migrations.AlterField(
+            model_name='paymentattempt',
+            name='currency',
+            field=models.CharField(choices=[('usd', '$USD'), ('rub', 'Рубль'), ('eur', '€EUR'), ('gbp', '£GBP'), ('cny', '¥CNY')], max_length=5, verbose_name='Валюта'),
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('source', 'target'), name='exchange_rate_unique_pair'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0012_webhook_next_attempt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SharedCounter',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Имя')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+                ('expires', models.FloatField(verbose_name='Действует до')),
+            ],
+            options={
+                'verbose_name': 'Общий счетчик',
+                'verbose_name_plural': 'Общие счетчики',
+            },
+        ),
+    ]
@@ -1,12 +1,21 @@
+from decimal import Decimal
+
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 
 class Currency(models.TextChoices):
+    # Суммы хранятся в сотых долях единицы валюты, поэтому допустимы
+    # только валюты с двумя знаками после запятой
     USD = "usd", "$USD"
     RUB = "rub", "Рубль"
+    EUR = "eur", "€EUR"
+    GBP = "gbp", "£GBP"
+    CNY = "cny", "¥CNY"
 
 
 class TaxBehavior(models.TextChoices):
@@ -14,6 +23,36 @@ class TaxBehavior(models.TextChoices):
     EXCLUSIVE = "exclusive"
 
 
+class PaymentStatus(models.TextChoices):
+    """Статусы PaymentIntent в stripe."""
+
+    REQUIRES_PAYMENT_METHOD = "requires_payment_method"
+    REQUIRES_CONFIRMATION = "requires_confirmation"
+    REQUIRES_ACTION = "requires_action"
+    PROCESSING = "processing"
+    REQUIRES_CAPTURE = "requires_capture"
+    CANCELED = "canceled"
+    SUCCEEDED = "succeeded"
+
+
+class OrderStatus(models.TextChoices):
+    NEW = "new", "Новый"
+    PAID = "paid", "Оплачен"
+
+
+class WebhookEventStatus(models.TextChoices):
+    PENDING = "pending", "Ожидает обработки"
+    PROCESSED = "processed", "Обработано"
+    FAILED = "failed", "Ошибка"
+
+
+class JobStatus(models.TextChoices):
+    PENDING = "pending", "Ожидает выполнения"
+    RUNNING = "running", "Выполняется"
+    SUCCEEDED = "succeeded", "Выполнено"
+    FAILED = "failed", "Ошибка"
+
+
 class CurrencyMixin(models.Model):
     currency = models.CharField(
         max_length=5,
@@ -27,11 +66,41 @@ class Item(CurrencyMixin):
     name = models.CharField(max_length=255, verbose_name="Наименование")
     description = models.CharField(max_length=255, verbose_name="Описание")
     price = models.PositiveIntegerField(verbose_name="Цена (коп)")
+    stripe_product_id = models.CharField(
+        max_length=255, blank=True, editable=False, verbose_name="Stripe id"
+    )
+    # Пусто, пока цена в stripe не соответствует цене и валюте товара
+    stripe_price_id = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        verbose_name="Stripe id цены",
+    )
 
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ("name",)
+        # Валюта хранится в таблице CurrencyMixin (multi-table), поэтому
+        # индекс по валюте и наименованию невозможен; список товаров
+        # упорядочен по наименованию и идентификатору (KeysetPagination)
+        indexes = [
+            models.Index(
+                fields=["name", "currencymixin_ptr"], name="item_name_pk_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["stripe_product_id"],
+                condition=~models.Q(stripe_product_id=""),
+                name="item_unique_stripe_product_id",
+            ),
+            models.UniqueConstraint(
+                fields=["stripe_price_id"],
+                condition=~models.Q(stripe_price_id=""),
+                name="item_unique_stripe_price_id",
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -81,6 +150,14 @@ class Tax(models.Model):
         verbose_name = "Налог"
         verbose_name_plural = "Налоги"
         ordering = ("name",)
+        # tax_id пуст, пока налог не синхронизирован со stripe
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tax_id"],
+                condition=~models.Q(tax_id=""),
+                name="tax_unique_stripe_id",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name} {self.percentage}% ({self.behavior})"
@@ -108,8 +185,61 @@ class ShippingTax(CurrencyMixin):
         return f"{self.name} {self.amount / 100} ({self.currency})"
 
 
+class ExchangeRate(models.Model):
+    """Курс пересчета сумм из валюты source в валюту target.
+
+    Курсы загружаются из файла (команда load_exchange_rates) или фикстуры
+    и используются через матрицу курсов в памяти процесса
+    (см. payments/exchange.py).
+    """
+
+    source = models.CharField(
+        max_length=5, verbose_name="Исходная валюта", choices=Currency.choices
+    )
+    target = models.CharField(
+        max_length=5, verbose_name="Валюта пересчета", choices=Currency.choices
+    )
+    rate = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+        validators=[MinValueValidator(Decimal("0.0000000001"))],
+        verbose_name="Курс",
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменен")
+
+    class Meta:
+        verbose_name = "Курс валюты"
+        verbose_name_plural = "Курсы валют"
+        ordering = ("source", "target")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source", "target"], name="exchange_rate_unique_pair"
+            ),
+        ]
+
+    def __str__(self):
+        return f"1 {self.source} = {self.rate} {self.target}"
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Итоги позиций, скидка, налог и доставка заказов (в SQL).
+
+        См. pricing.annotate_items_totals и calculate_annotated_pricing.
+        """
+        from .pricing import annotate_items_totals
+
+        return annotate_items_totals(self)
+
+    def for_payment_intents(self, intent_ids):
+        """Заказы по идентификаторам PaymentIntent stripe."""
+        return self.filter(payment_attempts__intent_id__in=intent_ids)
+
+
 class Order(models.Model):
-    items = models.ManyToManyField(Item, verbose_name="Список заказов")
+    items = models.ManyToManyField(
+        Item, through="OrderLine", verbose_name="Список заказов"
+    )
     discount = models.ForeignKey(
         Discount,
         blank=True,
@@ -131,11 +261,61 @@ class Order(models.Model):
         on_delete=models.SET_NULL,
         verbose_name="Доставка",
     )
+    status = models.CharField(
+        max_length=15,
+        editable=False,
+        verbose_name="Статус",
+        choices=OrderStatus.choices,
+        default=OrderStatus.NEW,
+    )
+    paid_at = models.DateTimeField(
+        blank=True, null=True, editable=False, verbose_name="Оплачен"
+    )
+    # Денормализованные итоги заказа, поддерживаются сигналами
+    # (см. payments/signals.py) и командой rebuild_order_totals.
+    items_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество товаров"
+    )
+    gross_amount = models.PositiveBigIntegerField(
+        default=0, editable=False, verbose_name="Сумма товаров (коп)"
+    )
+    discount_amount = models.PositiveBigIntegerField(
+        default=0, editable=False, verbose_name="Скидка (коп)"
+    )
+    tax_amount = models.PositiveBigIntegerField(
+        default=0, editable=False, verbose_name="Налог (коп)"
+    )
+    shipping_amount = models.PositiveBigIntegerField(
+        default=0, editable=False, verbose_name="Доставка (коп)"
+    )
+    final_amount = models.PositiveBigIntegerField(
+        default=0, editable=False, verbose_name="Итого (коп)"
+    )
+    currency = models.CharField(
+        max_length=5,
+        editable=False,
+        verbose_name="Валюта расчетов",
+        choices=Currency.choices,
+        default=settings.DEFAULT_CURRENCY,
+    )
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         default_related_name = "orders"
+        indexes = [
+            # Отчеты и выгрузка заказов по статусу и дате оплаты
+            models.Index(
+                fields=["status", "-paid_at"], name="order_status_paid_idx"
+            ),
+            models.Index(
+                fields=["-paid_at"],
+                condition=models.Q(paid_at__isnull=False),
+                name="order_paid_at_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"id: {self.pk}"
@@ -143,55 +323,300 @@ class Order(models.Model):
     def get_absolute_url(self):
         return reverse("payments:order_detail", kwargs={"pk": self.pk})
 
+    @cached_property
+    def pricing(self):
+        """Стоимость заказа (OrderPricing) по сохраненным итогам."""
+        from .pricing import OrderPricing
+
+        return OrderPricing.from_totals(self)
+
+    def reset_pricing(self):
+        """Сбрасывает ранее рассчитанную стоимость заказа."""
+        self.__dict__.pop("pricing", None)
+
     def get_order_price(self) -> int:
         """Общая сумма заказа (копеек)."""
-        return sum(item.price for item in self.items.all())
+        return self.pricing.gross
 
     def get_discount_amount(self) -> int:
         """Cумма скидки (копеек)."""
-        if self.discount:
-            return self.get_order_price() * self.discount.percent_off // 100
-        return 0
+        return self.pricing.discount
 
     def get_order_subtotal(self) -> int:
-        return self.get_order_price() - self.get_discount_amount()
+        return self.pricing.subtotal
 
     def get_tax_amount_inclusive(self) -> int:
         """Cумма налога включенного в стоимость (копеек)."""
-        if self.tax and self.tax.behavior == TaxBehavior.INCLUSIVE:
-            return (
-                self.get_order_subtotal()
-                * self.tax.percentage
-                // (100 + self.tax.percentage)
-            )
-        return 0
+        return self.pricing.tax_inclusive
 
     def get_tax_amount(self) -> int:
         """Cумма налога вне зависимости от типа (копеек)."""
-        return self.get_tax_amount_exlusive() + self.get_tax_amount_inclusive()
+        return self.pricing.tax
 
     def get_tax_amount_exlusive(self) -> int:
         """Cумма дополнительно налога (копеек)."""
-        if self.tax and self.tax.behavior == TaxBehavior.EXCLUSIVE:
-            return self.get_order_subtotal() * self.tax.percentage // 100
-        return 0
+        return self.pricing.tax_exclusive
 
     def get_shipping_amount(self) -> int:
         """Cумма доставки (копеек)."""
-        if self.shipping:
-            return self.shipping.amount
-        return 0
+        return self.pricing.shipping
 
     def get_final_price(self) -> int:
         """Итоговая сумма заказа (копеек)."""
-        return (
-            self.get_order_subtotal()
-            + self.get_tax_amount_exlusive()
-            + self.get_shipping_amount()
-        )
+        return self.pricing.final
 
     def get_currency(self) -> str:
-        """Текущая валюта заказа."""
-        if self.items.exists():
-            return self.items.first().currency
-        return settings.DEFAULT_CURRENCY
+        """Валюта расчетов заказа (см. exchange.get_settlement_currency)."""
+        return self.pricing.currency
+
+
+class OrderLine(models.Model):
+    """Товарная позиция заказа.
+
+    Цена товара запоминается при добавлении позиции в заказ, поэтому
+    последующее изменение цены товара не меняет стоимость заказа.
+    """
+
+    # Позиции заказа выбираются по уникальному индексу (order, item),
+    # отдельный индекс внешнего ключа не нужен
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name="lines",
+        db_index=False,
+        verbose_name="Заказ",
+    )
+    item = models.ForeignKey(
+        Item,
+        on_delete=models.CASCADE,
+        related_name="order_lines",
+        verbose_name="Товар",
+    )
+    quantity = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        verbose_name="Количество",
+    )
+    # Заполняется сигналом при добавлении через order.items.add()
+    unit_price = models.PositiveIntegerField(
+        blank=True, null=True, verbose_name="Цена (коп)"
+    )
+
+    class Meta:
+        db_table = "payments_order_items"
+        verbose_name = "Позиция заказа"
+        verbose_name_plural = "Позиции заказа"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order", "item"], name="order_line_unique_item"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.item} x {self.quantity}"
+
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.item.price
+        super().save(*args, **kwargs)
+
+    @property
+    def price(self) -> int:
+        """Цена единицы товара в позиции (копеек)."""
+        if self.unit_price is None:
+            return self.item.price
+        return self.unit_price
+
+    @property
+    def amount(self) -> int:
+        """Стоимость позиции (копеек)."""
+        return self.quantity * self.price
+
+
+class PaymentAttempt(models.Model):
+    """Созданный в stripe PaymentIntent для оплаты заказа."""
+
+    # PaymentIntent в этих статусах еще может быть оплачен клиентом
+    REUSABLE_STATUSES = (
+        PaymentStatus.REQUIRES_PAYMENT_METHOD,
+        PaymentStatus.REQUIRES_CONFIRMATION,
+        PaymentStatus.REQUIRES_ACTION,
+    )
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name="payment_attempts",
+        verbose_name="Заказ",
+    )
+    intent_id = models.CharField(
+        max_length=255, unique=True, verbose_name="Идентификатор stripe"
+    )
+    client_secret = models.CharField(
+        max_length=255, verbose_name="Секрет клиента"
+    )
+    amount = models.PositiveBigIntegerField(verbose_name="Сумма (коп)")
+    currency = models.CharField(
+        max_length=5, verbose_name="Валюта", choices=Currency.choices
+    )
+    status = models.CharField(
+        max_length=30,
+        verbose_name="Статус",
+        choices=PaymentStatus.choices,
+        default=PaymentStatus.REQUIRES_PAYMENT_METHOD,
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="Создан"
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменен")
+
+    class Meta:
+        verbose_name = "Попытка оплаты"
+        verbose_name_plural = "Попытки оплаты"
+        ordering = ("-created_at", "-pk")
+
+    def __str__(self):
+        return f"{self.intent_id} ({self.status})"
+
+    @property
+    def is_reusable(self) -> bool:
+        return self.status in self.REUSABLE_STATUSES
+
+
+class WebhookEvent(models.Model):
+    """Полученное от stripe событие, ожидающее обработки."""
+
+    event_id = models.CharField(
+        max_length=255, unique=True, verbose_name="Идентификатор stripe"
+    )
+    type = models.CharField(max_length=100, verbose_name="Тип")
+    payload = models.TextField(verbose_name="Содержимое")
+    status = models.CharField(
+        max_length=15,
+        verbose_name="Статус",
+        choices=WebhookEventStatus.choices,
+        default=WebhookEventStatus.PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name="Попыток обработки"
+    )
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now, verbose_name="Обработать после"
+    )
+    received_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="Получено"
+    )
+    processed_at = models.DateTimeField(
+        blank=True, null=True, verbose_name="Обработано"
+    )
+
+    class Meta:
+        verbose_name = "Событие stripe"
+        verbose_name_plural = "События stripe"
+        ordering = ("-received_at", "-pk")
+        indexes = [
+            # Очередь необработанных событий (WebhookService.process)
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status=WebhookEventStatus.PENDING),
+                name="webhook_event_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} ({self.type})"
+
+
+class StripeJob(models.Model):
+    """Отложенная синхронизация объекта со stripe (см. payments/jobs.py)."""
+
+    kind = models.CharField(max_length=50, verbose_name="Тип")
+    object_id = models.PositiveBigIntegerField(
+        verbose_name="Идентификатор объекта"
+    )
+    status = models.CharField(
+        max_length=15,
+        verbose_name="Статус",
+        choices=JobStatus.choices,
+        default=JobStatus.PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name="Попыток выполнения"
+    )
+    run_after = models.DateTimeField(
+        default=timezone.now, verbose_name="Выполнить после"
+    )
+    last_error = models.TextField(blank=True, verbose_name="Ошибка")
+    locked_by = models.CharField(
+        max_length=100, blank=True, verbose_name="Обработчик"
+    )
+    locked_at = models.DateTimeField(
+        blank=True, null=True, verbose_name="Начало выполнения"
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="Создано"
+    )
+    finished_at = models.DateTimeField(
+        blank=True, null=True, verbose_name="Завершено"
+    )
+
+    class Meta:
+        verbose_name = "Задача синхронизации stripe"
+        verbose_name_plural = "Задачи синхронизации stripe"
+        ordering = ("-created_at", "-pk")
+        indexes = [
+            # Выбор задач к выполнению (JobWorker.claim)
+            models.Index(
+                fields=["status", "run_after"], name="stripe_job_status_idx"
+            ),
+            # Поиск ожидающей задачи объекта (enqueue)
+            models.Index(
+                fields=["kind", "object_id"],
+                condition=models.Q(status=JobStatus.PENDING),
+                name="stripe_job_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} ({self.status})"
+
+
+class CatalogSyncCheckpoint(models.Model):
+    """Точка продолжения синхронизации каталога со stripe."""
+
+    kind = models.CharField(max_length=50, unique=True, verbose_name="Тип")
+    last_pk = models.PositiveBigIntegerField(
+        default=0, verbose_name="Последний синхронизированный объект"
+    )
+    synced = models.PositiveIntegerField(
+        default=0, verbose_name="Синхронизировано"
+    )
+    failed = models.PositiveIntegerField(default=0, verbose_name="Ошибок")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменено")
+
+    class Meta:
+        verbose_name = "Синхронизация каталога"
+        verbose_name_plural = "Синхронизация каталога"
+
+    def __str__(self):
+        return f"{self.kind}: {self.last_pk}"
+
+
+class SharedCounter(models.Model):
+    """Счетчик, общий для процессов (см. payments/counters.py)."""
+
+    name = models.CharField(
+        max_length=100, primary_key=True, verbose_name="Имя"
+    )
+    value = models.BigIntegerField(default=0, verbose_name="Значение")
+    # Время истечения (unix time): истекший счетчик сбрасывается
+    # при следующем увеличении
+    expires = models.FloatField(verbose_name="Действует до")
+
+    class Meta:
+        verbose_name = "Общий счетчик"
+        verbose_name_plural = "Общие счетчики"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
@@ -0,0 +1,153 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class PageCache:
+    """Кэш отрисованных страниц каталога и заказов.
+
+    Каждая страница зависит от набора областей (item:1, items, order:5,
+    orders). Версия области — время ее последнего изменения, которое
+    обновляется сигналами при изменении объектов. Ключ страницы включает
+    версии всех ее областей, поэтому после изменения объекта устаревшие
+    записи не выдаются и вытесняются из кэша по времени жизни.
+    """
+
+    prefix = "page"
+
+    def __init__(self, alias: str = "default", timeout: int = None):
+        self.alias = alias
+        self.timeout = timeout or settings.PAGE_CACHE_TIMEOUT
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version_key(self, scope: str) -> str:
+        return f"{self.prefix}:version:{scope}"
+
+    def get_versions(self, scopes: list[str]) -> dict:
+        """Возвращает версии областей (время изменения, сек).
+
+        Отсутствующие в кэше версии (вытесненные или еще не созданные)
+        инициализируются текущим временем.
+        """
+        keys = {self.version_key(scope): scope for scope in scopes}
+        stored = self.cache.get_many(keys)
+        missing = {key: time.time() for key in keys if key not in stored}
+        if missing:
+            for key, version in missing.items():
+                self.cache.add(key, version, None)
+            stored.update(self.cache.get_many(missing))
+        return {keys[key]: stored.get(key, time.time()) for key in keys}
+
+    def touch(self, *scopes: str):
+        """Отмечает изменение областей (страницы будут отрисованы заново).
+
+        Версии обновляются после фиксации транзакции, иначе параллельный
+        запрос мог бы сохранить под новой версией еще не измененные данные.
+        """
+        if not scopes:
+            return
+
+        def update():
+            now = time.time()
+            self.cache.set_many(
+                {self.version_key(scope): now for scope in scopes}, None
+            )
+
+        transaction.on_commit(update)
+
+    def touch_items(self, *pks: int):
+        self.touch("items", *(f"item:{pk}" for pk in pks))
+
+    def touch_orders(self, *pks: int):
+        self.touch("orders", *(f"order:{pk}" for pk in pks))
+
+    def make_key(self, view: str, path: str, versions: dict) -> str:
+        signature = hashlib.sha256(
+            repr((path, sorted(versions.items()))).encode()
+        ).hexdigest()
+        return f"{self.prefix}:{view}:{signature}"
+
+    def serve(self, request, view: str, scopes: list[str], render):
+        """Возвращает страницу из кэша или отрисовывает ее.
+
+        Поддерживаются условные запросы (If-None-Match,
+        If-Modified-Since): при совпадении версии возвращается 304
+        без обращения к базе данных и отрисовки.
+
+        Args:
+            request: Объект запроса.
+            view: Имя представления (для ключа и статистики).
+            scopes: Области, от которых зависит страница.
+            render: Функция отрисовки страницы, возвращает HttpResponse.
+        """
+        versions = self.get_versions(scopes)
+        key = self.make_key(view, request.get_full_path(), versions)
+        etag = quote_etag(key.rsplit(":", 1)[1][:32])
+        last_modified = int(max(versions.values()))
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            self.count(view, "not_modified")
+            return not_modified
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.count(view, "hits")
+            response = HttpResponse(
+                cached["content"], content_type=cached["content_type"]
+            )
+        else:
+            self.count(view, "misses")
+            response = render()
+            if hasattr(response, "render"):
+                response.render()
+            if response.status_code != 200:
+                return response
+            self.cache.set(
+                key,
+                {
+                    "content": response.content,
+                    "content_type": response["Content-Type"],
+                },
+                self.timeout,
+            )
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def count(self, view: str, name: str):
+        key = f"{self.prefix}:stats:{view}:{name}"
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            pass  # запись вытеснена из кэша (или кэш отключен)
+
+    def stats(self, views: list[str]) -> dict:
+        """Попадания, промахи и ответы 304 по представлениям."""
+        stats = {}
+        for view in views:
+            hits, misses, not_modified = (
+                self.cache.get(f"{self.prefix}:stats:{view}:{name}", 0)
+                for name in ("hits", "misses", "not_modified")
+            )
+            total = hits + misses + not_modified
+            stats[view] = {
+                "hits": hits,
+                "misses": misses,
+                "not_modified": not_modified,
+                "hit_rate": (hits + not_modified) / total if total else 0.0,
+            }
+        return stats
+
+
+page_cache = PageCache()
@@ -0,0 +1,119 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import Q
+from django.http import Http404
+
+
+class KeysetPaginationMixin:
+    """Постраничный вывод ListView по ключу (cursor) вместо OFFSET.
+
+    Следующая страница выбирается условием на значения полей keyset
+    последней строки текущей страницы, поэтому время запроса не зависит
+    от номера страницы, а количество строк не подсчитывается.
+
+    Attributes:
+        keyset: Поля сортировки (уникальные в совокупности, "-" для
+            сортировки по убыванию).
+        page_size: Количество строк на странице.
+        cursor_param: Параметр запроса с ключом страницы.
+    """
+
+    keyset = ("pk",)
+    page_size = 100
+    cursor_param = "after"
+
+    def get_queryset(self):
+        queryset = super().get_queryset().order_by(*self.keyset)
+        cursor = self.request.GET.get(self.cursor_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.get_keyset_filter(cursor, queryset.model)
+            )
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        rows, next_cursor = self.paginate_keyset(self.object_list)
+        kwargs.setdefault("object_list", rows)
+        kwargs["next_cursor"] = next_cursor
+        kwargs["is_paginated"] = bool(
+            next_cursor or self.request.GET.get(self.cursor_param)
+        )
+        return super().get_context_data(**kwargs)
+
+    def paginate_keyset(self, queryset) -> tuple:
+        """Возвращает строки страницы и ключ следующей страницы (или None).
+
+        Выбирается на одну строку больше размера страницы, чтобы узнать,
+        есть ли следующая страница.
+        """
+        rows = list(queryset[: self.page_size + 1])
+        has_next = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        return rows, self.encode_cursor(rows[-1]) if has_next else None
+
+    def get_keyset_filter(self, cursor: str, model) -> Q:
+        """Условие (a > x) OR (a = x AND b > y) OR ... для ключа страницы.
+
+        Дополнительное условие a >= x ограничивает диапазон индекса по
+        первому полю: без него условие OR не использует индекс.
+        """
+        values = self.decode_cursor(cursor, model)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.keyset, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        if len(self.keyset) > 1:
+            first = self.keyset[0]
+            lookup = "lte" if first.startswith("-") else "gte"
+            condition &= Q(**{f"{first.lstrip('-')}__{lookup}": values[0]})
+        return condition
+
+    def encode_cursor(self, obj) -> str:
+        values = [getattr(obj, field.lstrip("-")) for field in self.keyset]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor: str, model) -> list:
+        """Значения полей keyset из ключа страницы, приведенные к типам
+        полей модели.
+
+        Raises:
+            Http404: Ключ поврежден или значения не подходят полям.
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise Http404("Invalid cursor")
+        if not isinstance(values, list) or len(values) != len(self.keyset):
+            raise Http404("Invalid cursor")
+        result = []
+        for field, value in zip(self.keyset, values):
+            name = field.lstrip("-")
+            if name == "pk":
+                model_field = model._meta.pk
+            else:
+                model_field = model._meta.get_field(name)
+            if model_field.is_relation:
+                # pk наследника (multi-table) ссылается на pk родителя
+                model_field = model_field.target_field
+            if value is None or isinstance(value, (dict, list)):
+                raise Http404("Invalid cursor")
+            try:
+                value = model_field.to_python(value)
+                model_field.run_validators(value)
+            except (ValidationError, TypeError, ValueError):
+                raise Http404("Invalid cursor")
+            # У AutoField нет валидаторов диапазона, а SQLite не
+            # ограничивает диапазон целых полей
+            limits = BaseDatabaseOperations.integer_field_ranges.get(
+                model_field.get_internal_type()
+            )
+            if limits and not limits[0] <= value <= limits[1]:
+                raise Http404("Invalid cursor")
+            result.append(value)
+        return result
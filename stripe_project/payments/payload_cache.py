@@ -0,0 +1,77 @@
+import hashlib
+import json
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .page_cache import page_cache
+
+
+class CheckoutPayloadCache:
+    """Кэш данных позиций, скидок и доставки заказа для сессии stripe.
+
+    Данные (line_items, discounts, shipping_options) хранятся в виде
+    компактной строки JSON под версией заказа (версия области order:<pk>
+    кэша страниц), которая обновляется сигналами при изменении заказа,
+    его позиций, товаров, скидки, налога, доставки и их идентификаторов
+    stripe. Повторное оформление заказа не загружает позиции из базы
+    данных и не строит словари позиций заново.
+    """
+
+    prefix = "checkout_payload"
+
+    def __init__(self, alias: str = "default", timeout: int = None):
+        self.alias = alias
+        self.timeout = timeout or settings.PAGE_CACHE_TIMEOUT
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, pk: int) -> str:
+        scope = f"order:{pk}"
+        version = page_cache.get_versions([scope])[scope]
+        return f"{self.prefix}:order:{pk}:{version!r}"
+
+    def get_or_build(self, pk: int, build: Callable[[int], dict]) -> tuple:
+        """Возвращает данные заказа и их отпечаток (sha256).
+
+        Args:
+            pk: Идентификатор заказа.
+            build: Функция построения данных по идентификатору заказа.
+        """
+        key = self.make_key(pk)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.count("hits")
+            data, digest = cached
+            return json.loads(data), digest
+        self.count("misses")
+        payload = build(pk)
+        data = json.dumps(payload, separators=(",", ":"), sort_keys=True)
+        digest = hashlib.sha256(data.encode()).hexdigest()
+        self.cache.set(key, (data, digest), self.timeout)
+        return payload, digest
+
+    def count(self, name: str):
+        key = f"{self.prefix}:stats:{name}"
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            pass  # запись вытеснена из кэша (или кэш отключен)
+
+    def stats(self) -> dict:
+        """Количество попаданий и промахов кэша."""
+        hits = self.cache.get(f"{self.prefix}:stats:hits", 0)
+        misses = self.cache.get(f"{self.prefix}:stats:misses", 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+checkout_payload_cache = CheckoutPayloadCache()
@@ -0,0 +1,421 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .exchange import exchange_rates, get_settlement_currency
+from .models import (
+    Currency,
+    Discount,
+    Order,
+    OrderLine,
+    ShippingTax,
+    Tax,
+    TaxBehavior,
+)
+
+TOTALS_FIELDS = (
+    "items_count",
+    "gross_amount",
+    "discount_amount",
+    "tax_amount",
+    "shipping_amount",
+    "final_amount",
+    "currency",
+)
+
+
+# Режимы округления сумм скидки и налога (суммы неотрицательны)
+ROUND_DOWN = "down"
+ROUND_HALF_UP = "half_up"
+ROUND_HALF_EVEN = "half_even"
+ROUNDING_MODES = (ROUND_DOWN, ROUND_HALF_UP, ROUND_HALF_EVEN)
+
+# Проценты скидок и налогов хранятся с двумя знаками после запятой,
+# в расчетах используются целые базисные пункты (1% = 100 б.п.)
+BASIS_POINTS = 10000
+
+
+def to_basis_points(percent) -> int:
+    """Переводит процент (Decimal с двумя знаками) в базисные пункты."""
+    return int(Decimal(percent).scaleb(2).to_integral_exact())
+
+
+def divide(numerator, denominator, rounding: str):
+    """Целочисленное деление неотрицательных сумм с заданным округлением.
+
+    Принимает целые числа или массивы NumPy (пакетный расчет valuation),
+    поэтому обходится без ветвлений по значениям. ROUND_DOWN соответствует
+    отбрасыванию дробной части.
+    """
+    quotient, remainder = divmod(numerator, denominator)
+    if rounding == ROUND_DOWN:
+        return quotient
+    twice = 2 * remainder
+    if rounding == ROUND_HALF_UP:
+        return quotient + (twice >= denominator)
+    return quotient + (
+        (twice > denominator) | ((twice == denominator) & (quotient % 2 == 1))
+    )
+
+
+def get_rounding(rounding: Optional[str] = None) -> str:
+    rounding = rounding or settings.PRICING_ROUNDING
+    if rounding not in ROUNDING_MODES:
+        raise ValueError(f"Unknown rounding mode: {rounding}")
+    return rounding
+
+
+def line_amount(prefix: str = ""):
+    """Выражение стоимости позиции заказа (количество × цена).
+
+    Args:
+        prefix: Путь к позиции заказа от модели запроса ("lines__").
+    """
+    return F(f"{prefix}quantity") * Coalesce(
+        F(f"{prefix}unit_price"), F(f"{prefix}item__price")
+    )
+
+
+def convert_amounts(
+    amounts: dict[str, int], currency: str, rounding: Optional[str] = None
+) -> int:
+    """Сумма в валюте currency по суммам в разных валютах.
+
+    Сумма в каждой валюте пересчитывается по курсу один раз (а не по
+    позициям), поэтому результат не зависит от порядка позиций и
+    совпадает с пакетным расчетом (valuation). Матрица курсов не
+    загружается, если пересчет не нужен.
+
+    Args:
+        amounts: Суммы (копеек) по валютам.
+        currency: Валюта результата.
+        rounding: Режим округления (по умолчанию PRICING_ROUNDING).
+    """
+    rounding = get_rounding(rounding)
+    total = 0
+    for source, amount in amounts.items():
+        rate = exchange_rates.rate(source, currency)
+        total += divide(amount * rate.numerator, rate.denominator, rounding)
+    return total
+
+
+def get_lines_amounts(lines) -> tuple[dict[str, int], int]:
+    """Суммы позиций по валютам товаров и количество позиций (одним
+    запросом с группировкой по валюте).
+
+    Args:
+        lines: Позиции заказов (QuerySet OrderLine).
+    """
+    amounts = {}
+    count = 0
+    rows = (
+        lines.order_by()
+        .values("item__currency")
+        .annotate(gross=Sum(line_amount()), count=Count("pk"))
+        .values_list("item__currency", "gross", "count")
+    )
+    for currency, gross, lines_count in rows:
+        amounts[currency] = gross or 0
+        count += lines_count
+    return amounts, count
+
+
+@dataclass(frozen=True)
+class OrderPricing:
+    """Результат расчета стоимости заказа (все суммы в копейках)."""
+
+    items_count: int
+    gross: int
+    discount: int
+    subtotal: int
+    tax_inclusive: int
+    tax_exclusive: int
+    shipping: int
+    final: int
+    currency: str
+
+    @property
+    def tax(self) -> int:
+        """Cумма налога вне зависимости от типа (копеек)."""
+        return self.tax_inclusive + self.tax_exclusive
+
+    @classmethod
+    def from_totals(cls, order: Order) -> "OrderPricing":
+        """Восстанавливает расчет по сохраненным итогам заказа."""
+        subtotal = order.gross_amount - order.discount_amount
+        tax_exclusive = order.final_amount - subtotal - order.shipping_amount
+        return cls(
+            items_count=order.items_count,
+            gross=order.gross_amount,
+            discount=order.discount_amount,
+            subtotal=subtotal,
+            tax_inclusive=order.tax_amount - tax_exclusive,
+            tax_exclusive=tax_exclusive,
+            shipping=order.shipping_amount,
+            final=order.final_amount,
+            currency=order.currency,
+        )
+
+
+def calculate_pricing(
+    gross: int,
+    items_count: int,
+    currency: str,
+    discount: Optional[Discount] = None,
+    tax: Optional[Tax] = None,
+    shipping: Optional[ShippingTax] = None,
+    rounding: Optional[str] = None,
+) -> OrderPricing:
+    """Рассчитывает стоимость заказа по сумме товарных позиций.
+
+    Суммы скидки и налога вычисляются в целых числах (базисных пунктах)
+    с округлением rounding, так же как в пакетном расчете (valuation).
+    Стоимость доставки пересчитывается в валюту заказа.
+
+    Args:
+        gross: Общая сумма товарных позиций в валюте заказа (копеек).
+        items_count: Количество товарных позиций (без учета количества).
+        currency: Валюта расчетов заказа.
+        discount: Скидка заказа.
+        tax: Налог заказа.
+        shipping: Доставка заказа.
+        rounding: Режим округления (по умолчанию PRICING_ROUNDING).
+    """
+    rounding = get_rounding(rounding)
+    discount_amount = 0
+    if discount:
+        discount_amount = divide(
+            gross * to_basis_points(discount.percent_off),
+            BASIS_POINTS,
+            rounding,
+        )
+    subtotal = gross - discount_amount
+    tax_inclusive = tax_exclusive = 0
+    if tax and tax.behavior == TaxBehavior.INCLUSIVE:
+        percentage = to_basis_points(tax.percentage)
+        tax_inclusive = divide(
+            subtotal * percentage, BASIS_POINTS + percentage, rounding
+        )
+    elif tax and tax.behavior == TaxBehavior.EXCLUSIVE:
+        tax_exclusive = divide(
+            subtotal * to_basis_points(tax.percentage),
+            BASIS_POINTS,
+            rounding,
+        )
+    shipping_amount = 0
+    if shipping:
+        shipping_amount = convert_amounts(
+            {shipping.currency: shipping.amount}, currency, rounding
+        )
+    return OrderPricing(
+        items_count=items_count,
+        gross=gross,
+        discount=discount_amount,
+        subtotal=subtotal,
+        tax_inclusive=tax_inclusive,
+        tax_exclusive=tax_exclusive,
+        shipping=shipping_amount,
+        final=subtotal + tax_exclusive + shipping_amount,
+        currency=currency,
+    )
+
+
+def get_order_pricing(order) -> OrderPricing:
+    """Рассчитывает стоимость заказа за один проход.
+
+    Если позиции заказа загружены через prefetch_related("lines__item"),
+    расчет выполняется без обращения к базе данных, иначе одним
+    агрегирующим запросом (суммы по валютам товаров). Суммы в разных
+    валютах пересчитываются в валюту расчетов заказа.
+
+    Args:
+        order: Объект заказа.
+    """
+    if "lines" in getattr(order, "_prefetched_objects_cache", {}):
+        lines = order.lines.all()
+        amounts = {}
+        for line in lines:
+            currency = line.item.currency
+            amounts[currency] = amounts.get(currency, 0) + line.amount
+        items_count = len(lines)
+    else:
+        amounts, items_count = get_lines_amounts(order.lines.all())
+    currency = get_settlement_currency(
+        amounts, order.shipping.currency if order.shipping else None
+    )
+    return calculate_pricing(
+        convert_amounts(amounts, currency),
+        items_count,
+        currency,
+        discount=order.discount,
+        tax=order.tax,
+        shipping=order.shipping,
+    )
+
+
+def apply_pricing(order: Order, pricing: OrderPricing):
+    """Записывает рассчитанную стоимость в итоговые поля заказа."""
+    order.items_count = pricing.items_count
+    order.gross_amount = pricing.gross
+    order.discount_amount = pricing.discount
+    order.tax_amount = pricing.tax
+    order.shipping_amount = pricing.shipping
+    order.final_amount = pricing.final
+    order.currency = pricing.currency
+    order.reset_pricing()
+
+
+def refresh_order_totals(order: Order):
+    """Пересчитывает итоги заказа по сохраненной сумме товаров.
+
+    Не обращается к товарам заказа, поэтому выполняется за O(1).
+    Сумма товаров хранится в валюте расчетов заказа.
+    """
+    currency = order.currency
+    if not order.items_count:
+        currency = get_settlement_currency(
+            [], order.shipping.currency if order.shipping else None
+        )
+    apply_pricing(
+        order,
+        calculate_pricing(
+            order.gross_amount,
+            order.items_count,
+            currency,
+            discount=order.discount,
+            tax=order.tax,
+            shipping=order.shipping,
+        ),
+    )
+
+
+def refresh_orders_totals(queryset, batch_size: int = 500) -> int:
+    """Пересчитывает итоги заказов из queryset без обращения к товарам.
+
+    Используется при изменении скидки, налога или доставки, на которые
+    ссылается множество заказов. Возвращает количество заказов.
+    """
+    orders = []
+    count = 0
+    for order in queryset.select_related(
+        "discount", "tax", "shipping"
+    ).iterator(chunk_size=batch_size):
+        refresh_order_totals(order)
+        orders.append(order)
+        if len(orders) >= batch_size:
+            Order.objects.bulk_update(orders, TOTALS_FIELDS)
+            count += len(orders)
+            orders = []
+    if orders:
+        Order.objects.bulk_update(orders, TOTALS_FIELDS)
+        count += len(orders)
+    return count
+
+
+def annotate_items_totals(queryset):
+    """Добавляет к заказам итоги позиций, скидку, налог и доставку (в SQL).
+
+    Значения вычисляются коррелированными подзапросами, без GROUP BY
+    по всем полям заказа и без загрузки связанных объектов, поэтому
+    страница заказов выбирается одним запросом. Сумма позиций
+    вычисляется по каждой валюте (items_gross_<валюта>).
+    """
+    lines = (
+        OrderLine.objects.filter(order=OuterRef("pk"))
+        .order_by()
+        .values("order")
+    )
+
+    def related(model, field: str, value: str):
+        return Subquery(
+            model.objects.filter(pk=OuterRef(field)).values(value)[:1]
+        )
+
+    return queryset.annotate(
+        **{
+            f"items_gross_{currency}": Subquery(
+                lines.filter(item__currency=currency)
+                .annotate(gross=Sum(line_amount()))
+                .values("gross")
+            )
+            for currency in Currency.values
+        },
+        items_total=Coalesce(
+            Subquery(lines.annotate(count=Count("pk")).values("count")), 0
+        ),
+        discount_percent_off=related(Discount, "discount_id", "percent_off"),
+        tax_percentage=related(Tax, "tax_id", "percentage"),
+        tax_behavior=related(Tax, "tax_id", "behavior"),
+        shipping_price=related(ShippingTax, "shipping_id", "amount"),
+        shipping_currency=related(ShippingTax, "shipping_id", "currency"),
+    )
+
+
+def calculate_annotated_pricing(
+    order: Order, rounding: Optional[str] = None
+) -> OrderPricing:
+    """Рассчитывает стоимость заказа, полученного из annotate_items_totals."""
+    discount = tax = shipping = None
+    if order.discount_percent_off is not None:
+        discount = Discount(percent_off=order.discount_percent_off)
+    if order.tax_percentage is not None:
+        tax = Tax(percentage=order.tax_percentage, behavior=order.tax_behavior)
+    if order.shipping_price is not None:
+        shipping = ShippingTax(
+            amount=order.shipping_price, currency=order.shipping_currency
+        )
+    amounts = {
+        currency: getattr(order, f"items_gross_{currency}")
+        for currency in Currency.values
+        if getattr(order, f"items_gross_{currency}") is not None
+    }
+    currency = get_settlement_currency(amounts, order.shipping_currency)
+    return calculate_pricing(
+        convert_amounts(amounts, currency, rounding),
+        order.items_total,
+        currency,
+        discount=discount,
+        tax=tax,
+        shipping=shipping,
+        rounding=rounding,
+    )
+
+
+def rebuild_orders_totals(
+    queryset, batch_size: int = 500, verify: bool = False
+) -> tuple:
+    """Полностью пересчитывает итоги заказов по их товарам.
+
+    Args:
+        queryset: Заказы для пересчета.
+        batch_size: Размер пакета чтения и обновления.
+        verify: Только проверить итоги, не сохраняя изменений.
+
+    Returns:
+        Количество обработанных заказов и список идентификаторов заказов,
+        сохраненные итоги которых не совпали с рассчитанными.
+    """
+    orders = []
+    mismatched = []
+    count = 0
+    queryset = annotate_items_totals(queryset).order_by("pk")
+    for order in queryset.iterator(chunk_size=batch_size):
+        count += 1
+        pricing = calculate_annotated_pricing(order)
+        if OrderPricing.from_totals(order) == pricing:
+            continue
+        mismatched.append(order.pk)
+        if verify:
+            continue
+        apply_pricing(order, pricing)
+        orders.append(order)
+        if len(orders) >= batch_size:
+            Order.objects.bulk_update(orders, TOTALS_FIELDS)
+            orders = []
+    if orders:
+        Order.objects.bulk_update(orders, TOTALS_FIELDS)
+    return count, mismatched
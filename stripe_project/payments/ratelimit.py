@@ -0,0 +1,206 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .counters import SharedCounters
+from .metrics import measure, registry
+
+
+class TokenBucket:
+    """Ограничение частоты операций в пределах процесса (потокобезопасно).
+
+    Args:
+        rate: Количество операций в секунду.
+        capacity: Допустимый всплеск (по умолчанию равен rate).
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Ожидает доступные токены, возвращает время ожидания (сек)."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# Очереди обращений к stripe: оформление заказа (покупатель ждет ответа)
+# и фоновая синхронизация (задачи, загрузка каталога)
+CHECKOUT = "checkout"
+BACKGROUND = "background"
+LANES = (CHECKOUT, BACKGROUND)
+
+current_lane: ContextVar[str] = ContextVar("stripe_lane", default=CHECKOUT)
+
+
+@contextmanager
+def lane(name: str):
+    """Обращения к stripe внутри блока выполняются в очереди name.
+
+    Переменная контекста не передается в потоки ThreadPoolExecutor,
+    поэтому очередь задается в функции, выполняемой в потоке.
+    """
+    if name not in LANES:
+        raise ValueError(f"Unknown stripe lane: {name}")
+    token = current_lane.set(name)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+class RateLimitTimeout(stripe.error.RateLimitError):
+    """Превышено время ожидания очереди обращений к stripe."""
+
+
+class StripeRateLimiter:
+    """Ограничение частоты обращений к stripe, общее для процессов.
+
+    Счетчики обращений за текущую секунду и ожидающих обращений хранятся
+    в базе данных (SharedCounters) и изменяются атомарно, поэтому
+    ограничение действует для всех процессов. Фоновая очередь использует
+    не более доли background_share от ограничения и ожидает, пока есть
+    ожидающие обращения оформления заказа. После ответа 429 все очереди
+    всех процессов ожидают время Retry-After (время окончания паузы
+    хранится там же).
+
+    Args:
+        rate: Количество обращений в секунду.
+        background_share: Доля обращений, доступная фоновой очереди.
+        max_wait: Максимальное ожидание по очередям (сек).
+    """
+
+    prefix = "stripe_rate"
+    # Шаг повторной проверки при ожидании (сек)
+    poll_interval = 0.05
+
+    def __init__(
+        self,
+        rate: int,
+        background_share: float = 0.5,
+        max_wait: Optional[dict] = None,
+    ):
+        self.rate = rate
+        self.limits = {
+            CHECKOUT: rate,
+            BACKGROUND: max(int(rate * background_share), 1),
+        }
+        self.max_wait = {CHECKOUT: 5.0, BACKGROUND: 60.0, **(max_wait or {})}
+        self.counters = SharedCounters(self.prefix)
+
+    def reserve(self, name: str) -> float:
+        """Занимает обращение в текущей секунде для очереди name.
+
+        Возвращает 0, если обращение разрешено, иначе время до повторной
+        попытки (сек).
+        """
+        now = time.time()
+        counters = self.counters.get_many(
+            ["paused_until", "window", f"waiting:{CHECKOUT}"]
+        )
+        # Время окончания паузы хранится в миллисекундах
+        paused_until = counters.get("paused_until", 0) / 1000
+        if paused_until > now:
+            return paused_until - now
+        next_window = 1 - now % 1
+        if name != CHECKOUT and counters.get(f"waiting:{CHECKOUT}", 0) > 0:
+            return min(self.poll_interval, next_window)
+        if counters.get("window", 0) >= self.limits[name]:
+            return next_window
+        # Счетчик секунды сбрасывается первым обращением следующей секунды
+        if self.counters.incr("window", int(now) + 1) > self.limits[name]:
+            return next_window
+        return 0
+
+    @contextmanager
+    def waiting(self, name: str):
+        """Учитывает ожидающее обращение в глубине очереди name."""
+        key = f"waiting:{name}"
+        # Срок действия ограничивает счетчик, не уменьшенный аварийно
+        # завершенным процессом
+        self.counters.incr(key, time.time() + self.max_wait[name] + 1)
+        registry.stripe_queue_depth.add(name, 1)
+        try:
+            yield
+        finally:
+            registry.stripe_queue_depth.add(name, -1)
+            self.counters.decr(key)
+
+    def acquire(self, name: Optional[str] = None) -> float:
+        """Ожидает разрешения обращения, возвращает время ожидания (сек).
+
+        Args:
+            name: Очередь (по умолчанию очередь текущего контекста).
+
+        Raises:
+            RateLimitTimeout: Превышено максимальное ожидание очереди.
+        """
+        name = name or current_lane.get()
+        delay = self.reserve(name)
+        if not delay:
+            registry.stripe_wait.observe(name, 0)
+            return 0.0
+        start = time.perf_counter()
+        with measure("stripe_wait"), self.waiting(name):
+            while delay:
+                waited = time.perf_counter() - start
+                if waited + delay > self.max_wait[name]:
+                    registry.stripe_wait.observe(name, waited)
+                    raise RateLimitTimeout(
+                        f"Stripe rate limit: {name} queue wait exceeded"
+                    )
+                time.sleep(delay)
+                delay = self.reserve(name)
+        waited = time.perf_counter() - start
+        registry.stripe_wait.observe(name, waited)
+        return waited
+
+    async def aacquire(self, name: Optional[str] = None) -> float:
+        """Асинхронная версия acquire: ожидание выполняется в пуле
+        потоков, не блокируя цикл событий."""
+        name = name or current_lane.get()
+        return await sync_to_async(self.acquire, thread_sensitive=False)(
+            name
+        )
+
+    def pause(self, seconds: float):
+        """Приостанавливает обращения всех очередей (ответ 429)."""
+        until = time.time() + seconds
+        self.counters.set("paused_until", math.ceil(until * 1000), until)
+        registry.stripe_throttled.add(current_lane.get(), 1)
+
+
+def get_rate_limiter() -> Optional[StripeRateLimiter]:
+    """Ограничение обращений к stripe по настройке STRIPE_RATE_LIMIT
+    (None, если ограничение отключено)."""
+    config = settings.STRIPE_RATE_LIMIT
+    if not config["ENABLED"]:
+        return None
+    return StripeRateLimiter(
+        rate=config["RATE"],
+        background_share=config["BACKGROUND_SHARE"],
+        max_wait=config["MAX_WAIT"],
+    )
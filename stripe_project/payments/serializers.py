@@ -0,0 +1,133 @@
+import csv
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class FieldSerializer:
+    """Представление объектов в виде словарей с выбором полей.
+
+    Args:
+        fields: Функции получения значения по именам полей.
+        default: Поля, возвращаемые, если выбор не задан.
+    """
+
+    def __init__(self, fields: dict, default: tuple = None):
+        self.fields = fields
+        self.default = tuple(default or fields)
+
+    def get_fields(self, value: str = None, exclude: tuple = ()) -> tuple:
+        """Разбирает список полей из параметра запроса (?fields=a,b).
+
+        Raises:
+            ValidationError: Неизвестное или недоступное поле.
+        """
+        names = (name.strip() for name in (value or "").split(","))
+        fields = tuple(name for name in names if name)
+        if not fields:
+            return tuple(name for name in self.default if name not in exclude)
+        unknown = [
+            name
+            for name in fields
+            if name not in self.fields or name in exclude
+        ]
+        if unknown:
+            raise ValidationError(f"Unknown fields: {', '.join(unknown)}")
+        return fields
+
+    def serialize(self, obj, fields: tuple) -> dict:
+        return {name: self.fields[name](obj) for name in fields}
+
+
+def pricing_field(name: str):
+    return lambda order: getattr(order.pricing, name)
+
+
+def serialize_lines(order) -> list:
+    return [
+        {
+            "item": line.item_id,
+            "quantity": line.quantity,
+            "unit_price": line.unit_price,
+            "amount": line.amount,
+        }
+        for line in order.lines.all()
+    ]
+
+
+item_serializer = FieldSerializer(
+    {
+        "id": lambda item: item.pk,
+        "name": lambda item: item.name,
+        "description": lambda item: item.description,
+        "price": lambda item: item.price,
+        "currency": lambda item: item.currency,
+    }
+)
+
+# Стоимость заказа берется из сохраненных итогов (Order.pricing),
+# поэтому поля стоимости не требуют запросов к позициям заказа
+ORDER_PRICING_FIELDS = (
+    "currency",
+    "items_count",
+    "gross",
+    "discount",
+    "subtotal",
+    "tax_inclusive",
+    "tax_exclusive",
+    "tax",
+    "shipping",
+    "final",
+)
+
+order_serializer = FieldSerializer(
+    {
+        "id": lambda order: order.pk,
+        "status": lambda order: order.status,
+        "paid_at": lambda order: order.paid_at,
+        "discount_id": lambda order: order.discount_id,
+        "tax_id": lambda order: order.tax_id,
+        "shipping_id": lambda order: order.shipping_id,
+        **{name: pricing_field(name) for name in ORDER_PRICING_FIELDS},
+        "lines": serialize_lines,
+    },
+    default=("id", "status", "paid_at", *ORDER_PRICING_FIELDS),
+)
+
+
+class Echo:
+    """Файлоподобный объект, возвращающий записанную строку (для csv)."""
+
+    def write(self, value):
+        return value
+
+
+def batched(lines, size: int = 500):
+    """Объединяет строки выгрузки в блоки (меньше операций записи)."""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def stream_ndjson(objects, serializer: FieldSerializer, fields: tuple):
+    """Построчный JSON (NDJSON) по итератору объектов."""
+    encoder = DjangoJSONEncoder()
+    return batched(
+        encoder.encode(serializer.serialize(obj, fields)) + "\n"
+        for obj in objects
+    )
+
+
+def stream_csv(objects, serializer: FieldSerializer, fields: tuple):
+    """CSV с заголовком по итератору объектов."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    yield from batched(
+        writer.writerow(serializer.serialize(obj, fields).values())
+        for obj in objects
+    )
@@ -1,20 +1,47 @@
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
 import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
 from django.shortcuts import get_object_or_404
-from stripe import PaymentIntent
+from django.utils import timezone
 from stripe.checkout import Session
 
-from .models import Item, Order, ShippingTax, TaxBehavior
+from .exchange import (
+    ExchangeRateMissing,
+    exchange_rates,
+    get_settlement_currency,
+)
+from .gateways import get_gateway
+from .models import (
+    Currency,
+    Discount,
+    ExchangeRate,
+    Item,
+    Order,
+    OrderLine,
+    OrderStatus,
+    PaymentAttempt,
+    ShippingTax,
+    Tax,
+    TaxBehavior,
+)
+from .page_cache import page_cache
+from .payload_cache import checkout_payload_cache
+from .pricing import TOTALS_FIELDS, convert_amounts, rebuild_orders_totals
+from .serializers import order_serializer
+from .session_cache import checkout_session_cache
 
 
 class DiscountService:
     @classmethod
     def create_coupon(cls, coupon_id: str, name: str, percent_off: int):
-        stripe.Coupon.create(
-            name=name,
-            duration="forever",
-            id=coupon_id,
-            percent_off=percent_off,
-        )
+        get_gateway().create_coupon(coupon_id, name, percent_off)
 
     @classmethod
     def generate_coupon_id(cls, id: int) -> str:
@@ -22,15 +49,20 @@ class DiscountService:
 
     @classmethod
     def update_coupon(cls, coupon_id: str, name: str, percent_off: int):
+        gateway = get_gateway()
         try:
-            stripe.Coupon.delete(coupon_id)
+            gateway.delete_coupon(coupon_id)
         except Exception:
             pass  # coupon is not exist
-        stripe.Coupon.create(
-            name=name,
-            duration="forever",
-            id=coupon_id,
-            percent_off=percent_off,
+        gateway.create_coupon(coupon_id, name, percent_off)
+
+    @classmethod
+    def sync_coupon(cls, discount: Discount):
+        """Создает или пересоздает в stripe купон для скидки."""
+        cls.update_coupon(
+            cls.generate_coupon_id(discount.id),
+            discount.name,
+            discount.percent_off,
         )
 
 
@@ -43,7 +75,7 @@ class TaxService:
         percentage: float,
         behavior: TaxBehavior,
     ):
-        return stripe.TaxRate.create(
+        return get_gateway().create_tax_rate(
             display_name=name,
             description=description,
             percentage=percentage,
@@ -59,35 +91,160 @@ class TaxService:
         percentage: float,
         behavior: TaxBehavior,
     ):
-        stripe.TaxRate.modify(
-            id=tax_id,
+        get_gateway().modify_tax_rate(
+            tax_id,
             display_name=name,
             description=description,
         )
 
+    @classmethod
+    def sync_tax(cls, tax: Tax):
+        """Изменяет налог в stripe или создает его, если он отсутствует."""
+        if tax.tax_id:
+            try:
+                cls.update_tax(
+                    tax.tax_id,
+                    tax.name,
+                    tax.description,
+                    tax.percentage,
+                    tax.behavior,
+                )
+                return
+            except stripe.error.InvalidRequestError:
+                pass  # налог отсутствует в stripe, создаем новый
+        tax_rate = cls.create_tax(
+            tax.name, tax.description, tax.percentage, tax.behavior
+        )
+        tax.tax_id = tax_rate.id
+        # update() не вызывает пересчет итогов заказов (post_save),
+        # данные позиций заказов для stripe включают идентификатор налога
+        Tax.objects.filter(pk=tax.pk).update(tax_id=tax_rate.id)
+        page_cache.touch_orders(*tax.orders.values_list("pk", flat=True))
+
+
+class ProductService:
+    @classmethod
+    def generate_product_id(cls, id: int) -> str:
+        return "product_" + str(id)
+
+    @classmethod
+    def sync_product(cls, item: Item):
+        """Изменяет товар в stripe или создает его, если он отсутствует.
+
+        Цены stripe неизменяемы: при изменении цены или валюты товара
+        создается новая цена, а предыдущая деактивируется.
+        """
+        gateway = get_gateway()
+        product_id = item.stripe_product_id or cls.generate_product_id(
+            item.id
+        )
+        try:
+            product = gateway.modify_product(
+                product_id, name=item.name, description=item.description
+            )
+        except stripe.error.InvalidRequestError:
+            product = gateway.create_product(
+                product_id, name=item.name, description=item.description
+            )
+        price_id = item.stripe_price_id
+        if not price_id:
+            old_price_id = product.get("default_price")
+            price_id = gateway.create_price(
+                product_id,
+                unit_amount=item.price,
+                currency=item.currency,
+                idempotency_key=(
+                    f"item-{item.pk}-{old_price_id}-{item.price}-"
+                    f"{item.currency}"
+                ),
+            ).id
+            gateway.modify_product(
+                product_id,
+                name=item.name,
+                description=item.description,
+                default_price=price_id,
+            )
+            if old_price_id and old_price_id != price_id:
+                gateway.archive_price(old_price_id)
+        # Цена могла измениться во время синхронизации: тогда идентификатор
+        # не сохраняется, товар синхронизирует следующая задача
+        updated = Item.objects.filter(
+            pk=item.pk, price=item.price, currency=item.currency
+        ).update(stripe_product_id=product_id, stripe_price_id=price_id)
+        if updated and price_id != item.stripe_price_id:
+            # Данные позиций заказов для stripe включают идентификатор цены
+            page_cache.touch_orders(
+                *item.orders.values_list("pk", flat=True)
+            )
+        item.stripe_product_id = product_id
+        item.stripe_price_id = price_id
+
 
 class ItemPaymentService:
     @classmethod
-    def get_price_data(cls, item: Item, tax_rates: list[str] = None) -> dict:
+    def get_price_data(
+        cls,
+        item: Item,
+        tax_rates: list[str] = None,
+        quantity: int = 1,
+        unit_price: int = None,
+    ) -> dict:
         """Возвращает словарь с данными товарной позиции.
 
+        Если товар синхронизирован со stripe и цена позиции совпадает
+        с ценой товара, передается идентификатор цены stripe, иначе данные
+        цены и товара передаются в запросе.
+
         Args:
             item: Объект товарной позиции.
+            tax_rates: Идентификаторы налоговых ставок stripe.
+            quantity: Количество товара.
+            unit_price: Цена единицы товара в заказе (по умолчанию цена
+                товара).
         """
         if tax_rates is None:
             tax_rates = []
+        if unit_price is None:
+            unit_price = item.price
+        if item.stripe_price_id and unit_price == item.price:
+            return {
+                "price": item.stripe_price_id,
+                "quantity": quantity,
+                "tax_rates": tax_rates,
+            }
         return {
             "price_data": {
                 "currency": item.currency,
-                "unit_amount": item.price,
+                "unit_amount": unit_price,
                 "product_data": {
                     "name": item.name,
                 },
             },
-            "quantity": 1,
+            "quantity": quantity,
             "tax_rates": tax_rates,
         }
 
+    @classmethod
+    def get_session_params(
+        cls, pk: int, success_url: str, cancel_url: str
+    ) -> dict:
+        """Возвращает параметры создания сессии для товара.
+
+        Args:
+            pk: Идентификатор объекта.
+            success_url: Адрес перенаправления при успешном выполнении.
+            cancel_url: Адрес перенаправления при отмене.
+        """
+        item = get_object_or_404(Item, pk=pk)
+        return {
+            "payment_method_types": ["card"],
+            "line_items": [cls.get_price_data(item)],
+            "metadata": {"product_id": item.id},
+            "mode": "payment",
+            "success_url": success_url,
+            "cancel_url": cancel_url,
+        }
+
     @classmethod
     def get_session(
         cls, pk: int, success_url: str, cancel_url: str
@@ -99,15 +256,18 @@ class ItemPaymentService:
             success_url: Адрес перенаправления при успешном выполнении.
             cancel_url: Адрес перенаправления при отмене.
         """
-        item = get_object_or_404(Item, pk=pk)
-        return stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=[cls.get_price_data(item)],
-            metadata={"product_id": item.id},
-            mode="payment",
-            success_url=success_url,
-            cancel_url=cancel_url,
+        params = cls.get_session_params(pk, success_url, cancel_url)
+        return checkout_session_cache.get_or_create("item", pk, params)
+
+    @classmethod
+    async def aget_session(
+        cls, pk: int, success_url: str, cancel_url: str
+    ) -> Session:
+        """Асинхронная версия get_session."""
+        params = await sync_to_async(cls.get_session_params)(
+            pk, success_url, cancel_url
         )
+        return await checkout_session_cache.aget_or_create("item", pk, params)
 
 
 class ShippingTaxService:
@@ -127,7 +287,417 @@ class ShippingTaxService:
         }
 
 
+class ExchangeRateService:
+    @classmethod
+    def parse(cls, data: dict) -> dict[tuple[str, str], Decimal]:
+        """Разбирает курсы вида {"usd": {"rub": "92.5", "eur": "0.92"}}.
+
+        Args:
+            data: Курсы пересчета по исходной валюте и валюте пересчета.
+
+        Raises:
+            ValidationError: Неизвестная валюта или неверное значение курса.
+        """
+        if not isinstance(data, dict):
+            raise ValidationError("Exchange rates should be an object")
+        rates = {}
+        for source, targets in data.items():
+            if not isinstance(targets, dict):
+                raise ValidationError(f"Rates of {source} should be an object")
+            for target, value in targets.items():
+                for currency in (source, target):
+                    if currency not in Currency.values:
+                        raise ValidationError(f"Unknown currency: {currency}")
+                try:
+                    rate = Decimal(str(value))
+                except InvalidOperation:
+                    raise ValidationError(
+                        f"Invalid rate {source}/{target}: {value}"
+                    )
+                if not rate.is_finite() or rate <= 0 or source == target:
+                    raise ValidationError(
+                        f"Invalid rate {source}/{target}: {value}"
+                    )
+                rates[(source, target)] = rate
+        return rates
+
+    @classmethod
+    def load(
+        cls, rates: dict[tuple[str, str], Decimal], replace: bool = False
+    ) -> int:
+        """Записывает курсы в таблицу ExchangeRate и пересчитывает итоги
+        неоплаченных заказов, суммы которых пересчитываются по курсам.
+
+        Возвращает количество заказов с измененными итогами.
+
+        Args:
+            rates: Курсы по парам валют (source, target).
+            replace: Удалить курсы, отсутствующие в rates.
+        """
+        with transaction.atomic():
+            stored = {
+                (rate.source, rate.target): rate
+                for rate in ExchangeRate.objects.select_for_update()
+            }
+            if replace:
+                ExchangeRate.objects.filter(
+                    pk__in=[
+                        rate.pk
+                        for pair, rate in stored.items()
+                        if pair not in rates
+                    ]
+                ).delete()
+            changed = []
+            for pair, value in rates.items():
+                if pair in stored:
+                    stored[pair].rate = value
+                    stored[pair].updated_at = timezone.now()
+                    changed.append(stored[pair])
+            # bulk-операции не отправляют сигналы: матрица курсов
+            # сбрасывается и заказы пересчитываются один раз
+            ExchangeRate.objects.bulk_update(changed, ["rate", "updated_at"])
+            ExchangeRate.objects.bulk_create(
+                ExchangeRate(source=source, target=target, rate=value)
+                for (source, target), value in rates.items()
+                if (source, target) not in stored
+            )
+            exchange_rates.clear()
+            return cls.rebuild_orders()
+
+    @classmethod
+    def rebuild_orders(cls) -> int:
+        """Пересчитывает итоги неоплаченных заказов с товарами или
+        доставкой в валюте, отличной от валюты расчетов заказа.
+
+        Оплаченные заказы сохраняют итоги по курсам на момент оплаты.
+        Возвращает количество заказов с измененными итогами.
+        """
+        converted = Order.objects.filter(status=OrderStatus.NEW).filter(
+            Exists(
+                OrderLine.objects.filter(order=OuterRef("pk")).exclude(
+                    item__currency=OuterRef("currency")
+                )
+            )
+            | Q(shipping__isnull=False) & ~Q(shipping__currency=F("currency"))
+        )
+        _, mismatched = rebuild_orders_totals(converted)
+        page_cache.touch_orders(*mismatched)
+        return len(mismatched)
+
+
+class OrderLineService:
+    # Наибольшее количество товара в позиции заказа
+    MAX_QUANTITY = 10000
+
+    @classmethod
+    def upsert_lines(
+        cls, order: Order, quantities: dict[int, int], replace: bool = False
+    ):
+        """Добавляет товары в заказ одним запросом INSERT ... ON CONFLICT.
+
+        Для новых позиций запоминается текущая цена товара, у существующих
+        изменяется только количество. Позиции с нулевым количеством
+        удаляются. Итоги заказа пересчитываются один раз после записи.
+
+        Args:
+            order: Объект заказа.
+            quantities: Количество по идентификаторам товаров.
+            replace: Заменить количество (по умолчанию прибавить).
+
+        Raises:
+            ValidationError: Количество больше MAX_QUANTITY, товар
+                не найден или нет курса пересчета валюты товара.
+        """
+        if any(quantity < 0 for quantity in quantities.values()):
+            raise ValidationError("Quantity should not be negative")
+        if any(q > cls.MAX_QUANTITY for q in quantities.values()):
+            raise ValidationError(
+                f"Quantity should not exceed {cls.MAX_QUANTITY}"
+            )
+        removed = [pk for pk, quantity in quantities.items() if not quantity]
+        added = {pk: q for pk, q in quantities.items() if q}
+        prices = {
+            item["pk"]: item
+            for item in Item.objects.filter(pk__in=added).values(
+                "pk", "price", "currency"
+            )
+        }
+        missing = set(added) - set(prices)
+        if missing:
+            raise ValidationError(
+                f"Items not found: {', '.join(map(str, sorted(missing)))}"
+            )
+        with transaction.atomic():
+            if removed:
+                OrderLine.objects.filter(
+                    order=order, item__in=removed
+                ).delete()
+            if added:
+                cls.validate_currency(order, added)
+                if not replace:
+                    cls.validate_quantities(order, added)
+                cls.execute_upsert(
+                    [
+                        (order.pk, pk, quantity, prices[pk]["price"])
+                        for pk, quantity in added.items()
+                    ],
+                    replace,
+                )
+            rebuild_orders_totals(Order.objects.filter(pk=order.pk))
+            page_cache.touch_orders(order.pk)
+        order.refresh_from_db(fields=TOTALS_FIELDS)
+        order.reset_pricing()
+
+    @classmethod
+    def get_currencies(cls, order: Order, item_ids):
+        """Валюты товаров заказа и добавляемых товаров (без загрузки
+        товаров).
+
+        Объединение (UNION) выборок по идентификаторам и по позициям
+        заказа, чтобы каждое из условий использовало индекс.
+
+        Args:
+            order: Объект заказа.
+            item_ids: Идентификаторы добавляемых товаров.
+        """
+        return (
+            Item.objects.filter(pk__in=item_ids)
+            .order_by()
+            .values("currency")
+            .union(
+                Item.objects.filter(order_lines__order=order)
+                .order_by()
+                .values("currency")
+            )
+        )
+
+    @classmethod
+    def validate_currency(cls, order: Order, item_ids):
+        """Проверяет, что суммы товаров заказа, добавляемых товаров и
+        доставки могут быть пересчитаны в валюту расчетов заказа.
+
+        Матрица курсов загружается, только если валюты различаются.
+
+        Args:
+            order: Объект заказа.
+            item_ids: Идентификаторы добавляемых товаров.
+
+        Raises:
+            ValidationError: Нет курса пересчета для валюты.
+        """
+        currencies = {
+            row["currency"] for row in cls.get_currencies(order, item_ids)
+        }
+        shipping = order.shipping.currency if order.shipping_id else None
+        settlement = get_settlement_currency(currencies, shipping)
+        if shipping:
+            currencies.add(shipping)
+        try:
+            exchange_rates.check(currencies, settlement)
+        except ExchangeRateMissing as e:
+            raise ValidationError(str(e))
+
+    @classmethod
+    def validate_quantities(cls, order: Order, quantities: dict[int, int]):
+        """Проверяет, что количество в позициях заказа после добавления
+        не превысит MAX_QUANTITY.
+
+        Args:
+            order: Объект заказа.
+            quantities: Добавляемое количество по идентификаторам товаров.
+
+        Raises:
+            ValidationError: Количество в позиции больше MAX_QUANTITY.
+        """
+        existing = OrderLine.objects.filter(
+            order=order, item__in=quantities
+        ).values_list("item_id", "quantity")
+        for item_id, quantity in existing:
+            if quantity + quantities[item_id] > cls.MAX_QUANTITY:
+                raise ValidationError(
+                    f"Quantity should not exceed {cls.MAX_QUANTITY}"
+                )
+
+    @classmethod
+    def execute_upsert(cls, rows: list[tuple], replace: bool):
+        # Django 3.2 не поддерживает bulk_create(update_conflicts=True),
+        # синтаксис ON CONFLICT одинаков для PostgreSQL и SQLite
+        table = connection.ops.quote_name(OrderLine._meta.db_table)
+        quantity = "excluded.quantity"
+        if not replace:
+            quantity = f"{table}.quantity + excluded.quantity"
+        values = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (order_id, item_id, quantity, "
+                f"unit_price) VALUES {values} ON CONFLICT (order_id, "
+                f"item_id) DO UPDATE SET quantity = {quantity}",
+                [value for row in rows for value in row],
+            )
+
+
+class CartService:
+    """Создание заказов и изменение их позиций через JSON API."""
+
+    RELATED_MODELS = {
+        "discount": Discount,
+        "tax": Tax,
+        "shipping": ShippingTax,
+    }
+    # Наибольшее значение первичного ключа (BigAutoField)
+    MAX_ID = 2**63 - 1
+
+    @classmethod
+    def parse(cls, body: bytes) -> dict:
+        """Разбирает тело запроса.
+
+        Raises:
+            ValidationError: Тело запроса не является объектом JSON.
+        """
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise ValidationError("Request body should be a JSON object")
+        if not isinstance(data, dict):
+            raise ValidationError("Request body should be a JSON object")
+        return data
+
+    @classmethod
+    def parse_id(cls, value, name: str) -> int:
+        """Идентификатор объекта из запроса.
+
+        Args:
+            value: Значение из запроса (число или строка).
+            name: Имя поля для сообщения об ошибке.
+
+        Raises:
+            ValidationError: Значение не является положительным целым.
+        """
+        if isinstance(value, (int, str)) and not isinstance(value, bool):
+            try:
+                pk = int(value)
+            except ValueError:
+                pass
+            else:
+                if 0 < pk <= cls.MAX_ID:
+                    return pk
+        raise ValidationError(f"{name} should be a positive integer id")
+
+    @classmethod
+    def parse_lines(cls, data: dict) -> dict[int, int]:
+        """Возвращает количество по идентификаторам товаров.
+
+        Повторяющиеся товары суммируются.
+
+        Args:
+            data: Объект запроса со списком lines ({"item", "quantity"}).
+
+        Raises:
+            ValidationError: Список позиций некорректен или количество
+                не является целым от 1 до OrderLineService.MAX_QUANTITY.
+        """
+        lines = data.get("lines", [])
+        if not isinstance(lines, list):
+            raise ValidationError("lines should be a list")
+        max_quantity = OrderLineService.MAX_QUANTITY
+        quantities = {}
+        for line in lines:
+            try:
+                item_id = cls.parse_id(line["item"], "item")
+                quantity = line.get("quantity", 1)
+            except (KeyError, TypeError):
+                raise ValidationError(f"Invalid line: {line}")
+            if (
+                not isinstance(quantity, int)
+                or isinstance(quantity, bool)
+                or not 0 < quantity <= max_quantity
+            ):
+                raise ValidationError(
+                    f"quantity should be an integer from 1 to {max_quantity}"
+                )
+            quantities[item_id] = quantities.get(item_id, 0) + quantity
+            if quantities[item_id] > max_quantity:
+                raise ValidationError(
+                    f"Quantity should not exceed {max_quantity}"
+                )
+        return quantities
+
+    @classmethod
+    def create(cls, data: dict) -> Order:
+        """Создает заказ с позициями, скидкой, налогом и доставкой.
+
+        Raises:
+            ValidationError: Данные заказа некорректны.
+        """
+        quantities = cls.parse_lines(data)
+        related = {}
+        for field, model in cls.RELATED_MODELS.items():
+            if data.get(field) is None:
+                continue
+            pk = cls.parse_id(data[field], field)
+            if not model.objects.filter(pk=pk).exists():
+                raise ValidationError(f"{field} {pk} not found")
+            related[f"{field}_id"] = pk
+        with transaction.atomic():
+            order = Order.objects.create(**related)
+            if quantities:
+                OrderLineService.upsert_lines(order, quantities)
+        return order
+
+    @classmethod
+    def update_lines(
+        cls, pk: int, quantities: dict[int, int], replace: bool = False
+    ) -> Order:
+        """Изменяет позиции заказа (строка заказа блокируется).
+
+        Raises:
+            Http404: Заказ не найден.
+            ValidationError: Заказ оплачен или позиции некорректны.
+        """
+        with transaction.atomic():
+            order = get_object_or_404(
+                Order.objects.select_for_update(), pk=pk
+            )
+            if order.status == OrderStatus.PAID:
+                raise ValidationError("Order is already paid")
+            OrderLineService.upsert_lines(order, quantities, replace)
+        return order
+
+    @classmethod
+    def serialize(cls, order: Order) -> dict:
+        return order_serializer.serialize(
+            order, order_serializer.default + ("lines",)
+        )
+
+
+class LineItemsLimitExceeded(Exception):
+    """Заказ не может быть оплачен сессией stripe (количество позиций
+    больше ограничения), оплата выполняется через PaymentIntent."""
+
+    def __init__(self, pk: int):
+        self.pk = pk
+        super().__init__(
+            f"Order {pk} exceeds the checkout session line items limit"
+        )
+
+
+class IntentAmountMismatch(Exception):
+    """Сумма PaymentIntent в stripe не совпадает с суммой заказа."""
+
+    def __init__(self, intent_id: str, amount: int, expected: int):
+        self.intent_id = intent_id
+        super().__init__(
+            f"PaymentIntent {intent_id} amount {amount} "
+            f"does not match the order amount {expected}"
+        )
+
+
 class OrderPaymentService:
+    # Способы оплаты заказа с количеством позиций больше ограничения
+    # stripe (STRIPE_CHECKOUT_LINE_ITEMS["OVERFLOW"])
+    OVERFLOW_SUMMARIZE = "summarize"
+    OVERFLOW_PAYMENT_INTENT = "payment_intent"
+
     @classmethod
     def get_price_data(
         cls, order: Order, tax_rates: list[str] = None
@@ -138,10 +708,147 @@ class OrderPaymentService:
             order: Объект заказа.
         """
         return [
-            ItemPaymentService.get_price_data(item, tax_rates)
-            for item in order.items.all()
+            ItemPaymentService.get_price_data(
+                line.item, tax_rates, line.quantity, line.price
+            )
+            for line in order.lines.all()
         ]
 
+    @classmethod
+    def collapse_price_data(
+        cls, order: Order, tax_rates: list[str] = None
+    ) -> tuple[list[tuple[dict, int]], dict[str, list[int]]]:
+        """Возвращает данные товарных позиций заказа и их стоимость.
+
+        Позиции с одинаковой ценой stripe (или одинаковыми данными цены)
+        объединяются в одну с суммарным количеством. Позиции в валюте,
+        отличной от валюты расчетов заказа, не передаются по отдельности:
+        для каждой такой валюты возвращаются стоимость и количество
+        позиций.
+
+        Args:
+            order: Объект заказа.
+            tax_rates: Идентификаторы налоговых ставок stripe.
+        """
+        collapsed = {}
+        foreign = {}
+        for line in order.lines.all():
+            if line.item.currency != order.currency:
+                totals = foreign.setdefault(line.item.currency, [0, 0])
+                totals[0] += line.amount
+                totals[1] += 1
+                continue
+            data = ItemPaymentService.get_price_data(
+                line.item, tax_rates, line.quantity, line.price
+            )
+            if "price" in data:
+                key = data["price"]
+            else:
+                key = (line.item.currency, line.price, line.item.name)
+            if key in collapsed:
+                collapsed[key][0]["quantity"] += line.quantity
+                collapsed[key][1] += line.amount
+            else:
+                collapsed[key] = [data, line.amount]
+        return [(data, amount) for data, amount in collapsed.values()], foreign
+
+    @classmethod
+    def get_summary_data(
+        cls, order: Order, name: str, amount: int, tax_rates: list[str]
+    ) -> list[dict]:
+        """Итоговые позиции на сумму amount в валюте расчетов заказа.
+
+        Сумма распределяется по позициям с ценой единицы не больше
+        MAX_UNIT_AMOUNT.
+
+        Args:
+            order: Объект заказа.
+            name: Наименование итоговой позиции.
+            amount: Сумма (копеек).
+            tax_rates: Идентификаторы налоговых ставок stripe.
+        """
+        max_unit_amount = settings.STRIPE_CHECKOUT_LINE_ITEMS[
+            "MAX_UNIT_AMOUNT"
+        ]
+        parts = max(-(-amount // max_unit_amount), 1)
+        summary = []
+        for part in range(parts):
+            unit_amount = min(amount, max_unit_amount)
+            amount -= unit_amount
+            summary.append(
+                {
+                    "price_data": {
+                        "currency": order.currency,
+                        "unit_amount": unit_amount,
+                        "product_data": {
+                            "name": name
+                            if parts == 1
+                            else f"{name}, часть {part + 1} из {parts}",
+                        },
+                    },
+                    "quantity": 1,
+                    "tax_rates": tax_rates,
+                }
+            )
+        return summary
+
+    @classmethod
+    def get_line_items(
+        cls, order: Order, tax_rates: list[str] = None
+    ) -> Optional[list[dict]]:
+        """Возвращает позиции заказа для сессии stripe с учетом ограничения
+        количества позиций (STRIPE_CHECKOUT_LINE_ITEMS).
+
+        Одинаковые позиции объединяются. Товары в других валютах
+        передаются итоговыми позициями по валютам с суммой, пересчитанной
+        в валюту расчетов заказа. Если позиций по-прежнему больше
+        ограничения, последние из них заменяются итоговыми позициями
+        с их общей стоимостью (режим summarize). Сумма позиций сессии
+        совпадает с суммой товаров заказа, а скидка, налог и доставка
+        применяются к ней так же, как к заказу. Возвращает None, если
+        заказ должен оплачиваться через PaymentIntent (режим
+        payment_intent или сумма не умещается в итоговые позиции).
+
+        Args:
+            order: Объект заказа.
+            tax_rates: Идентификаторы налоговых ставок stripe.
+        """
+        if tax_rates is None:
+            tax_rates = []
+        config = settings.STRIPE_CHECKOUT_LINE_ITEMS
+        collapsed, foreign = cls.collapse_price_data(order, tax_rates)
+        converted = []
+        for currency, (amount, count) in sorted(foreign.items()):
+            converted += cls.get_summary_data(
+                order,
+                f"Товары в {currency.upper()} ({count} поз.)",
+                convert_amounts({currency: amount}, order.currency),
+                tax_rates,
+            )
+        limit = config["MAX"] - len(converted)
+        if len(collapsed) <= limit:
+            return [data for data, _ in collapsed] + converted
+        if config["OVERFLOW"] != cls.OVERFLOW_SUMMARIZE:
+            return None
+        # Стоимость позиций, начиная с каждой, до конца заказа
+        remaining = [0] * (len(collapsed) + 1)
+        for index in range(len(collapsed) - 1, -1, -1):
+            remaining[index] = remaining[index + 1] + collapsed[index][1]
+        for parts in range(1, limit):
+            kept = limit - parts
+            if remaining[kept] <= parts * config["MAX_UNIT_AMOUNT"]:
+                break
+        else:
+            return None
+        summary = cls.get_summary_data(
+            order,
+            f"Прочие товары заказа {order.pk} "
+            f"({len(collapsed) - kept} поз.)",
+            remaining[kept],
+            tax_rates,
+        )
+        return [data for data, _ in collapsed[:kept]] + summary + converted
+
     @classmethod
     def get_discounts_data(cls, order: Order) -> list[dict]:
         if not order.discount:
@@ -149,6 +856,100 @@ class OrderPaymentService:
         coupon_id = DiscountService.generate_coupon_id(order.discount.id)
         return [{"coupon": coupon_id}]
 
+    @classmethod
+    def build_payload(cls, pk: int) -> dict:
+        """Возвращает данные позиций, скидок и доставки заказа для сессии
+        stripe (line_items, discounts, shipping_options).
+
+        Для заказа, который оплачивается через PaymentIntent
+        (см. get_line_items), возвращает {"payment_intent": True}.
+
+        Args:
+            pk: Идентификатор объекта заказа.
+        """
+        order = get_object_or_404(
+            Order.objects.select_related(
+                "tax", "discount", "shipping"
+            ).prefetch_related("lines__item"),
+            pk=pk,
+        )
+        tax_rates = []
+        if order.tax and order.tax.tax_id:
+            # tax_id пуст, пока налог не синхронизирован со stripe
+            tax_rates = [order.tax.tax_id]
+        line_items = cls.get_line_items(order, tax_rates)
+        if line_items is None:
+            return {"payment_intent": True}
+        payload = {
+            "line_items": line_items,
+            "discounts": cls.get_discounts_data(order),
+        }
+        if order.shipping:
+            shipping_data = ShippingTaxService.get_shipping_rate_data(
+                order.shipping
+            )
+            # Стоимость доставки в валюте расчетов заказа
+            shipping_data["fixed_amount"] = {
+                "amount": order.pricing.shipping,
+                "currency": order.currency,
+            }
+            payload["shipping_options"] = [
+                {"shipping_rate_data": shipping_data}
+            ]
+        return payload
+
+    @classmethod
+    def get_session_params(
+        cls, pk: int, success_url: str, cancel_url: str
+    ) -> dict:
+        """Возвращает параметры создания сессии для заказа.
+
+        Args:
+            pk: Идентификатор объекта заказа.
+            success_url: Адрес перенаправления при успешном выполнении.
+            cancel_url: Адрес перенаправления при отмене.
+        """
+        return cls.get_session_request(pk, success_url, cancel_url)[0]
+
+    @classmethod
+    def get_session_request(
+        cls, pk: int, success_url: str, cancel_url: str
+    ) -> tuple[dict, str]:
+        """Возвращает параметры создания сессии и их отпечаток.
+
+        Данные позиций берутся из кэша по версии заказа
+        (checkout_payload_cache), отпечаток параметров вычисляется по
+        отпечатку данных без повторной сериализации позиций.
+
+        Args:
+            pk: Идентификатор объекта заказа.
+            success_url: Адрес перенаправления при успешном выполнении.
+            cancel_url: Адрес перенаправления при отмене.
+
+        Raises:
+            LineItemsLimitExceeded: Заказ оплачивается через PaymentIntent.
+        """
+        payload, digest = checkout_payload_cache.get_or_build(
+            pk, cls.build_payload
+        )
+        if payload.get("payment_intent"):
+            raise LineItemsLimitExceeded(pk)
+        params = {
+            "payment_method_types": ["card"],
+            **payload,
+            "metadata": {"order_id": pk},
+            "mode": "payment",
+            "success_url": success_url,
+            "cancel_url": cancel_url,
+        }
+        fingerprint = checkout_session_cache.fingerprint(
+            {
+                **{key: params[key] for key in params if key not in payload},
+                "payload": digest,
+            }
+        )
+        return params, fingerprint
+
     @classmethod
     def get_session(
         cls, pk: int, success_url: str, cancel_url: str
@@ -160,37 +961,115 @@ class OrderPaymentService:
             success_url: Адрес перенаправления при успешном выполнении.
             cancel_url: Адрес перенаправления при отмене.
         """
-        order = get_object_or_404(
-            Order.objects.select_related(
-                "tax", "discount", "shipping"
-            ).prefetch_related("items"),
-            pk=pk,
+        params, fingerprint = cls.get_session_request(
+            pk, success_url, cancel_url
         )
-        shipping_data = ShippingTaxService.get_shipping_rate_data(
-            order.shipping
+        return checkout_session_cache.get_or_create(
+            "order", pk, params, fingerprint
         )
-        tax_rates = [order.tax.tax_id] if order.tax else []
-        return stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            line_items=cls.get_price_data(order, tax_rates),
-            discounts=cls.get_discounts_data(order),
-            metadata={"order_id": order.id},
-            mode="payment",
-            success_url=success_url,
-            cancel_url=cancel_url,
-            shipping_options=[{"shipping_rate_data": shipping_data}],
+
+    @classmethod
+    async def aget_session(
+        cls, pk: int, success_url: str, cancel_url: str
+    ) -> Session:
+        """Асинхронная версия get_session."""
+        params, fingerprint = await sync_to_async(cls.get_session_request)(
+            pk, success_url, cancel_url
+        )
+        return await checkout_session_cache.aget_or_create(
+            "order", pk, params, fingerprint
         )
 
     @classmethod
-    def get_intent(cls, order: Order) -> PaymentIntent:
-        """Возвращает объект PaymentIntent для заказа.
+    def get_intent_idempotency_key(
+        cls, order: Order, amount: int, currency: str
+    ) -> str:
+        """Ключ идемпотентности запроса PaymentIntent для суммы заказа.
+
+        Номер попытки позволяет создать новый PaymentIntent, если
+        предыдущий с той же суммой уже оплачен или отменен.
+        """
+        attempt_number = order.payment_attempts.count()
+        return f"order-{order.pk}-{amount}-{currency}-{attempt_number}"
+
+    @classmethod
+    def get_intent(cls, order: Order) -> PaymentAttempt:
+        """Возвращает попытку оплаты (PaymentIntent) для заказа.
+
+        Ранее созданный PaymentIntent используется повторно без обращения
+        к stripe; при изменении суммы заказа он изменяется в stripe, при
+        изменении валюты заказа отменяется и заменяется новым.
 
         Args:
             order: Объект заказа.
+
+        Raises:
+            ValidationError: Заказ уже оплачен.
+            IntentAmountMismatch: Сумма PaymentIntent после изменения
+                не совпадает с суммой заказа.
+        """
+        if order.status == OrderStatus.PAID:
+            raise ValidationError("Order is already paid")
+        pricing = order.pricing
+        attempt = order.payment_attempts.filter(
+            status__in=PaymentAttempt.REUSABLE_STATUSES
+        ).first()
+        if attempt and attempt.currency == pricing.currency:
+            if attempt.amount == pricing.final:
+                return attempt
+            # Ключ включает прежнюю сумму и время изменения попытки: при
+            # возврате к прежней сумме заказа (A -> B -> A -> B) stripe
+            # не должен повторить ответ на предыдущее изменение
+            changed_at = attempt.updated_at.timestamp()
+            intent = get_gateway().modify_payment_intent(
+                attempt.intent_id,
+                amount=pricing.final,
+                idempotency_key=(
+                    f"order-{order.pk}-{attempt.intent_id}-{attempt.amount}-"
+                    f"{changed_at:.6f}-{pricing.final}"
+                ),
+            )
+            if intent.amount != pricing.final:
+                raise IntentAmountMismatch(
+                    intent.id, intent.amount, pricing.final
+                )
+        else:
+            if attempt:
+                cls.cancel_attempt(attempt)
+            intent = get_gateway().create_payment_intent(
+                amount=pricing.final,
+                currency=pricing.currency,
+                payment_method_types=["card"],
+                metadata={
+                    "integration_check": "accept_a_payment",
+                    "order_id": order.id,
+                },
+                idempotency_key=cls.get_intent_idempotency_key(
+                    order, pricing.final, pricing.currency
+                ),
+            )
+        attempt, _ = PaymentAttempt.objects.update_or_create(
+            intent_id=intent.id,
+            defaults={
+                "order": order,
+                "client_secret": intent.client_secret,
+                "amount": intent.amount,
+                "currency": intent.currency,
+                "status": intent.status,
+            },
+        )
+        return attempt
+
+    @classmethod
+    def cancel_attempt(cls, attempt: PaymentAttempt):
+        """Отменяет замененный PaymentIntent, чтобы его нельзя было
+        подтвердить.
+
+        Args:
+            attempt: Попытка оплаты заказа.
         """
-        return stripe.PaymentIntent.create(
-            amount=order.get_final_price(),
-            currency=order.get_currency(),
-            payment_method_types=["card"],
-            metadata={"integration_check": "accept_a_payment"},
+        intent = get_gateway().cancel_payment_intent(
+            attempt.intent_id, idempotency_key=f"cancel-{attempt.intent_id}"
         )
+        attempt.status = intent.status
+        attempt.save(update_fields=["status", "updated_at"])
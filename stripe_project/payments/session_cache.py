@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from stripe.checkout import Session
+
+from .gateways import get_gateway
+
+
+class CheckoutSessionCache:
+    """Кэш созданных в stripe сессий оформления заказа.
+
+    Ключ сессии включает вид и идентификатор объекта, а также отпечаток
+    всех параметров создания сессии (состав и цены позиций, скидки,
+    доставка, адреса перенаправления), поэтому при изменении цены или
+    состава заказа создается новая сессия. Время жизни записи (ttl за
+    вычетом запаса) меньше срока действия сессии в stripe (expires_at).
+    """
+
+    prefix = "checkout_session"
+    # Запас времени, чтобы не выдавать сессию, истекающую в stripe
+    expiry_margin = 60
+    # stripe требует, чтобы сессия истекала не ранее чем через 30 минут
+    # после создания (отсчет ведется от получения запроса stripe)
+    min_expiry = 30 * 60
+    # Ожидание сессии, которую в этот момент создает другой процесс
+    lock_timeout = 10
+    lock_wait = 0.05
+    lock_attempts = 40
+
+    def __init__(self, alias: str = "default", ttl: int = None):
+        self.alias = alias
+        self.ttl = ttl or settings.STRIPE_CHECKOUT_SESSION_TTL
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def fingerprint(self, params: dict) -> str:
+        """Отпечаток параметров создания сессии (sha256)."""
+        return hashlib.sha256(
+            json.dumps(params, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def make_key(
+        self, kind: str, pk: int, params: dict, fingerprint: str = None
+    ) -> str:
+        generation = self.cache.get(self.generation_key(kind, pk), 0)
+        fingerprint = fingerprint or self.fingerprint(params)
+        return f"{self.prefix}:{kind}:{pk}:{generation}:{fingerprint}"
+
+    def generation_key(self, kind: str, pk: int) -> str:
+        return f"{self.prefix}:{kind}:{pk}:generation"
+
+    def invalidate(self, kind: str, pk: int):
+        """Прекращает выдачу из кэша сессий объекта.
+
+        Вызывается, когда сессия завершена (оплачена или истекла) и не
+        может быть использована повторно.
+        """
+        key = self.generation_key(kind, pk)
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            pass  # запись вытеснена из кэша (или кэш отключен)
+
+    def get_or_create(
+        self, kind: str, pk: int, params: dict, fingerprint: str = None
+    ) -> Session:
+        """Возвращает сессию из кэша или создает ее в stripe.
+
+        Args:
+            kind: Вид объекта (item, order).
+            pk: Идентификатор объекта.
+            params: Параметры stripe.checkout.Session.create.
+            fingerprint: Отпечаток параметров, если уже вычислен.
+        """
+        key = self.make_key(kind, pk, params, fingerprint)
+        data, locked = self.lookup(key)
+        if data is None and not locked:
+            data = self.wait(key)
+        if data is not None:
+            self.count(kind, "hits")
+            return Session.construct_from(data, None)
+        self.count(kind, "misses")
+        try:
+            session = get_gateway().create_checkout_session(
+                expires_at=self.expires_at(), **params
+            )
+            self.store(key, session)
+        finally:
+            self.cache.delete(f"{key}:lock")
+        return session
+
+    async def aget_or_create(
+        self, kind: str, pk: int, params: dict, fingerprint: str = None
+    ) -> Session:
+        """Асинхронная версия get_or_create.
+
+        Обращения к кэшу выполняются в потоке синхронного кода Django,
+        запрос к платежному шлюзу не блокирует цикл событий.
+        """
+        key = await sync_to_async(self.make_key)(
+            kind, pk, params, fingerprint
+        )
+        data, locked = await sync_to_async(self.lookup)(key)
+        if data is None and not locked:
+            data = await self.await_wait(key)
+        if data is not None:
+            await sync_to_async(self.count)(kind, "hits")
+            return Session.construct_from(data, None)
+        await sync_to_async(self.count)(kind, "misses")
+        try:
+            session = await get_gateway().acreate_checkout_session(
+                expires_at=self.expires_at(), **params
+            )
+            await sync_to_async(self.store)(key, session)
+        finally:
+            await sync_to_async(self.cache.delete)(f"{key}:lock")
+        return session
+
+    def expires_at(self) -> int:
+        """Срок действия создаваемой сессии с запасом на задержку запроса."""
+        return (
+            int(time.time())
+            + max(self.ttl, self.min_expiry)
+            + self.expiry_margin
+        )
+
+    def lookup(self, key: str) -> tuple:
+        """Возвращает данные сессии и признак захвата блокировки создания."""
+        data = self.cache.get(key)
+        if data is not None:
+            return data, False
+        return None, self.cache.add(f"{key}:lock", 1, self.lock_timeout)
+
+    def store(self, key: str, session: Session):
+        self.cache.set(
+            key,
+            {"id": session.id, "url": session.url},
+            self.ttl - self.expiry_margin,
+        )
+
+    def wait(self, key: str):
+        for _ in range(self.lock_attempts):
+            time.sleep(self.lock_wait)
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+        return None
+
+    async def await_wait(self, key: str):
+        for _ in range(self.lock_attempts):
+            await asyncio.sleep(self.lock_wait)
+            data = await sync_to_async(self.cache.get)(key)
+            if data is not None:
+                return data
+        return None
+
+    def count(self, kind: str, name: str):
+        key = f"{self.prefix}:stats:{kind}:{name}"
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            pass  # запись вытеснена из кэша (или кэш отключен)
+
+    def stats(self) -> dict:
+        """Количество попаданий и промахов кэша по видам объектов."""
+        stats = {}
+        for kind in ("item", "order"):
+            hits = self.cache.get(f"{self.prefix}:stats:{kind}:hits", 0)
+            misses = self.cache.get(f"{self.prefix}:stats:{kind}:misses", 0)
+            total = hits + misses
+            stats[kind] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / total if total else 0.0,
+            }
+        return stats
+
+
+checkout_session_cache = CheckoutSessionCache()
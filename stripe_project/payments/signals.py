@@ -1,22 +1,295 @@
-from django.core.exceptions import ValidationError
-from django.db.models.signals import m2m_changed
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
 
-from .models import Item, Order
+from .exchange import exchange_rates, get_settlement_currency
+from .jobs import enqueue
+from .models import (
+    Discount,
+    ExchangeRate,
+    Item,
+    Order,
+    OrderLine,
+    OrderStatus,
+    ShippingTax,
+    Tax,
+)
+from .page_cache import page_cache
+from .pricing import (
+    TOTALS_FIELDS,
+    convert_amounts,
+    get_lines_amounts,
+    rebuild_orders_totals,
+    refresh_order_totals,
+    refresh_orders_totals,
+)
+from .services import OrderLineService
 
 
 @receiver(m2m_changed, sender=Order.items.through)
-def order_same_currency_validator(
+def order_exchange_rate_validator(
     sender, instance, action, reverse, model, pk_set, **kwargs
 ):
-    if action == "pre_add":
-        exist_currencies = set(
-            [item.currency for item in instance.items.all()]
+    """Проверяет, что для валют добавляемых товаров есть курсы пересчета
+    в валюту расчетов заказа."""
+    if action == "pre_add" and not reverse:
+        OrderLineService.validate_currency(instance, pk_set)
+
+
+def set_lines_totals(order: Order, amounts: dict[str, int], count: int):
+    """Записывает в заказ сумму всех его позиций (в валюте расчетов)."""
+    order.currency = get_settlement_currency(
+        amounts, order.shipping.currency if order.shipping else None
+    )
+    order.gross_amount = convert_amounts(amounts, order.currency)
+    order.items_count = count
+
+
+def snapshot_unit_prices(lines):
+    """Запоминает текущую цену товара в добавленных позициях заказа."""
+    lines.filter(unit_price__isnull=True).update(
+        unit_price=Subquery(
+            Item.objects.filter(pk=OuterRef("item_id")).values("price")[:1]
         )
-        added_currencies = set(
-            [item.currency for item in Item.objects.filter(pk__in=pk_set)]
+    )
+
+
+@receiver(m2m_changed, sender=Order.items.through)
+def order_items_totals(
+    sender, instance, action, reverse, model, pk_set, **kwargs
+):
+    """Инкрементально обновляет итоги заказа при изменении товаров."""
+    if reverse:
+        # Изменяются заказы товара: пересчитываем затронутые заказы целиком
+        if action == "pre_clear":
+            instance._cleared_order_ids = list(
+                instance.orders.values_list("pk", flat=True)
+            )
+        elif action in ("post_add", "post_remove"):
+            if action == "post_add":
+                snapshot_unit_prices(
+                    OrderLine.objects.filter(item=instance, order__in=pk_set)
+                )
+            rebuild_orders_totals(Order.objects.filter(pk__in=pk_set))
+            page_cache.touch_orders(*pk_set)
+        elif action == "post_clear":
+            order_ids = getattr(instance, "_cleared_order_ids", [])
+            rebuild_orders_totals(Order.objects.filter(pk__in=order_ids))
+            page_cache.touch_orders(*order_ids)
+        return
+
+    # Итоги изменяются на сумму позиций, если их валюта совпадает с валютой
+    # расчетов заказа и не может ее изменить; иначе (товары в другой
+    # валюте) сумма пересчитывается по всем позициям заказа
+    if action == "pre_remove":
+        # pk_set может содержать товары, которых нет в заказе
+        instance._removed_totals = get_lines_amounts(
+            instance.lines.filter(item__in=pk_set)
         )
-        if len(exist_currencies | added_currencies) > 1:
-            raise ValidationError(
-                "Order items should have the same currencies"
+        return
+    if action == "post_add":
+        lines = instance.lines.filter(item__in=pk_set)
+        snapshot_unit_prices(lines)
+        amounts, count = get_lines_amounts(lines)
+        if not instance.items_count:
+            set_lines_totals(instance, amounts, count)
+        elif set(amounts) <= {instance.currency}:
+            instance.gross_amount += amounts.get(instance.currency, 0)
+            instance.items_count += count
+        else:
+            amounts, count = get_lines_amounts(instance.lines.all())
+            set_lines_totals(instance, amounts, count)
+    elif action == "post_remove":
+        amounts, count = instance._removed_totals
+        # Заказ в валюте, отличной от SETTLEMENT_CURRENCY, содержит
+        # товары только этой валюты
+        if count == instance.items_count:
+            set_lines_totals(instance, {}, 0)
+        elif (
+            set(amounts) <= {instance.currency}
+            and instance.currency != settings.SETTLEMENT_CURRENCY
+        ):
+            instance.gross_amount -= amounts.get(instance.currency, 0)
+            instance.items_count -= count
+        else:
+            amounts, count = get_lines_amounts(instance.lines.all())
+            set_lines_totals(instance, amounts, count)
+    elif action == "post_clear":
+        set_lines_totals(instance, {}, 0)
+    else:
+        return
+    instance.save(update_fields=TOTALS_FIELDS)
+
+
+@receiver(pre_save, sender=Order)
+def order_refresh_totals(sender, instance, update_fields, **kwargs):
+    """Пересчитывает итоги заказа (могли смениться скидка, налог, доставка).
+
+    Сумма товаров в памяти может устареть, если заказ был пересчитан
+    через связанные объекты, поэтому при полном сохранении она
+    перечитывается из базы данных.
+    """
+    if not instance._state.adding and update_fields is None:
+        stored = (
+            Order.objects.filter(pk=instance.pk)
+            .values("gross_amount", "items_count", "currency")
+            .first()
+        )
+        if stored:
+            instance.gross_amount = stored["gross_amount"]
+            instance.items_count = stored["items_count"]
+            instance.currency = stored["currency"]
+    refresh_order_totals(instance)
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_save, sender=Tax)
+@receiver(post_save, sender=ShippingTax)
+def related_orders_refresh_totals(sender, instance, created, **kwargs):
+    """Обновляет итоги неоплаченных заказов, ссылающихся на измененный
+    объект (суммы оплаченных заказов не изменяются)."""
+    if not created:
+        refresh_orders_totals(instance.orders.filter(status=OrderStatus.NEW))
+
+
+@receiver(pre_delete, sender=Discount)
+@receiver(pre_delete, sender=Tax)
+@receiver(pre_delete, sender=ShippingTax)
+@receiver(pre_delete, sender=Item)
+def related_orders_remember(sender, instance, **kwargs):
+    instance._order_ids = list(instance.orders.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Discount)
+@receiver(post_delete, sender=Tax)
+@receiver(post_delete, sender=ShippingTax)
+def related_orders_refresh_after_delete(sender, instance, **kwargs):
+    refresh_orders_totals(
+        Order.objects.filter(
+            pk__in=instance._order_ids, status=OrderStatus.NEW
+        )
+    )
+
+
+# Поля товара, передаваемые в stripe
+ITEM_TRACKED_FIELDS = ("name", "description", "price", "currency")
+
+
+@receiver(pre_save, sender=Item)
+def item_remember_changes(sender, instance, raw, **kwargs):
+    """Запоминает поля товара, измененные относительно базы данных.
+
+    При изменении цены или валюты идентификатор цены stripe сбрасывается,
+    и до синхронизации цена передается в сессию оплаты явно.
+    """
+    instance._changed_fields = set()
+    if raw:
+        return
+    stored = (
+        Item.objects.filter(pk=instance.pk)
+        .values(*ITEM_TRACKED_FIELDS)
+        .first()
+        if instance.pk
+        else None
+    )
+    if stored is None:
+        instance._changed_fields = set(ITEM_TRACKED_FIELDS)
+        return
+    instance._changed_fields = {
+        field
+        for field in ITEM_TRACKED_FIELDS
+        if stored[field] != getattr(instance, field)
+    }
+    if instance._changed_fields & {"price", "currency"}:
+        instance.stripe_price_id = ""
+
+
+@receiver(post_save, sender=Item)
+def item_stripe_sync(sender, instance, **kwargs):
+    if getattr(instance, "_changed_fields", None):
+        enqueue("item.sync", instance.pk)
+
+
+@receiver(post_save, sender=Item)
+def item_orders_rebuild_totals(sender, instance, created, **kwargs):
+    """Пересчитывает неоплаченные заказы, содержащие товар с измененной
+    валютой.
+
+    Цена товара запоминается в позициях заказов, поэтому ее изменение
+    на стоимость существующих заказов не влияет.
+    """
+    if not created and "currency" in getattr(
+        instance, "_changed_fields", set()
+    ):
+        rebuild_orders_totals(
+            Order.objects.filter(
+                pk__in=instance.orders.values_list("pk", flat=True),
+                status=OrderStatus.NEW,
             )
+        )
+
+
+@receiver(post_delete, sender=Item)
+def item_orders_rebuild_after_delete(sender, instance, **kwargs):
+    rebuild_orders_totals(
+        Order.objects.filter(
+            pk__in=instance._order_ids, status=OrderStatus.NEW
+        )
+    )
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def exchange_rates_clear(sender, instance, **kwargs):
+    """Сбрасывает матрицу курсов процесса (остальные процессы получат
+    новые курсы по истечении EXCHANGE_RATES_TTL)."""
+    exchange_rates.clear()
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_page_cache_touch(sender, instance, **kwargs):
+    page_cache.touch_orders(instance.pk)
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_save, sender=Tax)
+@receiver(post_save, sender=ShippingTax)
+def related_orders_page_cache_touch(sender, instance, created, **kwargs):
+    """Сбрасывает страницы заказов, отображающих измененный объект."""
+    if not created:
+        page_cache.touch_orders(
+            *instance.orders.values_list("pk", flat=True)
+        )
+
+
+@receiver(post_delete, sender=Discount)
+@receiver(post_delete, sender=Tax)
+@receiver(post_delete, sender=ShippingTax)
+def related_orders_page_cache_touch_after_delete(sender, instance, **kwargs):
+    page_cache.touch_orders(*instance._order_ids)
+
+
+@receiver(post_save, sender=Item)
+def item_page_cache_touch(sender, instance, created, **kwargs):
+    """Сбрасывает страницы товара, каталога и заказов с этим товаром."""
+    if not getattr(instance, "_changed_fields", None):
+        return
+    page_cache.touch_items(instance.pk)
+    if not created:
+        page_cache.touch_orders(
+            *instance.orders.values_list("pk", flat=True)
+        )
+
+
+@receiver(post_delete, sender=Item)
+def item_page_cache_touch_after_delete(sender, instance, **kwargs):
+    page_cache.touch_items(instance.pk)
+    page_cache.touch_orders(*instance._order_ids)
@@ -0,0 +1,322 @@
+import base64
+import json
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .benchmarks.seed import seed
+from .breaker import CircuitBreaker, CircuitOpenError
+from .gateways import get_gateway
+from .models import Discount, Order, OrderStatus
+from .ratelimit import CHECKOUT, StripeRateLimiter
+from .serializers import item_serializer
+from .services import (
+    CartService,
+    OrderLineService,
+    OrderPaymentService,
+)
+from .views import OrderList
+
+# Страницы отрисовываются заново при каждом запросе (без кэша страниц)
+NO_CACHE = {
+    "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+}
+
+LINE_ITEMS = {"MAX": 100, "MAX_UNIT_AMOUNT": 99999999, "OVERFLOW": "summarize"}
+
+
+@override_settings(CACHES=NO_CACHE)
+class OrderListQueriesTest(TestCase):
+    """Количество запросов списка заказов не зависит от количества
+    заказов на странице и позиций в заказах."""
+
+    # Заказы страницы с итогами позиций, скидкой, налогом и доставкой
+    QUERIES = 1
+
+    def assert_pages_queries(self, lines: int):
+        seed([lines], orders=OrderList.page_size + 1)
+        url = reverse("payments:order-list")
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["object_list"]), 100)
+        cursor = response.context["next_cursor"]
+        self.assertIsNotNone(cursor)
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get(url, {"after": cursor})
+        self.assertEqual(len(response.context["object_list"]), 1)
+        self.assertIsNone(response.context["next_cursor"])
+        order = response.context["object_list"][0]
+        self.assertEqual(order.items_pricing, order.pricing)
+        self.assertEqual(order.items_pricing.items_count, lines)
+
+    def test_single_line_orders(self):
+        self.assert_pages_queries(1)
+
+    def test_large_orders(self):
+        self.assert_pages_queries(25)
+
+
+@override_settings(CACHES=NO_CACHE)
+class MalformedCursorTest(TestCase):
+    """Поврежденный ключ страницы дает 404, а не ошибку запроса."""
+
+    CURSORS = (
+        "not base64!",
+        "e30=",
+        ["x"],
+        [None],
+        [2**64],
+        [{"a": 1}, "x"],
+        ["name", "x"],
+        [["name"], 1],
+    )
+
+    def assert_malformed(self, name: str, cursors):
+        url = reverse(name)
+        for cursor in cursors:
+            if isinstance(cursor, list):
+                cursor = base64.urlsafe_b64encode(
+                    json.dumps(cursor).encode()
+                ).decode()
+            with self.subTest(url=url, cursor=cursor):
+                response = self.client.get(url, {"after": cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_order_list(self):
+        self.assert_malformed("payments:order-list", self.CURSORS[:5])
+
+    def test_item_list(self):
+        self.assert_malformed("payments:item-list", self.CURSORS)
+
+    def test_api_lists(self):
+        self.assert_malformed("payments:api-order-list", self.CURSORS[:5])
+        self.assert_malformed("payments:api-item-list", self.CURSORS)
+
+
+@override_settings(
+    CACHES=NO_CACHE,
+    PAYMENT_GATEWAY={"BACKEND": "payments.gateways.FakeGateway"},
+    STRIPE_CHECKOUT_LINE_ITEMS=LINE_ITEMS,
+    STRIPE_RATE_LIMIT={"ENABLED": False},
+    STRIPE_CIRCUIT_BREAKER={"ENABLED": False},
+)
+class LargeOrderCheckoutTest(TestCase):
+    """Оплата заказа из 10 000 позиций с ограничениями stripe на
+    количество позиций сессии и сумму позиции."""
+
+    LINES = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        dataset = seed([cls.LINES])
+        cls.pk = dataset.orders[cls.LINES][0]
+
+    def setUp(self):
+        get_gateway.cache_clear()
+        self.addCleanup(get_gateway.cache_clear)
+
+    def get_order(self) -> Order:
+        return Order.objects.select_related(
+            "tax", "discount", "shipping"
+        ).prefetch_related("lines__item").get(pk=self.pk)
+
+    def test_summarize(self):
+        order = self.get_order()
+        line_items = OrderPaymentService.get_line_items(order)
+        self.assertLessEqual(len(line_items), LINE_ITEMS["MAX"])
+        amounts = [data["price_data"]["unit_amount"] for data in line_items]
+        self.assertLessEqual(max(amounts), LINE_ITEMS["MAX_UNIT_AMOUNT"])
+        self.assertEqual(
+            sum(
+                data["price_data"]["unit_amount"] * data["quantity"]
+                for data in line_items
+            ),
+            order.pricing.gross,
+        )
+        # Сумма позиций превышает ограничение суммы одной позиции
+        self.assertGreater(order.pricing.gross, LINE_ITEMS["MAX_UNIT_AMOUNT"])
+
+    @override_settings(
+        STRIPE_CHECKOUT_LINE_ITEMS={**LINE_ITEMS, "OVERFLOW": "payment_intent"}
+    )
+    def test_payment_intent(self):
+        response = self.client.get(
+            reverse("payments:order-session-checkout", args=[self.pk])
+        )
+        redirect = response.json()["redirect"]
+        self.assertEqual(
+            redirect, reverse("payments:order-checkout", args=[self.pk])
+        )
+        self.assertEqual(self.client.get(redirect).status_code, 200)
+        order = self.get_order()
+        attempt = order.payment_attempts.get()
+        intent = get_gateway().get(attempt.intent_id)
+        self.assertEqual(attempt.amount, order.get_final_price())
+        self.assertEqual(intent.amount, order.get_final_price())
+
+
+@override_settings(
+    CACHES=NO_CACHE,
+    PAYMENT_GATEWAY={"BACKEND": "payments.gateways.FakeGateway"},
+    STRIPE_RATE_LIMIT={"ENABLED": False},
+    STRIPE_CIRCUIT_BREAKER={"ENABLED": False},
+)
+class OrderIntentTest(TestCase):
+    """PaymentIntent заказа следует за изменениями суммы заказа."""
+
+    def setUp(self):
+        get_gateway.cache_clear()
+        self.addCleanup(get_gateway.cache_clear)
+        dataset = seed([1], discount=False, tax="", shipping=False)
+        self.item = dataset.items[0]
+        self.pk = dataset.orders[1][0]
+
+    def get_intent(self, quantity: int):
+        CartService.update_lines(self.pk, {self.item: quantity}, True)
+        order = Order.objects.get(pk=self.pk)
+        attempt = OrderPaymentService.get_intent(order)
+        intent = get_gateway().get(attempt.intent_id)
+        self.assertEqual(attempt.amount, order.get_final_price())
+        self.assertEqual(intent.amount, order.get_final_price())
+        return attempt
+
+    def test_amount_changes_back_and_forth(self):
+        attempt = self.get_intent(1)
+        for quantity in (2, 1, 2):
+            self.assertEqual(self.get_intent(quantity), attempt)
+
+    def test_paid_order(self):
+        Order.objects.filter(pk=self.pk).update(status=OrderStatus.PAID)
+        response = self.client.get(
+            reverse("payments:order-checkout", args=[self.pk])
+        )
+        self.assertRedirects(response, reverse("payments:buy_success"))
+        self.assertFalse(
+            Order.objects.get(pk=self.pk).payment_attempts.exists()
+        )
+        self.assertEqual(get_gateway().calls, 0)
+
+
+@override_settings(CACHES=NO_CACHE)
+class CartQuantityTest(TestCase):
+    """Количество позиции корзины: целое от 1 до MAX_QUANTITY."""
+
+    def setUp(self):
+        dataset = seed([1], discount=False, tax="", shipping=False)
+        self.item = dataset.items[0]
+        self.pk = dataset.orders[1][0]
+
+    def post_lines(self, lines: list, url: str = None):
+        return self.client.post(
+            url or reverse("payments:cart-lines", args=[self.pk]),
+            {"lines": lines},
+            content_type="application/json",
+        )
+
+    def test_invalid_quantity(self):
+        max_quantity = OrderLineService.MAX_QUANTITY
+        for quantity in (2.9, True, 0, -1, "2", None, 10**12):
+            with self.subTest(quantity=quantity):
+                response = self.post_lines(
+                    [{"item": self.item, "quantity": quantity}],
+                    reverse("payments:cart-create"),
+                )
+                self.assertEqual(response.status_code, 400)
+        response = self.post_lines(
+            [{"item": self.item, "quantity": max_quantity}] * 2
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_quantity_added_to_line(self):
+        max_quantity = OrderLineService.MAX_QUANTITY
+        line = Order.objects.get(pk=self.pk).lines.get()
+        response = self.post_lines(
+            [{"item": self.item, "quantity": max_quantity - line.quantity}]
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.post_lines([{"item": self.item, "quantity": 1}])
+        self.assertEqual(response.status_code, 400)
+        line.refresh_from_db()
+        self.assertEqual(line.quantity, max_quantity)
+
+
+@override_settings(CACHES=NO_CACHE)
+class PaidOrderTotalsTest(TestCase):
+    """Изменение скидки не изменяет суммы оплаченных заказов."""
+
+    def setUp(self):
+        dataset = seed([3], orders=2)
+        self.paid, self.new = dataset.orders[3]
+        Order.objects.filter(pk=self.paid).update(status=OrderStatus.PAID)
+        self.discount = Discount.objects.get()
+
+    def get_final_prices(self) -> tuple:
+        return tuple(
+            Order.objects.get(pk=pk).get_final_price()
+            for pk in (self.paid, self.new)
+        )
+
+    def test_discount_changed_and_deleted(self):
+        paid, new = self.get_final_prices()
+        self.discount.percent_off = 50
+        self.discount.save()
+        self.assertEqual(self.get_final_prices()[0], paid)
+        self.assertLess(self.get_final_prices()[1], new)
+        self.discount.delete()
+        self.assertEqual(self.get_final_prices()[0], paid)
+        self.assertGreater(self.get_final_prices()[1], new)
+
+
+@override_settings(CACHES=NO_CACHE)
+class CircuitBreakerStateTest(TestCase):
+    """Состояние цепи хранится в общей таблице, а не в кэше процесса."""
+
+    def test_opened_for_other_instances(self):
+        CircuitBreaker(open_duration=30).open()
+        breaker = CircuitBreaker()
+        self.assertEqual(breaker.state(), "open")
+        with self.assertRaises(CircuitOpenError) as context:
+            breaker.before_call()
+        self.assertLessEqual(context.exception.retry_after, 30)
+        CircuitBreaker().close()
+        self.assertEqual(breaker.state(), "closed")
+        self.assertFalse(breaker.before_call())
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(open_duration=0, half_open_probes=1)
+        breaker.open()
+        self.assertEqual(breaker.state(), "half_open")
+        self.assertTrue(breaker.before_call())
+        with self.assertRaises(CircuitOpenError):
+            CircuitBreaker().before_call()
+        breaker.record(failed=False, probe=True)
+        self.assertEqual(CircuitBreaker().state(), "closed")
+
+
+@override_settings(CACHES=NO_CACHE)
+class RateLimiterPauseTest(TestCase):
+    """Пауза после ответа 429 действует для всех экземпляров (процессов)."""
+
+    def test_paused_for_other_instances(self):
+        StripeRateLimiter(rate=25).pause(10)
+        delay = StripeRateLimiter(rate=25).reserve(CHECKOUT)
+        self.assertAlmostEqual(delay, 10, delta=1)
+
+    def test_pause_expires(self):
+        StripeRateLimiter(rate=25).pause(0)
+        self.assertEqual(StripeRateLimiter(rate=25).reserve(CHECKOUT), 0)
+
+
+class FieldsParamTest(SimpleTestCase):
+    """Разбор параметра ?fields= списков API."""
+
+    def test_blank_names_skipped(self):
+        for value in ("id, ,name", "id,name, ", " id ,,name"):
+            with self.subTest(value=value):
+                self.assertEqual(
+                    item_serializer.get_fields(value), ("id", "name")
+                )
+        self.assertEqual(
+            item_serializer.get_fields(" , "), item_serializer.default
+        )
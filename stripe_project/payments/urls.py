@@ -10,6 +10,11 @@ urlpatterns = [
     path("item/", views.ItemList.as_view(), name="item-list"),
     path("item/<int:pk>/", views.ItemDetail.as_view(), name="item-detail"),
     path("buy/<int:pk>/", views.ItemCheckout.as_view(), name="item-checkout"),
+    path(
+        "async/buy/<int:pk>/",
+        views.item_checkout_async,
+        name="item-checkout-async",
+    ),
     path("order/", views.OrderList.as_view(), name="order-list"),
     path("order/<int:pk>/", views.OrderDetail.as_view(), name="order-detail"),
     path(
@@ -22,4 +27,48 @@ urlpatterns = [
         views.OrderSessionCheckout.as_view(),
         name="order-session-checkout",
     ),
+    path(
+        "async/order-session-checkout/<int:pk>/",
+        views.order_session_checkout_async,
+        name="order-session-checkout-async",
+    ),
+    path("api/items/", views.ItemApiList.as_view(), name="api-item-list"),
+    path(
+        "api/items/export/",
+        views.ItemApiExport.as_view(),
+        name="api-item-export",
+    ),
+    path(
+        "api/items/<int:pk>/",
+        views.ItemApiDetail.as_view(),
+        name="api-item-detail",
+    ),
+    path(
+        "api/orders/", views.OrderApiList.as_view(), name="api-order-list"
+    ),
+    path(
+        "api/orders/export/",
+        views.OrderApiExport.as_view(),
+        name="api-order-export",
+    ),
+    path(
+        "api/orders/<int:pk>/",
+        views.OrderApiDetail.as_view(),
+        name="api-order-detail",
+    ),
+    path("api/cart/", views.CartCreate.as_view(), name="cart-create"),
+    path(
+        "api/cart/<int:pk>/", views.CartDetail.as_view(), name="cart-detail"
+    ),
+    path(
+        "api/cart/<int:pk>/lines/",
+        views.CartLines.as_view(),
+        name="cart-lines",
+    ),
+    path(
+        "webhooks/stripe/",
+        views.StripeWebhook.as_view(),
+        name="stripe-webhook",
+    ),
+    path("metrics/", views.MetricsView.as_view(), name="metrics"),
 ]
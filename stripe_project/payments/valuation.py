@@ -0,0 +1,430 @@
+from array import array
+from fractions import Fraction
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+from .exchange import exchange_rates
+from .models import Currency, Order, OrderLine, TaxBehavior
+from .pricing import (
+    BASIS_POINTS,
+    OrderPricing,
+    divide,
+    get_rounding,
+    to_basis_points,
+)
+
+try:
+    import numpy as np
+except ImportError:  # необязательная зависимость
+    np = None
+
+# Предел сумм для расчета в int64: произведение суммы на базисные
+# пункты (и удвоенный остаток при округлении) не должно переполниться
+INT64_SAFE_AMOUNT = (2**63 - 1) // (4 * BASIS_POINTS)
+# Предел произведения суммы на числитель курса при пересчете валют
+INT64_SAFE_PRODUCT = (2**63 - 1) // 4
+
+COLUMNS = (
+    "items_count",
+    "gross",
+    "discount",
+    "subtotal",
+    "tax_inclusive",
+    "tax_exclusive",
+    "shipping",
+    "final",
+)
+
+
+class Valuation:
+    """Стоимость множества заказов в виде столбцов (списки или NumPy).
+
+    Attributes:
+        pks: Идентификаторы заказов (по возрастанию).
+        currencies: Валюты (по алфавиту).
+        currency: Коды валют расчетов заказов (индексы currencies).
+        items_count, gross, discount, subtotal, tax_inclusive,
+        tax_exclusive, shipping, final: Суммы заказов (копеек).
+    """
+
+    def __init__(self, pks, currencies, currency, **columns):
+        self.pks = pks
+        self.currencies = currencies
+        self.currency = currency
+        for name in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self) -> int:
+        return len(self.pks)
+
+    def currency_name(self, code: int) -> str:
+        return self.currencies[code]
+
+    def pricing(self, index: int) -> OrderPricing:
+        return OrderPricing(
+            **{name: int(getattr(self, name)[index]) for name in COLUMNS},
+            currency=self.currency_name(int(self.currency[index])),
+        )
+
+    def __iter__(self):
+        """Пары (идентификатор заказа, OrderPricing)."""
+        for index in range(len(self)):
+            yield int(self.pks[index]), self.pricing(index)
+
+    def summary(self) -> dict:
+        """Количество заказов и суммы по валютам."""
+        totals = {}
+
+        def add(currency: str, orders: int, sums: dict):
+            currency = totals.setdefault(
+                currency, {"orders": 0, **{name: 0 for name in COLUMNS}}
+            )
+            currency["orders"] += orders
+            for name in COLUMNS:
+                currency[name] += sums[name]
+
+        if np is not None and isinstance(self.gross, np.ndarray):
+            for code in np.unique(self.currency):
+                mask = self.currency == code
+                add(
+                    self.currency_name(int(code)),
+                    int(mask.sum()),
+                    {
+                        name: int(getattr(self, name)[mask].sum())
+                        for name in COLUMNS
+                    },
+                )
+            return totals
+        for index in range(len(self)):
+            pricing = self.pricing(index)
+            add(
+                pricing.currency,
+                1,
+                {name: getattr(pricing, name) for name in COLUMNS},
+            )
+        return totals
+
+
+class OrderColumns:
+    """Исходные данные заказов и их позиций в виде столбцов array.
+
+    Args:
+        queryset: Заказы для расчета.
+        batch_size: Размер порции чтения из базы данных.
+    """
+
+    def __init__(self, queryset, batch_size: int = 2000):
+        # Валюты кодируются номерами в порядке сортировки
+        self.currencies = sorted(Currency.values)
+        codes = {
+            currency: code for code, currency in enumerate(self.currencies)
+        }
+        self.default_code = codes[settings.DEFAULT_CURRENCY]
+        self.settlement_code = codes[settings.SETTLEMENT_CURRENCY]
+        self.pks = array("q")
+        self.discount = array("q")
+        self.tax = array("q")
+        self.tax_inclusive = array("b")
+        self.shipping = array("q")
+        # Код валюты доставки, -1 — заказ без доставки
+        self.shipping_currency = array("h")
+        orders = (
+            queryset.order_by("pk")
+            .values_list(
+                "pk",
+                "discount__percent_off",
+                "tax__percentage",
+                "tax__behavior",
+                "shipping__amount",
+                "shipping__currency",
+            )
+            .iterator(chunk_size=batch_size)
+        )
+        for (
+            pk,
+            percent_off,
+            percentage,
+            behavior,
+            shipping,
+            shipping_currency,
+        ) in orders:
+            self.pks.append(pk)
+            self.discount.append(
+                to_basis_points(percent_off) if percent_off is not None else 0
+            )
+            self.tax.append(
+                to_basis_points(percentage) if percentage is not None else 0
+            )
+            self.tax_inclusive.append(behavior == TaxBehavior.INCLUSIVE)
+            self.shipping.append(shipping or 0)
+            self.shipping_currency.append(
+                codes[shipping_currency] if shipping_currency else -1
+            )
+
+        self.line_orders = array("q")
+        self.line_quantities = array("q")
+        self.line_prices = array("q")
+        self.line_currencies = array("h")
+        lines = (
+            OrderLine.objects.filter(order__in=queryset.values("pk"))
+            .order_by("order_id")
+            .values_list(
+                "order_id",
+                "quantity",
+                Coalesce(F("unit_price"), F("item__price")),
+                "item__currency",
+            )
+            .iterator(chunk_size=batch_size)
+        )
+        for order_id, quantity, price, currency in lines:
+            self.line_orders.append(order_id)
+            self.line_quantities.append(quantity)
+            self.line_prices.append(price)
+            self.line_currencies.append(codes[currency])
+
+    def settlement(self, codes, shipping: int) -> int:
+        """Код валюты расчетов заказа по кодам валют его товаров и
+        доставки (см. exchange.get_settlement_currency)."""
+        if len(codes) == 1:
+            return next(iter(codes))
+        if codes:
+            return self.settlement_code
+        return shipping if shipping >= 0 else self.default_code
+
+    def rate(self, source: int, target: int) -> Fraction:
+        """Курс пересчета между валютами по их кодам."""
+        return exchange_rates.rate(
+            self.currencies[source], self.currencies[target]
+        )
+
+    def convert(
+        self, amount: int, source: int, target: int, rounding: str
+    ) -> int:
+        """Пересчет суммы так же, как в pricing.convert_amounts."""
+        if source == target:
+            return amount
+        rate = self.rate(source, target)
+        return divide(amount * rate.numerator, rate.denominator, rounding)
+
+
+def value_columns_python(columns: OrderColumns, rounding: str) -> Valuation:
+    """Расчет без NumPy: проходы по столбцам позиций и заказов.
+
+    Суммы считаются целыми числами Python и не ограничены int64.
+    Суммы позиций накапливаются по валютам и пересчитываются в валюту
+    расчетов заказа по одному разу на валюту.
+    """
+    size = len(columns.pks)
+    index = {pk: i for i, pk in enumerate(columns.pks)}
+    amounts = [{} for _ in range(size)]
+    items_count = array("q", bytes(8 * size))
+    for order_id, quantity, price, code in zip(
+        columns.line_orders,
+        columns.line_quantities,
+        columns.line_prices,
+        columns.line_currencies,
+    ):
+        i = index[order_id]
+        sums = amounts[i]
+        sums[code] = sums.get(code, 0) + quantity * price
+        items_count[i] += 1
+    currency = array(
+        "h",
+        [
+            columns.settlement(sums, shipping)
+            for sums, shipping in zip(amounts, columns.shipping_currency)
+        ],
+    )
+    gross = [
+        sum(
+            columns.convert(amount, source, target, rounding)
+            for source, amount in sums.items()
+        )
+        for sums, target in zip(amounts, currency)
+    ]
+    shipping = [
+        columns.convert(amount, source, target, rounding) if amount else 0
+        for amount, source, target in zip(
+            columns.shipping, columns.shipping_currency, currency
+        )
+    ]
+    discount = [
+        divide(amount * bp, BASIS_POINTS, rounding)
+        for amount, bp in zip(gross, columns.discount)
+    ]
+    subtotal = [amount - off for amount, off in zip(gross, discount)]
+    tax_inclusive = [
+        divide(amount * bp, BASIS_POINTS + bp, rounding) if inclusive else 0
+        for amount, bp, inclusive in zip(
+            subtotal, columns.tax, columns.tax_inclusive
+        )
+    ]
+    tax_exclusive = [
+        0 if inclusive else divide(amount * bp, BASIS_POINTS, rounding)
+        for amount, bp, inclusive in zip(
+            subtotal, columns.tax, columns.tax_inclusive
+        )
+    ]
+    final = [
+        amount + tax + delivery
+        for amount, tax, delivery in zip(subtotal, tax_exclusive, shipping)
+    ]
+    return Valuation(
+        columns.pks,
+        columns.currencies,
+        currency,
+        items_count=items_count,
+        gross=gross,
+        discount=discount,
+        subtotal=subtotal,
+        tax_inclusive=tax_inclusive,
+        tax_exclusive=tax_exclusive,
+        shipping=shipping,
+        final=final,
+    )
+
+
+def convert_column(
+    columns: OrderColumns, column, source: int, target: int, rounding: str
+):
+    """Пересчет столбца сумм NumPy между валютами (None, если
+    произведение суммы на курс может переполнить int64)."""
+    rate = columns.rate(source, target)
+    if (
+        int(column.max(initial=0)) * rate.numerator > INT64_SAFE_PRODUCT
+        or rate.denominator > INT64_SAFE_PRODUCT
+    ):
+        return None
+    return divide(column * rate.numerator, rate.denominator, rounding)
+
+
+def value_columns_numpy(
+    columns: OrderColumns, rounding: str
+) -> Optional[Valuation]:
+    """Векторный расчет по столбцам NumPy (int64, без промежуточных
+    вещественных чисел).
+
+    Суммы позиций накапливаются в матрице (заказ × валюта), суммы
+    в других валютах пересчитываются в валюту расчетов столбцами.
+    Возвращает None, если суммы могут переполнить int64.
+    """
+    pks = np.frombuffer(columns.pks, dtype=np.int64)
+    size = len(pks)
+    line_orders = np.frombuffer(columns.line_orders, dtype=np.int64)
+    # Позиции и заказы упорядочены по идентификатору заказа
+    index = np.searchsorted(pks, line_orders)
+    amounts = np.frombuffer(
+        columns.line_quantities, dtype=np.int64
+    ) * np.frombuffer(columns.line_prices, dtype=np.int64)
+    if amounts.size and int(amounts.max()) * amounts.size > INT64_SAFE_AMOUNT:
+        return None
+    codes = np.frombuffer(columns.line_currencies, dtype=np.int16)
+    sums = np.zeros((size, len(columns.currencies)), dtype=np.int64)
+    np.add.at(sums, (index, codes), amounts)
+    present = np.zeros(sums.shape, dtype=bool)
+    present[index, codes] = True
+    kinds = present.sum(axis=1)
+    shipping_codes = np.frombuffer(columns.shipping_currency, np.int16)
+    empty = np.where(shipping_codes >= 0, shipping_codes, columns.default_code)
+    currency = np.where(
+        kinds == 1,
+        present.argmax(axis=1),
+        np.where(kinds == 0, empty, columns.settlement_code),
+    ).astype(np.int16)
+    items_count = np.bincount(index, minlength=size).astype(np.int64)
+    # Суммы в валюте расчетов, затем пересчет сумм в других валютах
+    # для заказов с товарами разных валют
+    gross = sums[np.arange(size), currency]
+    mixed = kinds > 1
+    for code in range(len(columns.currencies)):
+        column = sums[mixed, code]
+        if code == columns.settlement_code or not column.any():
+            continue
+        converted = convert_column(
+            columns, column, code, columns.settlement_code, rounding
+        )
+        if converted is None:
+            return None
+        gross[mixed] += converted
+    if gross.size and int(gross.max()) > INT64_SAFE_AMOUNT:
+        return None
+    shipping = np.frombuffer(columns.shipping, dtype=np.int64).copy()
+    for source in np.unique(shipping_codes[shipping_codes >= 0]):
+        for target in np.unique(currency[shipping_codes == source]):
+            if source == target:
+                continue
+            mask = (shipping_codes == source) & (currency == target)
+            converted = convert_column(
+                columns, shipping[mask], int(source), int(target), rounding
+            )
+            if converted is None:
+                return None
+            shipping[mask] = converted
+    discount_bp = np.frombuffer(columns.discount, dtype=np.int64)
+    tax_bp = np.frombuffer(columns.tax, dtype=np.int64)
+    inclusive = np.frombuffer(columns.tax_inclusive, dtype=np.int8) == 1
+
+    discount = divide(gross * discount_bp, BASIS_POINTS, rounding)
+    subtotal = gross - discount
+    tax_inclusive = np.where(
+        inclusive,
+        divide(subtotal * tax_bp, BASIS_POINTS + tax_bp, rounding),
+        0,
+    )
+    tax_exclusive = np.where(
+        inclusive, 0, divide(subtotal * tax_bp, BASIS_POINTS, rounding)
+    )
+    return Valuation(
+        pks,
+        columns.currencies,
+        currency,
+        items_count=items_count,
+        gross=gross,
+        discount=discount,
+        subtotal=subtotal,
+        tax_inclusive=tax_inclusive,
+        tax_exclusive=tax_exclusive,
+        shipping=shipping,
+        final=subtotal + tax_exclusive + shipping,
+    )
+
+
+def value_orders(
+    queryset=None,
+    rounding: Optional[str] = None,
+    backend: Optional[str] = None,
+    batch_size: int = 2000,
+) -> Valuation:
+    """Пакетный расчет стоимости заказов (для отчетов по большому
+    количеству заказов).
+
+    Заказы и их позиции загружаются двумя запросами в столбцы, скидка,
+    налоги, доставка и итоги вычисляются проходами по столбцам с теми же
+    целочисленными формулами и округлением, что и calculate_pricing,
+    поэтому результат совпадает с расчетом по одному заказу.
+
+    Args:
+        queryset: Заказы (по умолчанию все).
+        rounding: Режим округления (по умолчанию PRICING_ROUNDING).
+        backend: numpy или python (по умолчанию numpy, если установлен).
+        batch_size: Размер порции чтения из базы данных.
+    """
+    if queryset is None:
+        queryset = Order.objects.all()
+    rounding = get_rounding(rounding)
+    if backend is None:
+        backend = "numpy" if np is not None else "python"
+    if backend == "numpy" and np is None:
+        raise ValueError("NumPy is not installed")
+    if backend not in ("numpy", "python"):
+        raise ValueError(f"Unknown backend: {backend}")
+    columns = OrderColumns(queryset, batch_size)
+    if backend == "numpy":
+        valuation = value_columns_numpy(columns, rounding)
+        if valuation is not None:
+            return valuation
+    # Суммы, которые могут превысить int64, считаются целыми числами Python
+    return value_columns_python(columns, rounding)
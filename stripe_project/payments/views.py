@@ -1,26 +1,119 @@
 import stripe
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.exceptions import ValidationError
+from django.http import (
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView
-from django.views.generic.detail import DetailView
-from django.views.generic.list import ListView
+from django.views.generic.detail import DetailView, SingleObjectMixin
+from django.views.generic.list import ListView, MultipleObjectMixin
 
-from .models import Item, Order
-from .services import ItemPaymentService, OrderPaymentService
+from .breaker import CircuitOpenError
+from .metrics import registry
+from .models import Item, Order, OrderStatus
+from .page_cache import page_cache
+from .pagination import KeysetPaginationMixin
+from .pricing import calculate_annotated_pricing
+from .serializers import (
+    item_serializer,
+    order_serializer,
+    stream_csv,
+    stream_ndjson,
+)
+from .services import (
+    CartService,
+    ItemPaymentService,
+    LineItemsLimitExceeded,
+    OrderPaymentService,
+)
+from .webhooks import WebhookService
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+def payment_error_response(error: Exception) -> JsonResponse:
+    """Ответ при ошибке создания оплаты.
+
+    Если stripe недоступен (цепь разомкнута, сетевая ошибка, ответ 5xx)
+    или превышено ограничение частоты обращений, возвращается 503 с
+    заголовком Retry-After, чтобы клиент повторил запрос позже, иначе 500.
+    """
+    if isinstance(error, CircuitOpenError):
+        code, retry_after = "payment_service_unavailable", error.retry_after
+    elif isinstance(
+        error, (stripe.error.APIConnectionError, stripe.error.APIError)
+    ):
+        code, retry_after = "payment_service_error", 1
+    elif isinstance(error, stripe.error.RateLimitError):
+        code, retry_after = "payment_service_busy", 1
+    else:
+        return JsonResponse({"message": str(error)}, status=500)
+    response = JsonResponse(
+        {
+            "message": "Payment service is temporarily unavailable",
+            "code": code,
+            "retry_after": retry_after,
+        },
+        status=503,
+    )
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def intent_redirect_response(error: LineItemsLimitExceeded) -> JsonResponse:
+    """Ответ для заказа, который не может быть оплачен сессией stripe:
+    адрес страницы оплаты через PaymentIntent."""
+    return JsonResponse(
+        {
+            "message": str(error),
+            "redirect": reverse(
+                "payments:order-checkout", kwargs={"pk": error.pk}
+            ),
+        }
+    )
 
 
 class IndexView(TemplateView):
     template_name = "payments/index.html"
 
 
-class ItemDetail(DetailView):
+class CachedPageMixin:
+    """Выдача страницы через кэш отрисованных страниц (page_cache).
+
+    Attributes:
+        cache_name: Имя страницы в ключах и статистике кэша.
+    """
+
+    cache_name = None
+
+    def get_cache_scopes(self) -> list[str]:
+        """Области (item:1, items, order:1, orders), от которых зависит
+        страница."""
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        return page_cache.serve(
+            request,
+            self.cache_name,
+            self.get_cache_scopes(),
+            lambda: super(CachedPageMixin, self).get(request, *args, **kwargs),
+        )
+
+
+class ItemDetail(CachedPageMixin, DetailView):
     model = Item
     template_name = "payments/item_detail.html"
     pk_url_kwarg = "pk"
+    cache_name = "item-detail"
+
+    def get_cache_scopes(self):
+        return [f"item:{self.kwargs['pk']}"]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -40,23 +133,65 @@ class ItemCheckout(View):
             )
             return JsonResponse({"session_id": checkout_session.id})
         except Exception as e:
-            return JsonResponse({"message": str(e)}, status=500)
+            return payment_error_response(e)
+
 
+async def item_checkout_async(request, pk: int):
+    """Асинхронная версия ItemCheckout (для запуска под ASGI)."""
+    try:
+        checkout_session = await ItemPaymentService.aget_session(
+            pk,
+            success_url=settings.DOMAIN + reverse("payments:buy_success"),
+            cancel_url=settings.DOMAIN
+            + reverse("payments:item-detail", kwargs={"pk": pk}),
+        )
+        return JsonResponse({"session_id": checkout_session.id})
+    except Exception as e:
+        return payment_error_response(e)
 
-class ItemList(ListView):
+
+class ItemList(CachedPageMixin, KeysetPaginationMixin, ListView):
     model = Item
     template_name = "payments/item_list.html"
+    keyset = ("name", "pk")
+    cache_name = "item-list"
+
+    def get_cache_scopes(self):
+        return ["items"]
 
 
-class OrderList(ListView):
+class OrderList(CachedPageMixin, KeysetPaginationMixin, ListView):
     model = Order
     template_name = "payments/order_list.html"
+    keyset = ("-pk",)
+    cache_name = "order-list"
+
+    def get_cache_scopes(self):
+        return ["orders"]
+
+    def get_queryset(self):
+        return super().get_queryset().with_totals()
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        for order in context["object_list"]:
+            order.items_pricing = calculate_annotated_pricing(order)
+        return context
 
-class OrderDetail(DetailView):
+
+class OrderDetail(CachedPageMixin, DetailView):
     model = Order
     template_name = "payments/order_detail.html"
     pk_url_kwarg = "pk"
+    cache_name = "order-detail"
+
+    def get_cache_scopes(self):
+        return [f"order:{self.kwargs['pk']}"]
+
+    def get_queryset(self):
+        return Order.objects.select_related(
+            "discount", "tax", "shipping"
+        ).prefetch_related("lines__item")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -74,8 +209,26 @@ class OrderSessionCheckout(View):
                 + reverse("payments:order-detail", kwargs={"pk": pk}),
             )
             return JsonResponse({"session_id": checkout_session.id})
+        except LineItemsLimitExceeded as e:
+            return intent_redirect_response(e)
         except Exception as e:
-            return JsonResponse({"message": str(e)}, status=500)
+            return payment_error_response(e)
+
+
+async def order_session_checkout_async(request, pk: int):
+    """Асинхронная версия OrderSessionCheckout (для запуска под ASGI)."""
+    try:
+        checkout_session = await OrderPaymentService.aget_session(
+            pk,
+            success_url=settings.DOMAIN + reverse("payments:buy_success"),
+            cancel_url=settings.DOMAIN
+            + reverse("payments:order-detail", kwargs={"pk": pk}),
+        )
+        return JsonResponse({"session_id": checkout_session.id})
+    except LineItemsLimitExceeded as e:
+        return intent_redirect_response(e)
+    except Exception as e:
+        return payment_error_response(e)
 
 
 class OrderCheckout(DetailView):
@@ -83,16 +236,264 @@ class OrderCheckout(DetailView):
     template_name = "payments/order_checkout.html"
     pk_url_kwarg = "pk"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    def get_queryset(self):
+        return Order.objects.select_related("discount", "tax", "shipping")
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        # Для оплаченного заказа новый PaymentIntent не создается
+        if self.object.status == OrderStatus.PAID:
+            return redirect("payments:buy_success")
         try:
-            intent = OrderPaymentService.get_intent(self.object)
+            attempt = OrderPaymentService.get_intent(self.object)
+        except ValidationError as e:
+            return JsonResponse({"message": " ".join(e.messages)}, status=409)
         except Exception as e:
-            return JsonResponse({"message": str(e)}, status=500)
+            return payment_error_response(e)
+        context = self.get_context_data(
+            object=self.object, clientSecret=attempt.client_secret
+        )
+        return self.render_to_response(context)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
         context["stripe_pk"] = settings.STRIPE_PUBLIC_KEY
-        context["clientSecret"] = intent.client_secret
         return context
 
 
 class SuccessView(TemplateView):
     template_name = "payments/success.html"
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class StripeWebhook(View):
+    """Прием событий stripe: проверка подписи и запись в очередь.
+
+    События применяются к заказам командой process_webhooks.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            WebhookService.receive(
+                request.body, request.META.get("HTTP_STRIPE_SIGNATURE", "")
+            )
+        except (ValueError, stripe.error.SignatureVerificationError) as e:
+            return JsonResponse({"message": str(e)}, status=400)
+        return JsonResponse({"received": True})
+
+
+class MetricsView(View):
+    """Метрики запросов в формате Prometheus (при METRICS_ENABLED)."""
+
+    def get(self, request, *args, **kwargs):
+        if not settings.METRICS_ENABLED:
+            raise Http404
+        return HttpResponse(
+            registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+class JsonApiView(View):
+    """Базовый обработчик JSON API: ошибки возвращаются в JSON."""
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ValidationError as e:
+            return JsonResponse({"message": " ".join(e.messages)}, status=400)
+        except Http404:
+            return JsonResponse({"message": "Not found"}, status=404)
+
+
+class CartView(JsonApiView):
+    """Базовый обработчик JSON API корзины.
+
+    Принимаются только запросы с Content-Type: application/json,
+    поэтому изменить заказ отправкой формы с другого сайта нельзя.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in ("POST", "DELETE") and (
+            request.content_type != "application/json"
+        ):
+            return JsonResponse(
+                {"message": "Content-Type should be application/json"},
+                status=415,
+            )
+        return super().dispatch(request, *args, **kwargs)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CartCreate(CartView):
+    def post(self, request, *args, **kwargs):
+        order = CartService.create(CartService.parse(request.body))
+        return JsonResponse(CartService.serialize(order), status=201)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CartDetail(CartView):
+    def get(self, request, pk: int, *args, **kwargs):
+        order = get_object_or_404(Order, pk=pk)
+        return JsonResponse(CartService.serialize(order))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CartLines(CartView):
+    """Изменение позиций заказа.
+
+    POST {"lines": [{"item": 1, "quantity": 2}, ...], "replace": false}
+    добавляет количество (или заменяет его при "replace": true),
+    DELETE {"items": [1, 2, ...]} удаляет позиции.
+    """
+
+    def post(self, request, pk: int, *args, **kwargs):
+        data = CartService.parse(request.body)
+        order = CartService.update_lines(
+            pk,
+            CartService.parse_lines(data),
+            replace=bool(data.get("replace", False)),
+        )
+        return JsonResponse(CartService.serialize(order))
+
+    def delete(self, request, pk: int, *args, **kwargs):
+        items = CartService.parse(request.body).get("items", [])
+        if not isinstance(items, list):
+            raise ValidationError("items should be a list")
+        quantities = {
+            CartService.parse_id(item_id, "item"): 0 for item_id in items
+        }
+        order = CartService.update_lines(pk, quantities, replace=True)
+        return JsonResponse(CartService.serialize(order))
+
+
+class JsonListView(KeysetPaginationMixin, MultipleObjectMixin, JsonApiView):
+    """Постраничный список объектов в JSON с выбором полей (?fields=)."""
+
+    serializer = None
+
+    def get(self, request, *args, **kwargs):
+        fields = self.serializer.get_fields(request.GET.get("fields"))
+        queryset = self.get_queryset()
+        if "lines" in fields:
+            queryset = queryset.prefetch_related("lines")
+        rows, next_cursor = self.paginate_keyset(queryset)
+        return JsonResponse(
+            {
+                "results": [
+                    self.serializer.serialize(row, fields) for row in rows
+                ],
+                "next": next_cursor,
+            }
+        )
+
+
+class JsonDetailView(SingleObjectMixin, JsonApiView):
+    """Объект в JSON с выбором полей (?fields=)."""
+
+    serializer = None
+    default_fields = None
+
+    def get(self, request, *args, **kwargs):
+        fields = request.GET.get("fields") or ",".join(
+            self.default_fields or self.serializer.default
+        )
+        fields = self.serializer.get_fields(fields)
+        return JsonResponse(
+            self.serializer.serialize(self.get_object(), fields)
+        )
+
+
+class JsonExportView(JsonApiView):
+    """Потоковая выгрузка всех объектов в NDJSON или CSV (?format=).
+
+    Объекты читаются итератором порциями по chunk_size, поэтому память
+    не зависит от количества выгружаемых объектов.
+    """
+
+    model = None
+    serializer = None
+    chunk_size = 2000
+    # Вложенные поля не выгружаются (требуют запроса на каждый объект)
+    exclude_fields = ("lines",)
+    formats = {
+        "ndjson": ("application/x-ndjson", stream_ndjson),
+        "csv": ("text/csv", stream_csv),
+    }
+
+    def get_queryset(self):
+        return self.model.objects.order_by("pk")
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get("format", "ndjson")
+        if export_format not in self.formats:
+            raise ValidationError(f"Unknown format: {export_format}")
+        fields = self.serializer.get_fields(
+            request.GET.get("fields"), exclude=self.exclude_fields
+        )
+        content_type, stream = self.formats[export_format]
+        objects = self.get_queryset().iterator(chunk_size=self.chunk_size)
+        response = StreamingHttpResponse(
+            stream(objects, self.serializer, fields),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{self.model._meta.model_name}s.'
+            f'{export_format}"'
+        )
+        return response
+
+
+class ItemApiList(CachedPageMixin, JsonListView):
+    model = Item
+    serializer = item_serializer
+    keyset = ("name", "pk")
+    cache_name = "api-item-list"
+
+    def get_cache_scopes(self):
+        return ["items"]
+
+
+class ItemApiDetail(CachedPageMixin, JsonDetailView):
+    model = Item
+    serializer = item_serializer
+    cache_name = "api-item-detail"
+
+    def get_cache_scopes(self):
+        return [f"item:{self.kwargs['pk']}"]
+
+
+class ItemApiExport(JsonExportView):
+    model = Item
+    serializer = item_serializer
+
+
+class OrderApiList(CachedPageMixin, JsonListView):
+    model = Order
+    serializer = order_serializer
+    keyset = ("-pk",)
+    cache_name = "api-order-list"
+
+    def get_cache_scopes(self):
+        return ["orders"]
+
+
+class OrderApiDetail(CachedPageMixin, JsonDetailView):
+    model = Order
+    serializer = order_serializer
+    default_fields = order_serializer.default + ("lines",)
+    cache_name = "api-order-detail"
+
+    def get_cache_scopes(self):
+        return [f"order:{self.kwargs['pk']}"]
+
+
+class OrderApiExport(JsonExportView):
+    model = Order
+    serializer = order_serializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.GET.get("status"):
+            queryset = queryset.filter(status=self.request.GET["status"])
+        return queryset
@@ -0,0 +1,193 @@
+import json
+import logging
+import random
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Order,
+    OrderStatus,
+    PaymentAttempt,
+    PaymentStatus,
+    WebhookEvent,
+    WebhookEventStatus,
+)
+from .page_cache import page_cache
+from .session_cache import checkout_session_cache
+
+logger = logging.getLogger("payments.webhooks")
+
+PAYMENT_INTENT_EVENTS = {
+    "payment_intent.succeeded",
+    "payment_intent.processing",
+    "payment_intent.payment_failed",
+    "payment_intent.canceled",
+    "payment_intent.requires_action",
+}
+CHECKOUT_SESSION_EVENTS = {
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+    "checkout.session.expired",
+}
+
+
+class WebhookService:
+    @classmethod
+    def receive(cls, payload: bytes, signature: str) -> dict:
+        """Проверяет подпись события и сохраняет его в очередь обработки.
+
+        Повторно доставленные события (с тем же идентификатором)
+        игнорируются уникальным индексом без дополнительного запроса.
+
+        Args:
+            payload: Тело запроса stripe.
+            signature: Заголовок Stripe-Signature.
+
+        Raises:
+            stripe.error.SignatureVerificationError: Неверная подпись.
+            ValueError: Тело запроса не является событием stripe.
+        """
+        payload = payload.decode("utf-8")
+        stripe.WebhookSignature.verify_header(
+            payload,
+            signature,
+            settings.STRIPE_WEBHOOK_SECRET,
+            settings.STRIPE_WEBHOOK_TOLERANCE,
+        )
+        event = json.loads(payload)
+        if not isinstance(event, dict) or "id" not in event:
+            raise ValueError("Payload is not a stripe event")
+        WebhookEvent.objects.bulk_create(
+            [
+                WebhookEvent(
+                    event_id=event["id"],
+                    type=event.get("type", ""),
+                    payload=payload,
+                )
+            ],
+            ignore_conflicts=True,
+        )
+        return event
+
+    @classmethod
+    def process_batch(cls, batch_size: int = 500) -> int:
+        """Применяет пакет ожидающих событий к заказам и попыткам оплаты.
+
+        Если пакет не удалось применить целиком, события применяются по
+        одному, чтобы ошибочное событие не блокировало остальные.
+        Ошибочные события откладываются до next_attempt_at. Возвращает
+        количество выбранных из очереди событий.
+        """
+        with transaction.atomic():
+            events = list(
+                WebhookEvent.objects.select_for_update(skip_locked=True)
+                .filter(
+                    status=WebhookEventStatus.PENDING,
+                    next_attempt_at__lte=timezone.now(),
+                )
+                .order_by("pk")[:batch_size]
+            )
+            try:
+                with transaction.atomic():
+                    cls.apply([json.loads(event.payload) for event in events])
+                cls.mark_processed(events)
+            except Exception:
+                logger.exception("Webhook batch failed, applying one by one")
+                for event in events:
+                    try:
+                        with transaction.atomic():
+                            cls.apply([json.loads(event.payload)])
+                        cls.mark_processed([event])
+                    except Exception as e:
+                        cls.mark_failed(event, e)
+        return len(events)
+
+    @classmethod
+    def mark_processed(cls, events: list[WebhookEvent]):
+        WebhookEvent.objects.filter(pk__in=[e.pk for e in events]).update(
+            status=WebhookEventStatus.PROCESSED,
+            processed_at=timezone.now(),
+            attempts=F("attempts") + 1,
+            error="",
+        )
+
+    @classmethod
+    def mark_failed(cls, event: WebhookEvent, error: Exception):
+        logger.warning("Webhook event %s failed: %s", event.event_id, error)
+        attempts = event.attempts + 1
+        if attempts >= settings.STRIPE_WEBHOOK_MAX_ATTEMPTS:
+            WebhookEvent.objects.filter(pk=event.pk).update(
+                status=WebhookEventStatus.FAILED,
+                attempts=attempts,
+                error=str(error),
+            )
+            return
+        # Экспоненциальная задержка повтора со случайным разбросом
+        delay = min(
+            settings.STRIPE_WEBHOOK_BACKOFF_BASE * 2 ** (attempts - 1),
+            settings.STRIPE_WEBHOOK_BACKOFF_MAX,
+        )
+        delay *= random.uniform(0.5, 1)
+        WebhookEvent.objects.filter(pk=event.pk).update(
+            attempts=attempts,
+            error=str(error),
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+    @classmethod
+    def apply(cls, events: list[dict]):
+        """Применяет события пакетом: по одному UPDATE на каждый статус.
+
+        Заказы оплаченных PaymentIntent без order_id в metadata
+        определяются одним запросом по попыткам оплаты.
+        """
+        intent_statuses = {}
+        paid_order_ids = set()
+        paid_intent_ids = []
+        for event in sorted(events, key=lambda event: event.get("created", 0)):
+            obj = event.get("data", {}).get("object", {})
+            metadata = obj.get("metadata") or {}
+            if event.get("type") in PAYMENT_INTENT_EVENTS:
+                intent_statuses[obj["id"]] = obj["status"]
+                if obj["status"] == PaymentStatus.SUCCEEDED:
+                    if metadata.get("order_id"):
+                        paid_order_ids.add(metadata["order_id"])
+                    else:
+                        paid_intent_ids.append(obj["id"])
+            elif event.get("type") in CHECKOUT_SESSION_EVENTS:
+                if obj.get("payment_status") == "paid":
+                    paid_order_ids.add(metadata.get("order_id"))
+                # Завершенная сессия не может быть выдана повторно
+                if metadata.get("order_id"):
+                    checkout_session_cache.invalidate(
+                        "order", metadata["order_id"]
+                    )
+                if metadata.get("product_id"):
+                    checkout_session_cache.invalidate(
+                        "item", metadata["product_id"]
+                    )
+
+        intents_by_status = {}
+        for intent_id, status in intent_statuses.items():
+            intents_by_status.setdefault(status, []).append(intent_id)
+        for status, intent_ids in intents_by_status.items():
+            PaymentAttempt.objects.filter(intent_id__in=intent_ids).update(
+                status=status, updated_at=timezone.now()
+            )
+        if paid_intent_ids:
+            paid_order_ids.update(
+                Order.objects.for_payment_intents(paid_intent_ids)
+                .values_list("pk", flat=True)
+                .distinct()
+            )
+        paid_order_ids.discard(None)
+        if paid_order_ids:
+            Order.objects.filter(pk__in=paid_order_ids).exclude(
+                status=OrderStatus.PAID
+            ).update(status=OrderStatus.PAID, paid_at=timezone.now())
+            page_cache.touch_orders(*paid_order_ids)
@@ -3,6 +3,8 @@
 
 python manage.py migrate
 
+python manage.py createcachetable
+
 python manage.py collectstatic --noinput
 
 cp -r /app/collected_static/. /backend_static/
@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "payments.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -43,7 +44,7 @@ ROOT_URLCONF = "stripe_project.urls"
 TEMPLATES_DIR = BASE_DIR / "templates/"
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "payments.metrics.InstrumentedTemplates",
         "DIRS": [
             TEMPLATES_DIR,
         ],
@@ -72,6 +73,25 @@ DATABASES = {
     }
 }
 
+# Для разделения кэша между процессами gunicorn используйте, например,
+# CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache
+# CACHE_LOCATION=django_cache (таблица создается командой createcachetable)
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Время хранения отрисованных страниц каталога и заказов (сек)
+PAGE_CACHE_TIMEOUT = int(os.getenv("PAGE_CACHE_TIMEOUT", 600))
+
+# Метрики запросов: количество и время SQL-запросов, обращений к stripe
+# и отрисовки шаблонов (заголовок Server-Timing и /metrics для Prometheus)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -99,5 +119,107 @@ STATIC_ROOT = BASE_DIR / "collected_static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DEFAULT_CURRENCY = "usd"
+# Валюта расчетов заказов с товарами в разных валютах: суммы товаров
+# и доставки пересчитываются в нее по курсам ExchangeRate, матрица курсов
+# хранится в памяти процесса EXCHANGE_RATES_TTL секунд
+SETTLEMENT_CURRENCY = os.getenv("SETTLEMENT_CURRENCY", DEFAULT_CURRENCY)
+EXCHANGE_RATES_TTL = int(os.getenv("EXCHANGE_RATES_TTL", 300))
+
+# Округление сумм скидки и налога: down (отбрасывание дробной части),
+# half_up, half_even. После изменения итоги заказов пересчитываются
+# командой rebuild_order_totals
+PRICING_ROUNDING = os.getenv("PRICING_ROUNDING", "down")
+
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY", "pk_test_1234")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "sk_test_1234")
+# Платежный шлюз: payments.gateways.StripeGateway (API stripe) или
+# payments.gateways.FakeGateway (в памяти процесса, для нагрузочных тестов)
+PAYMENT_GATEWAY = {
+    "BACKEND": os.getenv(
+        "PAYMENT_GATEWAY_BACKEND", "payments.gateways.StripeGateway"
+    ),
+    "OPTIONS": {},
+}
+if PAYMENT_GATEWAY["BACKEND"] == "payments.gateways.FakeGateway":
+    PAYMENT_GATEWAY["OPTIONS"] = {
+        "latency": float(os.getenv("PAYMENT_GATEWAY_LATENCY", 0)),
+        "jitter": float(os.getenv("PAYMENT_GATEWAY_JITTER", 0)),
+        "error_rate": float(os.getenv("PAYMENT_GATEWAY_ERROR_RATE", 0)),
+    }
+# Секрет подписи событий stripe (whsec_...), допустимое расхождение времени
+# подписи (сек), количество попыток обработки события и задержка повтора
+# (сек)
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "whsec_1234")
+STRIPE_WEBHOOK_TOLERANCE = int(os.getenv("STRIPE_WEBHOOK_TOLERANCE", 300))
+STRIPE_WEBHOOK_MAX_ATTEMPTS = int(os.getenv("STRIPE_WEBHOOK_MAX_ATTEMPTS", 5))
+STRIPE_WEBHOOK_BACKOFF_BASE = float(
+    os.getenv("STRIPE_WEBHOOK_BACKOFF_BASE", 5)
+)
+STRIPE_WEBHOOK_BACKOFF_MAX = float(os.getenv("STRIPE_WEBHOOK_BACKOFF_MAX", 600))
+# Очередь задач синхронизации со stripe: число одновременно выполняемых
+# задач, попыток, задержка повтора (сек) и время до повторного захвата
+# прерванной задачи (сек)
+STRIPE_JOBS = {
+    "CONCURRENCY": int(os.getenv("STRIPE_JOBS_CONCURRENCY", 4)),
+    "MAX_ATTEMPTS": int(os.getenv("STRIPE_JOBS_MAX_ATTEMPTS", 8)),
+    "BACKOFF_BASE": float(os.getenv("STRIPE_JOBS_BACKOFF_BASE", 5)),
+    "BACKOFF_MAX": float(os.getenv("STRIPE_JOBS_BACKOFF_MAX", 600)),
+    "LOCK_TIMEOUT": int(os.getenv("STRIPE_JOBS_LOCK_TIMEOUT", 300)),
+}
+# Пул соединений, таймауты (сек) и повторы запросов к API stripe
+STRIPE_HTTP_CLIENT = {
+    "POOL_SIZE": int(os.getenv("STRIPE_HTTP_POOL_SIZE", 10)),
+    "CONNECT_TIMEOUT": float(os.getenv("STRIPE_CONNECT_TIMEOUT", 5)),
+    "READ_TIMEOUT": float(os.getenv("STRIPE_READ_TIMEOUT", 30)),
+    "MAX_NETWORK_RETRIES": int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", 2)),
+    "INITIAL_RETRY_DELAY": float(os.getenv("STRIPE_INITIAL_RETRY_DELAY", 0.5)),
+    "MAX_RETRY_DELAY": float(os.getenv("STRIPE_MAX_RETRY_DELAY", 5)),
+}
+# Ограничение частоты обращений к stripe (в секунду), общее для процессов
+# (счетчики и пауза после ответа 429 в таблице SharedCounter):
+# доля, доступная фоновой синхронизации, и максимальное ожидание очереди
+# (сек) для оформления заказа и фоновых задач
+STRIPE_RATE_LIMIT = {
+    "ENABLED": os.getenv("STRIPE_RATE_LIMIT_ENABLED", "true").lower()
+    == "true",
+    "RATE": int(os.getenv("STRIPE_RATE_LIMIT", 25)),
+    "BACKGROUND_SHARE": float(
+        os.getenv("STRIPE_RATE_LIMIT_BACKGROUND_SHARE", 0.5)
+    ),
+    "MAX_WAIT": {
+        "checkout": float(os.getenv("STRIPE_RATE_LIMIT_CHECKOUT_WAIT", 5)),
+        "background": float(os.getenv("STRIPE_RATE_LIMIT_BACKGROUND_WAIT", 60)),
+    },
+}
+# Размыкание цепи обращений к stripe при недоступности (общее для процессов:
+# счетчики и время размыкания в таблице SharedCounter): доля
+# ошибок за окно, минимум обращений, время обращения, считающееся ошибкой
+# (сек), окно (сек), время до пробных обращений (сек) и количество
+# одновременных пробных обращений
+STRIPE_CIRCUIT_BREAKER = {
+    "ENABLED": os.getenv("STRIPE_CIRCUIT_BREAKER_ENABLED", "true").lower()
+    == "true",
+    "FAILURE_RATE": float(os.getenv("STRIPE_CIRCUIT_FAILURE_RATE", 0.5)),
+    "MIN_CALLS": int(os.getenv("STRIPE_CIRCUIT_MIN_CALLS", 20)),
+    "SLOW_CALL": float(os.getenv("STRIPE_CIRCUIT_SLOW_CALL", 5)),
+    "WINDOW": int(os.getenv("STRIPE_CIRCUIT_WINDOW", 60)),
+    "OPEN_DURATION": int(os.getenv("STRIPE_CIRCUIT_OPEN_DURATION", 30)),
+    "HALF_OPEN_PROBES": int(os.getenv("STRIPE_CIRCUIT_HALF_OPEN_PROBES", 1)),
+}
+# Срок действия сессии оформления заказа stripe и записи о ней в кэше (сек),
+# stripe допускает значения от 30 минут до 24 часов (меньшие значения
+# ограничивают только время хранения в кэше)
+STRIPE_CHECKOUT_SESSION_TTL = int(
+    os.getenv("STRIPE_CHECKOUT_SESSION_TTL", 30 * 60)
+)
+# Ограничения stripe на позиции сессии оформления заказа: количество
+# позиций и цена единицы. Позиции сверх ограничения объединяются в
+# итоговые строки (summarize) или заказ оплачивается через PaymentIntent
+# (payment_intent)
+STRIPE_CHECKOUT_LINE_ITEMS = {
+    "MAX": int(os.getenv("STRIPE_CHECKOUT_MAX_LINE_ITEMS", 100)),
+    "MAX_UNIT_AMOUNT": int(
+        os.getenv("STRIPE_CHECKOUT_MAX_UNIT_AMOUNT", 99999999)
+    ),
+    "OVERFLOW": os.getenv("STRIPE_CHECKOUT_OVERFLOW", "summarize"),
+}